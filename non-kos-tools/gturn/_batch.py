@@ -0,0 +1,117 @@
+import glob
+import json
+import logging
+import os
+import os.path as pth
+
+import numpy as np
+
+import _surrogate as sg
+import koson as ks
+
+
+def collect_tasks(target):
+    """Collects the tasks of a batch.
+
+    :param target: one of
+        * a directory - every ``input.json`` in its subdirectories (i.e. a
+          master directory of the server mode) and every ``*.json`` file
+          directly in it is a task
+        * a parameter sweep specification - a plain JSON file in the format of
+          the precompute mode; every grid point is a task
+        * a glob pattern or a single file - every matching kOS-JSON input
+          file is a task
+    :return: list of tuples ``(name, source, data)``
+    """
+    if pth.isdir(target):
+        files = sorted(glob.glob(pth.join(target, '*', 'input.json')) +
+                       glob.glob(pth.join(target, '*.json')))
+    elif pth.isfile(target) and _is_sweep(target):
+        with open(target, mode='r') as f:
+            spec = sg.load_spec(f)
+        return [('sweep-' + '-'.join(str(i) for i in index), target, inputs)
+                for index, inputs in sg.grid_points(spec)]
+    else:
+        files = sorted(glob.glob(target))
+    tasks = []
+    names = set()
+    for fname in files:
+        if pth.basename(fname) == 'input.json':
+            name = pth.basename(pth.dirname(fname))
+        else:
+            name = pth.splitext(pth.basename(fname))[0]
+        if name in names:
+            name = pth.splitext(fname)[0].replace(os.sep, '_')
+        names.add(name)
+        with open(fname, mode='r') as f:
+            tasks.append((name, fname, ks.load(f)))
+    return tasks
+
+
+def _is_sweep(fname):
+    try:
+        with open(fname, mode='r') as f:
+            raw = json.load(f)
+    except ValueError:
+        return False
+    return isinstance(raw, dict) and 'axes' in raw
+
+
+def save_results(path, tasks, results, metrics=None):
+    """Saves the results of a batch into a single columnar ``.npz`` file and
+    writes a JSON index next to it (``<path without extension>-index.json``).
+
+    Each result array (``time``, ``mass``, ...) is stored as one column
+    concatenated over all successful tasks; the rows of task ``i`` are
+    ``offset[i]:offset[i] + length[i]``. Scalar inputs of the tasks are stored
+    as columns ``input/<name>`` with one value per task (NaN if missing).
+
+    :param tasks: list of tuples ``(name, source, data)``
+    :param results: list of result dictionaries, or strings with the error
+        descriptions of the failed tasks, in the order of the tasks
+    :param metrics: optional list of dictionaries with the metrics of the
+        tasks (in the order of the tasks), stored in the index
+    """
+    keys = sorted({key for r in results if isinstance(r, dict)
+                   for key in r})
+    offset = np.zeros(len(tasks), dtype=np.int64)
+    length = np.zeros(len(tasks), dtype=np.int64)
+    columns = {key: [] for key in keys}
+    index = []
+    pos = 0
+    for i, ((name, source, _), res) in enumerate(zip(tasks, results)):
+        entry = {'name': name, 'source': source}
+        if isinstance(res, dict):
+            n = len(res[keys[0]])
+            for key in keys:
+                columns[key].append(np.asarray(res[key], dtype=float))
+            offset[i] = pos
+            length[i] = n
+            pos += n
+            entry.update(status='ok', offset=int(pos - n), length=n)
+        else:
+            entry.update(status='error', error=res)
+        if metrics is not None:
+            entry['metrics'] = metrics[i]
+        index.append(entry)
+
+    input_names = sorted({key for _, _, data in tasks for key, value in
+                          data.items() if isinstance(value, (int, float))})
+    data = {'name': np.array([t[0] for t in tasks]),
+            'ok': np.array([e['status'] == 'ok' for e in index]),
+            'offset': offset,
+            'length': length}
+    for key in keys:
+        data[key] = np.concatenate(columns[key])
+    for key in input_names:
+        data['input/' + key] = np.array([float(t[2].get(key, np.nan))
+                                         for t in tasks])
+    with open(path, mode='wb') as f:
+        np.savez(f, **data)
+
+    index_file = pth.splitext(path)[0] + '-index.json'
+    with open(index_file, mode='w') as f:
+        json.dump({'results': path, 'tasks': index}, f, indent=2)
+    logging.info('Saved %d results (%d failed) to %s, index %s', len(tasks),
+                 len(tasks) - int(np.count_nonzero(data['ok'])), path,
+                 index_file)
@@ -0,0 +1,196 @@
+import itertools
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+
+import koson as ks
+
+
+def parse_address(address):
+    """Parses the address of the endpoint.
+
+    :param address: ``HOST:PORT`` for TCP, otherwise the path of a Unix socket
+    :return: tuple of the socket family and the address
+    """
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit() and os.sep not in address:
+        return socket.AF_INET, (host or 'localhost', int(port))
+    return socket.AF_UNIX, address
+
+
+def connect(address, timeout=None):
+    """Connects to an endpoint (see :func:`parse_address`)."""
+    family, addr = parse_address(address)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    sock.connect(addr)
+    if family == socket.AF_INET:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+class Request(object):
+    """A computation request received by the :class:`Endpoint`."""
+
+    def __init__(self, connection, data, rid=None, with_metrics=False):
+        self.connection = connection
+        self.data = data
+        self.id = rid
+        self.with_metrics = with_metrics
+
+    @property
+    def closed(self):
+        """``True`` if the client has disconnected."""
+        return self.connection.closed
+
+    def reply(self, result, metrics=None):
+        """Sends the result (and the metrics if requested) back."""
+        response = dict(result)
+        if self.id is not None:
+            response['id'] = self.id
+        if self.with_metrics and metrics is not None:
+            response['metrics'] = metrics
+        self.connection.send(response)
+
+
+class Connection(object):
+    """A client connection. Reads the requests, one kOS-JSON (or plain JSON)
+    document per line, in its own thread and sends back the responses, one per
+    line, in the order the computations finish.
+    """
+
+    def __init__(self, sock, requests, wake):
+        self.sock = sock
+        self.closed = False
+        self._requests = requests
+        self._wake = wake
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._read, daemon=True)
+        self._thread.start()
+
+    def _read(self):
+        try:
+            with self.sock.makefile('rb') as f:
+                for line in f:
+                    if line.strip():
+                        self._received(line)
+        except OSError:
+            pass
+        finally:
+            self.closed = True
+            self._wake()
+
+    def _received(self, line):
+        detected = time.monotonic()
+        try:
+            data = ks.loads(line.decode('utf-8'))
+            if not isinstance(data, dict):
+                raise ValueError('the request must be a lexicon')
+        except (ValueError, AssertionError) as e:
+            logging.error('Invalid request: %s', e)
+            self.send({'error': 'invalid request: {}'.format(e)})
+            return
+        request = Request(self, data, rid=data.pop('id', None),
+                          with_metrics=bool(data.pop('metrics', False)))
+        self._requests.put((request, {'detected': detected,
+                                      'input_load': time.monotonic() -
+                                      detected}))
+        self._wake()
+
+    def send(self, data):
+        text = ks.dumps(data) + '\n'
+        with self._lock:
+            try:
+                self.sock.sendall(text.encode('utf-8'))
+            except OSError as e:
+                logging.debug('Response could not be sent: %s', e)
+                self.closed = True
+
+    def close(self):
+        self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class Endpoint(object):
+    """Socket endpoint of the server accepting computation requests.
+
+    Every line a client sends is a request with the same content as
+    input.json. Besides the input data it may contain ``id`` (echoed back in
+    the response) and ``metrics`` (if true, the response contains the metrics
+    of the computation). The response is a line with the same content as
+    output.json. A client may send several requests without waiting for the
+    responses.
+
+    The requests are taken by :meth:`requests` (from the thread running the
+    server); ``wake`` is called from the connection threads whenever a request
+    arrives.
+    """
+
+    def __init__(self, address, wake):
+        self.address = address
+        self._wake = wake
+        self._requests = queue.Queue()
+        self._connections = []
+        self._names = itertools.count()
+        family, addr = parse_address(address)
+        if family == socket.AF_UNIX and os.path.exists(addr):
+            # a stale socket of a previous run
+            os.unlink(addr)
+        self._sock = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(addr)
+        self._sock.listen()
+        self._closed = False
+        self._thread = threading.Thread(target=self._accept, daemon=True)
+        self._thread.start()
+
+    def _accept(self):
+        while not self._closed:
+            try:
+                sock, _ = self._sock.accept()
+            except OSError:
+                break
+            if sock.family == socket.AF_INET:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            logging.debug('Accepted a connection to %s', self.address)
+            self._connections = [c for c in self._connections
+                                 if not c.closed]
+            self._connections.append(Connection(sock, self._requests,
+                                                self._wake))
+
+    def requests(self):
+        """Returns the requests received since the last call.
+
+        :return: list of tuples ``(name, request, metrics)`` where the name is
+            unique within the run of the server
+        """
+        res = []
+        while True:
+            try:
+                request, metrics = self._requests.get_nowait()
+            except queue.Empty:
+                return res
+            res.append(('socket-{}'.format(next(self._names)), request,
+                        metrics))
+
+    def close(self):
+        self._closed = True
+        try:
+            # wakes up the accepting thread
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+        for connection in self._connections:
+            connection.close()
+        family, addr = parse_address(self.address)
+        if family == socket.AF_UNIX and os.path.exists(addr):
+            os.unlink(addr)
@@ -0,0 +1,163 @@
+import inspect
+import math
+
+import numpy as np
+
+import _gturn as gt
+import _scheduler as sc
+
+# Inputs of a computation: the required ones (without a default value) and all
+# the accepted ones, see _gturn.compute_gravity_turn()
+_SIGNATURE = inspect.signature(gt.compute_gravity_turn).parameters
+REQUIRED = tuple(name for name, p in _SIGNATURE.items()
+                 if p.default is inspect.Parameter.empty)
+ACCEPTED = frozenset(_SIGNATURE) - {'metrics', 'progress_file', 'start'}
+
+# Inputs which must be positive and finite
+POSITIVE = ('m0', 'm1', 'g0', 'r0', 'Isp0', 'Isp1', 'Fmax', 'H', 'v_obj')
+
+# Relative margin of the ideal delta-v over the lossless requirement below
+# which a task is flagged; the gravity and drag losses of an ascent are
+# typically of this order or more.
+MARGIN = 0.1
+
+
+def _column(inputs, key):
+    """Returns the values of an input of all the tasks, NaN where it is
+    missing or not a number."""
+    res = np.full(len(inputs), np.nan)
+    for i, data in enumerate(inputs):
+        value = data.get(key)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            res[i] = value
+    return res
+
+
+def screen(inputs):
+    """Checks the inputs of many tasks at once for obvious mistakes and for
+    targets which the vehicle cannot reach.
+
+    The checks are analytic and take microseconds per task:
+        * ``inputs`` - missing, unknown or non-numeric inputs
+        * ``values`` - inputs out of their ranges (e.g. m1 >= m0 or a
+          deadline which is not a positive number)
+        * ``twr`` - the thrust to weight ratio at launch Fmax / (m0 * g0) is
+          at most 1, the vehicle cannot lift off
+        * ``delta_v`` - the ideal delta-v ``Isp1 * g0 * ln(m0 / m1)`` is below
+          the speed equivalent to the kinetic and potential energy of the
+          target, which is needed even without any losses
+        * ``delta_v_margin`` (a warning) - the ideal delta-v exceeds it by
+          less than :data:`MARGIN`, likely not enough for the gravity and drag
+          losses
+    The vehicle tests are skipped for the re-planning tasks (with ``state``).
+
+    :param inputs: list of the input data of the tasks
+    :return: list of the issues of every task, each a dictionary of
+        ``check``, ``severity`` (``error`` or ``warning``), ``message`` and,
+        for the vehicle checks, ``value`` and ``limit``
+    """
+    c = {key: _column(inputs, key) for key in REQUIRED + ('deadline',)}
+    finite = {key: np.isfinite(value) for key, value in c.items()}
+    issues = [[] for _ in inputs]
+    for i, data in enumerate(inputs):
+        missing = [key for key in REQUIRED if key not in data]
+        unknown = sorted(key for key in data if key not in ACCEPTED)
+        wrong = [key for key in REQUIRED if key in data and
+                 not finite[key][i]]
+        for problem, keys in (('missing inputs', missing),
+                              ('unknown inputs', unknown),
+                              ('inputs not finite numbers', wrong)):
+            if keys:
+                issues[i].append({'check': 'inputs',
+                                  'severity': 'error',
+                                  'message': '{}: {}'.format(
+                                      problem, ', '.join(keys))})
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        invalid = {
+            'non-positive {}'.format(key): ~(c[key] > 0) for key in POSITIVE}
+        invalid['m1 >= m0'] = ~(c['m1'] < c['m0'])
+        invalid['negative cd, A, rho or h_obj'] = ~(
+            (c['cd'] >= 0) & (c['A'] >= 0) & (c['rho'] >= 0) &
+            (c['h_obj'] >= 0))
+        invalid['q_obj outside [0, pi]'] = ~((c['q_obj'] >= 0) &
+                                             (c['q_obj'] <= math.pi))
+        invalid['deadline not a positive number'] = np.array(
+            ['deadline' in data for data in inputs], dtype=bool) & ~(
+            c['deadline'] > 0)
+
+        twr = c['Fmax'] / (c['m0'] * c['g0'])
+        delta_v = c['Isp1'] * c['g0'] * np.log(c['m0'] / c['m1'])
+        mu = c['g0'] * c['r0'] ** 2
+        needed = np.sqrt(c['v_obj'] ** 2 + 2.0 * mu * (
+            1.0 / c['r0'] - 1.0 / (c['r0'] + c['h_obj'])))
+        vehicle = [
+            ('twr', 'error', twr <= 1.0, twr, 1.0,
+             'thrust to weight ratio at launch {:.3f} is not above {:.3g}'),
+            ('delta_v', 'error', delta_v < needed, delta_v, needed,
+             'ideal delta-v {:.1f} m/s is below {:.1f} m/s needed without '
+             'losses'),
+            ('delta_v_margin', 'warning',
+             (delta_v >= needed) & (delta_v < (1.0 + MARGIN) * needed),
+             delta_v, (1.0 + MARGIN) * needed,
+             'ideal delta-v {:.1f} m/s leaves little for the losses, '
+             '{:.1f} m/s recommended')]
+
+    for i, data in enumerate(inputs):
+        if issues[i]:
+            continue
+        reasons = [reason for reason, mask in invalid.items() if mask[i]]
+        if reasons:
+            issues[i].append({'check': 'values',
+                              'severity': 'error',
+                              'message': 'invalid inputs: {}'.format(
+                                  ', '.join(reasons))})
+            continue
+        if 'state' in data:
+            continue
+        for check, severity, mask, value, limit, message in vehicle:
+            if mask[i]:
+                limit = float(np.broadcast_to(limit, mask.shape)[i])
+                issues[i].append({'check': check,
+                                  'severity': severity,
+                                  'message': message.format(value[i], limit),
+                                  'value': float(value[i]),
+                                  'limit': limit})
+    return issues
+
+
+def check(data):
+    """Checks the inputs of one task, see :func:`screen`."""
+    return screen([data])[0]
+
+
+def options(priority, timeout):
+    """Checks the scheduling options of a task (the entries ``priority``
+    and ``timeout`` of the input data): the priority must be a finite number
+    and the timeout, unless ``None``, a finite number greater than 0.
+
+    :return: list of the issues, see :func:`screen`
+    """
+    invalid = []
+    if not sc.finite(priority):
+        invalid.append('priority not a finite number')
+    if timeout is not None and not (sc.finite(timeout) and timeout > 0):
+        invalid.append('timeout not a positive number')
+    if not invalid:
+        return []
+    return [{'check': 'options',
+             'severity': 'error',
+             'message': 'invalid options: {}'.format(', '.join(invalid))}]
+
+
+def errors(issues):
+    """Returns the issues which reject the task."""
+    return [issue for issue in issues if issue['severity'] == 'error']
+
+
+def error_result(issues):
+    """Returns the result of a rejected task: ``error`` with the messages of
+    the errors and ``feasibility`` with all the issues."""
+    messages = '; '.join(issue['message'] for issue in errors(issues))
+    return {'error': 'infeasible task: {}'.format(messages),
+            'feasibility': issues}
@@ -4,13 +4,1112 @@
 # (c) Mirko Hahn
 # https://mintoc.de/index.php/Gravity_Turn_Maneuver_(Casadi)
 # ----------------------------------------------------------------
+import hashlib
+import json
+import logging
+import os
+import os.path as pth
+import subprocess
+import tempfile
+import time
+
 import casadi as cs
 import numpy
 
+import _progress
+import _solutions
+import _surrogate
+
+# Names of the problem constants (vehicle and body) which are passed to the NLP
+# as parameters, in the order they appear in the parameter vector.
+PARAMETERS = ('m0', 'm1', 'g0', 'r0', 'Isp0', 'Isp1', 'Fmax', 'cd', 'A', 'H',
+              'rho')
+
+INTEGRATOR_OPTIONS = {'nonlinear_solver_iteration': 'functional'}
+SOLVER_OPTIONS = {'ipopt': {'tol': 1e-4,
+                            'print_level': 5,
+                            'max_iter': 500}}
+# Options of the solver used when the initial guess includes the multipliers
+# of a previous solution.
+WARM_SOLVER_OPTIONS = {'ipopt': dict(SOLVER_OPTIONS['ipopt'],
+                                     warm_start_init_point='yes',
+                                     warm_start_bound_push=1e-9,
+                                     warm_start_bound_frac=1e-9,
+                                     warm_start_slack_bound_push=1e-9,
+                                     warm_start_mult_bound_push=1e-9,
+                                     mu_init=1e-4)}
+# IPOPT options of the fallback attempts of a computation with a deadline,
+# see _anytime()
+LOOSE_IPOPT_OPTIONS = {'tol': 1e-2,
+                       'acceptable_tol': 1e-1,
+                       'acceptable_iter': 3}
+
+# Attempts of a computation with a deadline in the order they are tried, each
+# with its share of the time left: the normal computation, a warm restart from
+# the best iterate with the loose tolerance and a coarser grid with the loose
+# tolerance.
+DEADLINE_LADDER = (('full', 0.6), ('loose', 0.5), ('coarse', 1.0))
+# The coarse attempt solves on a grid this many times coarser, of at least
+# DEADLINE_COARSE_N intervals
+DEADLINE_COARSE_FACTOR = 4
+DEADLINE_COARSE_N = 10
+# Time (s) kept before the deadline for publishing the result
+DEADLINE_RESERVE = 0.1
+# An attempt is not started with less time (s) left
+DEADLINE_MIN_ATTEMPT = 0.05
+# Quality of the result of a computation with a deadline, from the best
+QUALITIES = ('optimal', 'suboptimal', 'infeasible')
+
+# Solvers built so far in this process, keyed by the transcription and the
+# number of intervals.
+_solvers = dict()
+
+# Transcription used when a computation does not specify one, see
+# set_transcription()
+_transcription = {'default': 'shooting'}
+
+# Threads evaluating the shooting intervals of one solve, see set_threads()
+_parallel = {'threads': 1}
+
+# Preparation of the solvers for the computations with a deadline, see
+# set_deadlines()
+_deadlines = {'prepare': False}
+
+# Stand-in of the solver for measuring the overhead of the server, see
+# set_stub()
+_stub = {'delay': None}
+
+# On-disk solver cache configuration, see set_solver_cache()
+_cache = {'directory': None,
+          'compile': False,
+          'key': None}
+
+# Bump whenever the layout of the cached artifacts changes.
+_CACHE_FORMAT = 1
+
+# Store of past solutions used for warm starts, see set_solution_store()
+_store = {'store': None}
+
+# Precomputed grid answering the requests, see set_surrogate()
+_surrogate_cfg = {'surrogate': None,
+                  'polish': False}
+
+# Coarse-to-fine mesh continuation configuration, see set_continuation()
+_continuation = {'coarse_N': None,
+                 'factor': 2,
+                 'tol': None}
+
+# Return statuses of solutions good enough to seed other computations.
+_SUCCESS = {'Solve_Succeeded', 'Solved_To_Acceptable_Level'}
+
+# Default initial guesses of the multi-start, see
+# GravityTurnSolver.initial_guess(): the time horizon (s), the constant control
+# and the exponent of the profile of the angle to vertical (below 1 turns
+# early, above 1 turns late). The first one is the default initial guess.
+START_GUESSES = [{'T': 300.0, 'u': 0.5, 'turn': 1.0},
+                 {'T': 200.0, 'u': 0.8, 'turn': 0.5},
+                 {'T': 450.0, 'u': 0.35, 'turn': 2.0},
+                 {'T': 150.0, 'u': 1.0, 'turn': 1.0},
+                 {'T': 250.0, 'u': 0.6, 'turn': 0.5},
+                 {'T': 400.0, 'u': 0.4, 'turn': 1.5}]
+
+
+# noinspection PyPep8Naming
+class GravityTurnSolver(object):
+    """Direct multiple shooting NLP for the gravity turn with a fixed number of
+    shooting intervals.
+
+    All the vehicle and body constants are parameters of the NLP and the target
+    state enters only through the bounds, so one instance can be reused for any
+    input with the same number of shooting intervals.
+    """
+
+    transcription = 'shooting'
+
+    # Useful variable block sizes
+    np = 1  # Number of optimised parameters (time horizon)
+    nx = 5  # Number of states
+    nu = 1  # Number of controls
+    ns = nx + nu  # Number of variables per shooting interval
+
+    def __init__(self, N, solver=None):
+        self.N = N
+        # times (s) it took to obtain the solver
+        self.timings = dict()
+        if solver is None:
+            start = time.perf_counter()
+            nlp = self.build_nlp(N)
+            self.timings['build'] = time.perf_counter() - start
+            start = time.perf_counter()
+            solver = cs.nlpsol('S', 'ipopt', nlp, SOLVER_OPTIONS)
+            self.timings['setup'] = time.perf_counter() - start
+        self.solver = solver
+        self._variants = dict()
+        self._progress = None
+
+    def progress_callback(self):
+        """Returns the progress reporting iteration callback of the solvers
+        of this instance. It is created on first use.
+
+        :rtype: _progress.ProgressCallback
+        """
+        if self._progress is None:
+            self._progress = _progress.ProgressCallback(self.n_variables(),
+                                                        self.n_constraints(),
+                                                        len(PARAMETERS))
+        return self._progress
+
+    def variant(self, warm=False, progress=False, loose=False):
+        """Returns a solver for the same NLP.
+
+        :param warm: if ``True``, the solver also takes the initial guess of
+            the multipliers into account
+        :param progress: if ``True``, the solver reports its progress through
+            :meth:`progress_callback`
+        :param loose: if ``True``, the solver stops at the tolerances of
+            :data:`LOOSE_IPOPT_OPTIONS`
+        """
+        if not warm and not progress and not loose:
+            return self.solver
+        key = (warm, progress, loose)
+        if key not in self._variants:
+            opts = dict(WARM_SOLVER_OPTIONS if warm else SOLVER_OPTIONS)
+            if loose:
+                opts['ipopt'] = dict(opts['ipopt'], **LOOSE_IPOPT_OPTIONS)
+            if progress:
+                opts['iteration_callback'] = self.progress_callback()
+            self._variants[key] = cs.nlpsol('W', 'ipopt',
+                                            self.solver.oracle(), opts)
+        return self._variants[key]
+
+    def prepare_deadline(self):
+        """Creates the variants of the solver used by the computations with
+        a deadline (see :func:`_anytime`), so that creating them does not take
+        from the time of the computation. The time it took is added to
+        :attr:`timings` as ``deadline_setup``."""
+        start = time.perf_counter()
+        for warm in (False, True):
+            for loose in (False, True):
+                self.variant(warm=warm, progress=True, loose=loose)
+        self.timings['deadline_setup'] = time.perf_counter() - start
+
+    @classmethod
+    def dynamics(cls):
+        """Returns the right hand side of the ODE in the normalized time.
+
+        :return: function of the state ``x`` and the parameters
+            ``p = [u, T, c]`` (control, time horizon and the constants in the
+            order of :data:`PARAMETERS`) returning the state derivative
+            ``dx/dtau`` where ``tau = t / T``
+        :rtype: casadi.Function
+        """
+        # Create symbolic variables
+        x = cs.SX.sym('[m, v, q, h, d]', cls.nx)  # Vehicle state
+        u = cs.SX.sym('u')  # Vehicle controls
+        T = cs.SX.sym('T')  # Time horizon (s)
+        c = cs.SX.sym('c', len(PARAMETERS))  # Vehicle and body constants
+        (m0, m1, g0, r0, Isp0, Isp1, Fmax, cd, A, H,
+         rho) = cs.vertsplit(c)
+
+        # Introduce symbolic expressions for important composite terms
+        Fthrust = Fmax * u
+        Fdrag = 0.5 * A * cd * rho * cs.exp(-x[3] / H) * x[1] ** 2
+        r = x[3] + r0
+        g = g0 * (r0 / r) ** 2
+        vhor = x[1] * cs.sin(x[2])
+        vver = x[1] * cs.cos(x[2])
+        Isp = Isp1 + (Isp0 - Isp1) * cs.exp(-x[3] / H)
+
+        # Build symbolic expressions for ODE right hand side
+        mdot = -(Fthrust / (Isp * g0))
+        vdot = (Fthrust - Fdrag) / x[0] - g * cs.cos(x[2])
+        hdot = vver
+        ddot = vhor / r
+        qdot = g * cs.sin(x[2]) / x[1] - ddot
+
+        ode = [
+            mdot,
+            vdot,
+            qdot,
+            hdot,
+            ddot
+        ]
+        p = cs.vertcat(u, T, c)
+        return cs.Function('f', [x, p], [T * cs.vertcat(*ode)], ['x', 'p'],
+                           ['xdot'])
+
+    @classmethod
+    def build_nlp(cls, N):
+        """Builds the symbolic NLP for N shooting intervals.
+
+        :return: NLP dictionary as accepted by ``casadi.nlpsol``
+        """
+        # Build the DAE function
+        f = cls.dynamics()
+        x = cs.SX.sym('x', cls.nx)
+        p = cs.SX.sym('p', cls.nu + 1 + len(PARAMETERS))
+        dae = {'x': x,
+               'p': p,
+               'ode': f(x, p)}
+        opts = dict(INTEGRATOR_OPTIONS, t0=0.0, tf=1.0 / N)
+        I = cs.integrator('I', 'cvodes', dae, opts)
+
+        # Introduce symbolic variables and view the shooting blocks as the
+        # columns of a matrix, so that the graph does not grow with N
+        np, nx, ns = cls.np, cls.nx, cls.ns
+        V = cs.MX.sym('X', N * ns + nx + np)
+        C = cs.MX.sym('C', len(PARAMETERS))
+        P = V[0]
+        blocks = cs.reshape(V[np:np + N * ns], ns, N)
+        X = blocks[:nx, :]
+        U = blocks[nx:, :]
+        X_end = cs.horzcat(X[:, 1:], V[np + N * ns:])
+
+        # Build DMS structure, all the intervals integrated by one call
+        if _parallel['threads'] > 1:
+            F = I.map(N, 'thread', _parallel['threads'])
+        else:
+            F = I.map(N)
+        Y = F(x0=X, p=cs.vertcat(U, cs.repmat(cs.vertcat(P, C), 1, N)))
+        G = cs.vec(Y['xf'] - X_end)
+
+        m0 = C[PARAMETERS.index('m0')]
+        m1 = C[PARAMETERS.index('m1')]
+        return {'x': V, 'p': C, 'f': (m0 - V[-nx]) / (m0 - m1), 'g': G}
+
+    def n_variables(self):
+        """Returns the number of the decision variables."""
+        return self.N * self.ns + self.nx + self.np
+
+    def n_constraints(self):
+        """Returns the number of the nonlinear constraints."""
+        return self.N * self.nx
+
+    def path_bounds(self, m0, m1, vel_eps):
+        """Returns the lower and upper bounds of the states along the
+        trajectory.
+
+        :return: a tuple ``(x_min, x_max)``
+        """
+        x_min = [m1, vel_eps, 0.0, 0.0, 0.0]
+        x_max = [m0, cs.inf, cs.pi, cs.inf, cs.inf]
+        return x_min, x_max
+
+    def bounds(self, m0, m1, h_obj, v_obj, q_obj, vel_eps, state=None):
+        """Returns lower and upper bounds of the decision variables.
+
+        :param state: if given, the initial state ``[m, v, q, h, d]`` is fixed
+            to it (re-planning from the current state of the vehicle),
+            otherwise the vehicle starts from the pad with a free initial
+            angle to vertical
+        :return: a tuple ``(lbx, ubx)``
+        """
+        N = self.N
+        p_min = [0.0]
+        p_max = [600.0]
+
+        u_min = [0.0]
+        u_max = [1.0]
+
+        if state is None:
+            x0_min = [m0, vel_eps, 0.0, 0.0, 0.0]
+            x0_max = [m0, vel_eps, 0.5 * cs.pi, 0.0, 0.0]
+        else:
+            x0_min = x0_max = [float(value) for value in state]
+
+        xf_min = [m1, v_obj, q_obj, h_obj, 0.0]
+        xf_max = [m0, v_obj, q_obj, h_obj, cs.inf]
+
+        x_min, x_max = self.path_bounds(m0, m1, vel_eps)
+
+        lbx = p_min + x0_min + u_min + (N - 1) * (x_min + u_min) + xf_min
+        ubx = p_max + x0_max + u_max + (N - 1) * (x_max + u_max) + xf_max
+        return lbx, ubx
+
+    def initial_guess(self, m0, m1, h_obj, v_obj, q_obj, vel_eps, start=0,
+                      state=None):
+        """Returns the default initial guess: a straight line between the
+        initial and the target state with constant control.
+
+        :param start: index of the guess in :data:`START_GUESSES`; the angle
+            to vertical follows ``frac ** turn`` instead of the straight line
+        :param state: if given, the initial state (see :meth:`bounds`); the
+            time horizon of the guess is shortened by the fraction of the
+            target speed already reached
+        """
+        N = self.N
+        guess = START_GUESSES[start]
+        p_init = [guess['T']]
+        u_init = [guess['u']]
+        x0_init = [m0, vel_eps, 0.05 * cs.pi, 0.0, 0.0]
+        if state is not None:
+            x0_init = [float(value) for value in state]
+            p_init = [guess['T'] * max(0.1, 1.0 - x0_init[1] / v_obj)]
+        xf_init = [m1, v_obj, q_obj, h_obj, 0.0]
+
+        x0_init = numpy.array(x0_init)
+        xf_init = numpy.array(xf_init)
+        frac = numpy.arange(1, N + 1) / N
+        states = x0_init + frac[:, None] * (xf_init - x0_init)
+        states[:, 2] = x0_init[2] + frac ** guess['turn'] * (xf_init[2] -
+                                                             x0_init[2])
+        body = numpy.column_stack((numpy.full((N, self.nu), u_init), states))
+        return numpy.concatenate((p_init, x0_init, body.ravel()))
+
+    def resample(self, x, N):
+        """Interpolates a solution vector for N shooting intervals onto the
+        shooting grid of this solver.
+
+        States are interpolated linearly in the normalized time, controls are
+        taken from the interval containing the midpoint of the new interval.
+        Only the leading shooting blocks of the solution vector (see
+        :meth:`main_part`) are used.
+        """
+        np, nx, ns = self.np, self.nx, self.ns
+        x = self.main_part(x, N)
+        if N == self.N:
+            return x
+        body = x[np:np + N * ns].reshape(N, ns)
+        states = numpy.vstack((body[:, :nx], x[np + N * ns:]))
+        controls = body[:, nx:]
+
+        tau = numpy.linspace(0.0, 1.0, self.N + 1)
+        new_states = numpy.column_stack([
+            numpy.interp(tau, numpy.linspace(0.0, 1.0, N + 1), states[:, j])
+            for j in range(0, nx)])
+        mid = (numpy.arange(self.N) + 0.5) / self.N
+        idx = numpy.minimum((mid * N).astype(int), N - 1)
+        new_controls = controls[idx]
+
+        res = numpy.empty(self.N * ns + nx + np)
+        res[:np] = x[:np]
+        new_body = res[np:np + self.N * ns].reshape(self.N, ns)
+        new_body[:, :nx] = new_states[:-1]
+        new_body[:, nx:] = new_controls
+        res[np + self.N * ns:] = new_states[-1]
+        return res
+
+    def main_part(self, x, N=None):
+        """Returns the leading part of a solution vector for N (by default
+        this solver's number of) shooting intervals which has the layout of
+        multiple shooting: ``[T, x0, u0, x1, u1, ..., xN]``.
+        """
+        if N is None:
+            N = self.N
+        x = numpy.asarray(x, dtype=float).ravel()
+        return x[:N * self.ns + self.nx + self.np]
+
+    def refine(self, seed):
+        """Interpolates a solution for a different number of shooting
+        intervals, including its multipliers, onto the shooting grid of this
+        solver, so that it can be used as a warm start.
+
+        The multipliers of the shooting constraints approximate the costates
+        at the ends of the intervals and are interpolated linearly in the
+        normalized time, the multipliers of the bounds are resampled like the
+        decision variables.
+
+        :param seed: initial guess with multipliers in the form returned by
+            :meth:`_solutions.SolutionStore.nearest`
+        :return: initial guess for this solver in the same form
+        """
+        N, nx = seed['N'], self.nx
+        if N == self.N:
+            return seed
+        lam_g = numpy.asarray(seed['lam_g'], dtype=float)[:N * nx]
+        lam_g = lam_g.reshape(N, nx)
+        tau_old = numpy.arange(1, N + 1) / N
+        tau = numpy.arange(1, self.N + 1) / self.N
+        lam_g = numpy.column_stack([numpy.interp(tau, tau_old, lam_g[:, j])
+                                    for j in range(0, nx)])
+        return {'N': self.N,
+                'x': self.resample(seed['x'], N),
+                'lam_x': self.resample(seed['lam_x'], N),
+                'lam_g': lam_g.ravel()}
+
+    def difference(self, x, seed):
+        """Returns the difference between a solution of this solver and a
+        solution for a different number of shooting intervals: the maximum
+        over the states and the time horizon of the absolute difference
+        relative to the largest magnitude of the state (or the horizon).
+
+        :param x: solution vector of this solver
+        :param seed: the other solution in the form returned by
+            :meth:`_solutions.SolutionStore.nearest`
+        """
+        N, np, nx, ns = self.N, self.np, self.nx, self.ns
+        a = self.main_part(x)
+        b = GravityTurnSolver.resample(self, seed['x'], seed['N'])
+
+        def states(v):
+            return numpy.vstack((v[np:np + N * ns].reshape(N, ns)[:, :nx],
+                                 v[np + N * ns:]))
+        sa = states(a)
+        scale = numpy.maximum(numpy.abs(sa).max(axis=0), 1e-9)
+        return max(abs(a[0] - b[0]) / max(abs(a[0]), 1e-9),
+                   float((numpy.abs(sa - states(b)) / scale).max()))
+
+    def solve(self, m0, m1, g0, r0, Isp0, Isp1, Fmax, cd, A, H, rho, h_obj,
+              v_obj, q_obj, vel_eps=1e-3, seed=None, progress_file=None,
+              start=0, state=None, stop_at=None, loose=False):
+        """Solves the problem for the given input.
+
+        See :func:`compute_gravity_turn` for the meaning of the parameters.
+
+        :param seed: initial guess in the form returned by
+            :meth:`_solutions.SolutionStore.nearest`; if ``None``, the default
+            straight line initial guess is used; if it includes the
+            multipliers and has the same transcription, it is refined onto
+            the grid of this solver (see :meth:`refine`) and used as a warm
+            start
+        :param progress_file: if given, the progress of the solver is reported
+            to this file, see :class:`_progress.ProgressCallback`
+        :param start: index of the default initial guess (see
+            :meth:`initial_guess`) used if there is no seed
+        :param state: if given, the problem is solved from this initial
+            state, see :meth:`bounds`
+        :param stop_at: if given, the time (:func:`time.monotonic`) when the
+            solver is stopped and returns its current iterate
+        :param loose: if ``True``, the loose tolerances are used, see
+            :meth:`variant`
+        :return: a tuple of the CasADi solver output and the solver statistics
+        """
+        lbx, ubx = self.bounds(m0, m1, h_obj, v_obj, q_obj, vel_eps, state)
+        kwargs = dict()
+        warm = False
+        if seed is None:
+            x0 = self.initial_guess(m0, m1, h_obj, v_obj, q_obj, vel_eps,
+                                    start, state)
+        elif (seed.get('lam_x') is not None and
+              seed.get('transcription', 'shooting') == self.transcription):
+            warm = True
+            seed = self.refine(seed)
+            x0 = seed['x']
+            kwargs['lam_x0'] = seed['lam_x']
+            kwargs['lam_g0'] = seed['lam_g']
+        else:
+            x0 = self.resample(seed['x'], seed['N'])
+        progress = progress_file is not None or stop_at is not None
+        S = self.variant(warm=warm, progress=progress, loose=loose)
+        if progress:
+            self.progress_callback().start(progress_file, stop_at=stop_at)
+        try:
+            r = S(x0=x0,
+                  p=[m0, m1, g0, r0, Isp0, Isp1, Fmax, cd, A, H, rho],
+                  lbx=lbx,
+                  ubx=ubx,
+                  lbg=0.0,
+                  ubg=0.0,
+                  **kwargs)
+        except RuntimeError:
+            if progress:
+                self.progress_callback().finish('error')
+            raise
+        stats = S.stats()
+        if progress:
+            self.progress_callback().finish(stats['return_status'])
+        return r, stats
+
+    def extract(self, x):
+        """Extracts state sequences and parameters from a solution vector."""
+        N, np, nx, ns = self.N, self.np, self.nx, self.ns
+        x = self.main_part(x)
+        T = float(x[0])
+
+        t = numpy.linspace(0, T, N + 1)
+        m = numpy.array(x[np::ns]).squeeze()
+        v = numpy.array(x[np + 1::ns]).squeeze()
+        q = numpy.array(x[np + 2::ns]).squeeze()
+        h = numpy.array(x[np + 3::ns]).squeeze()
+        d = numpy.array(x[np + 4::ns]).squeeze()
+        u = numpy.concatenate((numpy.array(x[np + nx::ns]).squeeze(), [0.0]))
+        return {'time': t,
+                'mass': m,
+                'speed': v,
+                'altitude': h,
+                'control': u,
+                'body_curvature': d,
+                'vertical_angle': q}
+
+
+# noinspection PyPep8Naming
+class CollocationSolver(GravityTurnSolver):
+    """Direct collocation NLP for the gravity turn with a fixed number of
+    intervals.
+
+    On every interval the states are approximated by a polynomial of degree
+    :attr:`degree` through the Legendre points and the dynamics are enforced at
+    these points. The dynamics are singular at the start (the initial speed is
+    almost zero), so the first interval is further divided into
+    :attr:`first_subintervals` geometrically growing subintervals.
+
+    The decision vector starts with the same blocks as the one of multiple
+    shooting (``[T, x0, u0, ..., xN]``) followed by the internal states of the
+    intervals: the states at the collocation points and at the inner
+    boundaries of the subintervals, in the order of time. The constraints
+    start with the continuity conditions at the ends of the intervals followed
+    by one condition per internal state. The whole NLP is a single expression
+    graph, so no ODE integration is needed and the solver can be
+    code-generated.
+    """
+
+    transcription = 'collocation'
+    degree = 3
+    scheme = 'legendre'
+    first_subintervals = 16
+
+    @classmethod
+    def subintervals(cls, N):
+        """Returns the boundaries of the subintervals of every interval in the
+        normalized interval time.
+
+        :return: list of N arrays starting with 0 and ending with 1
+        """
+        widths = 2.0 ** numpy.arange(cls.first_subintervals)
+        first = numpy.concatenate(([0.0], numpy.cumsum(widths) / widths.sum()))
+        return [first] + [numpy.array([0.0, 1.0])] * (N - 1)
+
+    @classmethod
+    def internal_times(cls, N):
+        """Returns the normalized times of the internal states of all the
+        intervals, in the order of the decision vector.
+        """
+        tau = numpy.array(cs.collocation_points(cls.degree, cls.scheme))
+        times = []
+        for i, b in enumerate(cls.subintervals(N)):
+            for j in range(0, len(b) - 1):
+                if j > 0:
+                    times.append(i + b[j])
+                times.extend(i + b[j] + tau * (b[j + 1] - b[j]))
+        return numpy.array(times) / N
+
+    @classmethod
+    def build_nlp(cls, N):
+        """Builds the symbolic NLP for N intervals.
+
+        :return: NLP dictionary as accepted by ``casadi.nlpsol``
+        """
+        f = cls.dynamics()
+        d, np, nx, ns = cls.degree, cls.np, cls.nx, cls.ns
+        C, D, _ = cs.collocation_coeff(cs.collocation_points(d, cls.scheme))
+        main = N * ns + nx + np
+        n_internal = len(cls.internal_times(N))
+
+        V = cs.SX.sym('X', main + n_internal * nx)
+        P = cs.SX.sym('C', len(PARAMETERS))
+        T = V[0]
+        X = [V[(np + i * ns):(np + i * ns + nx)] for i in range(0, N + 1)]
+        U = [V[(np + i * ns + nx):(np + (i + 1) * ns)] for i in range(0, N)]
+        Xi = cs.reshape(V[main:], nx, n_internal)
+
+        G = []
+        Gi = []
+        k = 0
+        for i, bounds in enumerate(cls.subintervals(N)):
+            p = cs.vertcat(U[i], T, P)
+            xs = X[i]
+            for j in range(0, len(bounds) - 1):
+                if j > 0:
+                    Gi += [xs - Xi[:, k]]
+                    xs = Xi[:, k]
+                    k += 1
+                h = (bounds[j + 1] - bounds[j]) / N
+                Z = cs.horzcat(xs, Xi[:, k:k + d])
+                xp = cs.mtimes(Z, C)
+                for r in range(0, d):
+                    Gi += [h * f(Xi[:, k + r], p) - xp[:, r]]
+                xs = cs.mtimes(Z, D)
+                k += d
+            G += [xs - X[i + 1]]
+
+        m0 = P[PARAMETERS.index('m0')]
+        m1 = P[PARAMETERS.index('m1')]
+        return {'x': V, 'p': P, 'f': (m0 - X[-1][0]) / (m0 - m1),
+                'g': cs.vertcat(*(G + Gi))}
+
+    def n_variables(self):
+        return (GravityTurnSolver.n_variables(self) +
+                len(self.internal_times(self.N)) * self.nx)
+
+    def n_constraints(self):
+        return (GravityTurnSolver.n_constraints(self) +
+                len(self.internal_times(self.N)) * self.nx)
+
+    def _internal_states(self, x):
+        """Interpolates the internal states linearly from the states at the
+        ends of the intervals.
+        """
+        N, np, nx, ns = self.N, self.np, self.nx, self.ns
+        states = numpy.vstack((x[np:np + N * ns].reshape(N, ns)[:, :nx],
+                               x[np + N * ns:]))
+        nodes = numpy.linspace(0.0, 1.0, N + 1)
+        times = self.internal_times(N)
+        return numpy.column_stack([numpy.interp(times, nodes, states[:, j])
+                                   for j in range(0, nx)]).ravel()
+
+    def bounds(self, m0, m1, h_obj, v_obj, q_obj, vel_eps, state=None):
+        lbx, ubx = GravityTurnSolver.bounds(self, m0, m1, h_obj, v_obj, q_obj,
+                                            vel_eps, state)
+        x_min, x_max = self.path_bounds(m0, m1, vel_eps)
+        n = len(self.internal_times(self.N))
+        return lbx + n * x_min, ubx + n * x_max
+
+    def initial_guess(self, m0, m1, h_obj, v_obj, q_obj, vel_eps, start=0,
+                      state=None):
+        x = numpy.array(GravityTurnSolver.initial_guess(
+            self, m0, m1, h_obj, v_obj, q_obj, vel_eps, start, state))
+        return numpy.concatenate((x, self._internal_states(x)))
+
+    def resample(self, x, N):
+        """Interpolates a solution vector for N intervals (of any
+        transcription) onto the grid of this solver. The internal states are
+        interpolated from the states at the ends of the intervals.
+        """
+        x = GravityTurnSolver.resample(self, x, N)
+        return numpy.concatenate((x, self._internal_states(x)))
+
+    def refine(self, seed):
+        N, nx = seed['N'], self.nx
+        if N == self.N:
+            return seed
+        res = GravityTurnSolver.refine(self, seed)
+        lam = numpy.asarray(seed['lam_g'], dtype=float)[N * nx:]
+        lam = lam.reshape(-1, nx)
+        old = self.internal_times(N)
+        new = self.internal_times(self.N)
+        lam = numpy.column_stack([numpy.interp(new, old, lam[:, j])
+                                  for j in range(0, nx)])
+        res['lam_g'] = numpy.concatenate((res['lam_g'], lam.ravel()))
+        return res
+
+
+# Available transcriptions of the problem
+TRANSCRIPTIONS = {GravityTurnSolver.transcription: GravityTurnSolver,
+                  CollocationSolver.transcription: CollocationSolver}
+
+
+def set_solver_cache(directory, compile=False):
+    """Configures the on-disk solver cache.
+
+    :param directory: directory where the solver artifacts are stored; if
+        ``None``, the on-disk cache is disabled
+    :param compile: if ``True``, newly built solvers are also code-generated
+        and compiled into a shared library (requires a C compiler, see the
+        ``CC`` environment variable); solvers which cannot be code-generated
+        are only serialized
+    """
+    if directory is not None:
+        os.makedirs(directory, exist_ok=True)
+    _cache['directory'] = directory
+    _cache['compile'] = compile
+
+
+def load_solver_cache():
+    """Loads all the up-to-date solvers from the on-disk cache into memory and
+    removes the stale ones.
+
+    :return: list of tuples ``(transcription, N)`` of the loaded solvers
+    """
+    directory = _cache['directory']
+    if directory is None:
+        return []
+    prefix = 'gturn-{}-'.format(solver_key())
+    loaded = []
+    for fname in sorted(os.listdir(directory)):
+        if not fname.startswith('gturn-'):
+            continue
+        if not fname.startswith(prefix):
+            logging.debug('Removing stale solver artifact %s', fname)
+            _remove(pth.join(directory, fname))
+            continue
+        transcription, _, N = pth.splitext(fname[len(prefix):])[0].rpartition(
+            '-N')
+        N, _, threads = N.partition('-T')
+        try:
+            N = int(N)
+            threads = int(threads or 1)
+        except ValueError:
+            continue
+        if threads != _parallel['threads']:
+            continue
+        key = (transcription, N)
+        if transcription in TRANSCRIPTIONS and key not in _solvers:
+            solver = _load_solver(transcription, N)
+            if solver is not None:
+                _solvers[key] = solver
+                loaded.append(key)
+    return loaded
+
+
+def solver_key():
+    """Returns a hash identifying the structure of the built solvers.
+
+    Everything except the transcription and the number of intervals that
+    influences the built solver is part of the key (options, CasADi version
+    and the source of this module), so any change makes the cached artifacts
+    stale.
+    """
+    if _cache['key'] is not None:
+        return _cache['key']
+    with open(__file__, mode='rb') as f:
+        source = hashlib.sha1(f.read()).hexdigest()
+    structure = {'format': _CACHE_FORMAT,
+                 'casadi': cs.__version__,
+                 'integrator': INTEGRATOR_OPTIONS,
+                 'solver': SOLVER_OPTIONS,
+                 'source': source}
+    data = json.dumps(structure, sort_keys=True).encode('utf-8')
+    _cache['key'] = hashlib.sha1(data).hexdigest()[:16]
+    return _cache['key']
+
+
+def _artifact(transcription, N, ext):
+    threads = _parallel['threads']
+    name = 'gturn-{}-{}-N{}{}{}'.format(
+        solver_key(), transcription, N,
+        '-T{}'.format(threads) if threads > 1 else '', ext)
+    return pth.join(_cache['directory'], name)
+
+
+def _remove(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def _load_solver(transcription, N):
+    """Loads the solver for N intervals from the on-disk cache.
+
+    :return: the solver or ``None`` if there is no usable artifact
+    """
+    cls = TRANSCRIPTIONS[transcription]
+    lib = _artifact(transcription, N, '.so')
+    ser = _artifact(transcription, N, '.casadi')
+    start = time.perf_counter()
+    try:
+        if pth.isfile(lib):
+            logging.debug('Loading compiled solver %s', lib)
+            solver = cls(N, cs.nlpsol('S', 'ipopt', lib, SOLVER_OPTIONS))
+        elif pth.isfile(ser):
+            logging.debug('Loading serialized solver %s', ser)
+            solver = cls(N, cs.Function.load(ser))
+        else:
+            return None
+        solver.timings['load'] = time.perf_counter() - start
+        return solver
+    except RuntimeError:
+        logging.warning('Solver artifact for N=%d is corrupt, rebuilding.', N)
+        _remove(lib)
+        _remove(ser)
+    return None
+
+
+def _store_solver(solver):
+    """Stores the solver into the on-disk cache.
+
+    The artifacts are written under temporary names and then renamed so that
+    concurrently starting workers never see a partially written file.
+    """
+    directory = _cache['directory']
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    os.close(fd)
+    try:
+        solver.solver.save(tmp)
+        os.replace(tmp, _artifact(solver.transcription, solver.N, '.casadi'))
+    finally:
+        _remove(tmp)
+    if _cache['compile']:
+        _compile_solver(solver)
+
+
+def _compile_solver(solver):
+    """Generates C code of the NLP functions of the solver and compiles it into
+    a shared library loadable by ``casadi.nlpsol``.
+    """
+    directory = _cache['directory']
+    S = solver.solver
+    nlp = solver.build_nlp(solver.N)
+    workdir = tempfile.mkdtemp(dir=directory, suffix='.tmp')
+    cfile = pth.join(workdir, 'nlp.c')
+    lib = pth.join(workdir, 'nlp.so')
+    try:
+        cg = cs.CodeGenerator('nlp.c')
+        cg.add(cs.Function('nlp', [nlp['x'], nlp['p']], [nlp['f'], nlp['g']],
+                           ['x', 'p'], ['f', 'g']))
+        for name in S.get_function():
+            cg.add(S.get_function(name))
+        cg.generate(workdir + os.sep)
+        cc = os.environ.get('CC', 'cc')
+        subprocess.run([cc, '-O1', '-fPIC', '-shared', cfile, '-o', lib],
+                       check=True, stdout=subprocess.PIPE,
+                       stderr=subprocess.PIPE)
+        os.replace(lib, _artifact(solver.transcription, solver.N, '.so'))
+    except (RuntimeError, OSError, subprocess.CalledProcessError) as e:
+        logging.info('Solver for N=%d could not be compiled, keeping the '
+                     'serialized form only (%s).', solver.N,
+                     str(e).splitlines()[0] if str(e) else type(e).__name__)
+    finally:
+        for fname in os.listdir(workdir):
+            _remove(pth.join(workdir, fname))
+        os.rmdir(workdir)
+
+
+def set_solution_store(directory, max_distance=1.0):
+    """Configures the store of past solutions used to warm-start the
+    computations.
+
+    :param directory: directory of the store; if ``None``, the store is
+        disabled and every computation starts from the default initial guess
+    :param max_distance: see :class:`_solutions.SolutionStore`
+    """
+    if directory is None:
+        _store['store'] = None
+    else:
+        _store['store'] = _solutions.SolutionStore(directory, max_distance)
+
+
+def set_surrogate(path, polish=False):
+    """Configures the precomputed grid used to answer the requests without
+    solving the NLP.
+
+    :param path: grid file created by the precompute mode; if ``None``, every
+        request is solved
+    :param polish: if ``True``, the interpolated profile is only used as the
+        initial guess of a regular computation
+    """
+    if path is None:
+        _surrogate_cfg['surrogate'] = None
+    else:
+        _surrogate_cfg['surrogate'] = _surrogate.Surrogate(path)
+    _surrogate_cfg['polish'] = polish
+
+
+def set_continuation(coarse_N, factor=2, tol=None):
+    """Configures the coarse-to-fine mesh continuation.
+
+    Computations which have no better initial guess than the default one are
+    first solved with ``coarse_N`` shooting intervals. The solution, including
+    the multipliers, is then interpolated onto a grid ``factor`` times finer
+    and solved again as a warm start, until the requested number of shooting
+    intervals is reached.
+
+    :param coarse_N: number of shooting intervals of the coarsest grid; if
+        ``None``, computations are solved directly on the requested grid
+    :param factor: refinement factor between consecutive grids
+    :param tol: if given, the refinement stops as soon as the solutions on two
+        consecutive grids differ by less than this (see
+        :meth:`GravityTurnSolver.difference`) and the solution on the finer of
+        them is the result
+    """
+    if coarse_N is not None and coarse_N < 1:
+        raise ValueError('Coarsest grid must have at least 1 interval.')
+    if factor < 2:
+        raise ValueError('Refinement factor must be at least 2.')
+    if tol is not None and not 0 < tol < float('inf'):
+        raise ValueError('Tolerance must be a finite number greater than 0.')
+    _continuation['coarse_N'] = coarse_N
+    _continuation['factor'] = factor
+    _continuation['tol'] = tol
+
+
+def mesh_levels(N):
+    """Returns the numbers of shooting intervals of the grids the mesh
+    continuation solves on to reach N shooting intervals.
+    """
+    coarse_N = _continuation['coarse_N']
+    if coarse_N is None or coarse_N >= N:
+        return [N]
+    levels = []
+    n = coarse_N
+    while n < N:
+        levels.append(n)
+        n *= _continuation['factor']
+    return levels + [N]
+
+
+def seed_from_result(result):
+    """Converts a dictionary with results to an initial guess accepted by
+    :meth:`GravityTurnSolver.solve`.
+    """
+    N = len(result['time']) - 1
+    x = numpy.empty(N * GravityTurnSolver.ns + GravityTurnSolver.nx +
+                    GravityTurnSolver.np)
+    x[0] = result['time'][-1]
+    states = numpy.column_stack([result[key] for key in
+                                 ('mass', 'speed', 'vertical_angle',
+                                  'altitude', 'body_curvature')])
+    body = x[1:1 + N * GravityTurnSolver.ns].reshape(N, GravityTurnSolver.ns)
+    body[:, :GravityTurnSolver.nx] = states[:-1]
+    body[:, GravityTurnSolver.nx] = result['control'][:-1]
+    x[1 + N * GravityTurnSolver.ns:] = states[-1]
+    return {'N': N, 'x': x, 'lam_x': None, 'lam_g': None}
+
+
+def shift_result(previous, elapsed, state):
+    """Shifts a previously computed result in time, so that it starts at the
+    given time with the given state. Used as the initial guess of the
+    re-planning.
+
+    :param previous: a dictionary with results (see
+        :meth:`GravityTurnSolver.extract`), possibly resampled; the members
+        which are not profiles sampled at its times (e.g. ``quality`` and
+        ``tables`` of a published output) are left out
+    :param elapsed: time (s) since the start of the previous result
+    :param state: the current state ``[m, v, q, h, d]``
+    :return: the remaining part of the result with the same number of samples
+        and the time starting at zero, or ``None`` if the previous result
+        already ended
+    """
+    t = numpy.asarray(previous['time'], dtype=float)
+    if elapsed >= t[-1]:
+        return None
+    tau = numpy.linspace(max(elapsed, 0.0), t[-1], len(t))
+    res = {key: numpy.interp(tau, t, numpy.asarray(value, dtype=float))
+           for key, value in previous.items()
+           if not isinstance(value, (str, dict)) and
+           numpy.shape(value) == t.shape}
+    res['time'] = tau - tau[0]
+    for key, value in zip(('mass', 'speed', 'vertical_angle', 'altitude',
+                           'body_curvature'), state):
+        res[key][0] = value
+    return res
+
+
+def set_threads(threads):
+    """Sets the number of threads evaluating the shooting intervals (the
+    integrations and their sensitivities) of one solve of the multiple
+    shooting transcription. The solvers built before are dropped.
+
+    :param threads: number of threads, 1 evaluates the intervals serially
+    """
+    if threads < 1:
+        raise ValueError('Number of threads must be at least 1')
+    if threads != _parallel['threads']:
+        _parallel['threads'] = threads
+        _solvers.clear()
+
+
+def set_deadlines(prepare=False):
+    """Configures the solvers for the computations with a deadline.
+
+    :param prepare: if ``True``, the solvers obtained by :func:`get_solver`
+        from now on are prepared for them (see
+        :meth:`GravityTurnSolver.prepare_deadline`); otherwise the first
+        computation with a deadline of every number of intervals creates the
+        variants it uses and may overrun the deadline by the time it takes
+    """
+    _deadlines['prepare'] = prepare
+
+
+def set_stub(delay=None):
+    """Replaces the solver by a stub, so that the overhead of the server
+    (scheduling, input and output) can be measured without the solver.
+
+    :param delay: time (s) every computation takes (sleeping) before it
+        returns the straight line between the initial and the target state;
+        if ``None``, the computations are solved normally
+    """
+    _stub['delay'] = delay
+
+
+def _stub_result(m0, m1, h_obj, v_obj, q_obj, N, vel_eps, metrics):
+    """Returns the result of a stubbed computation, see :func:`set_stub`."""
+    time.sleep(_stub['delay'])
+    frac = numpy.linspace(0.0, 1.0, N + 1)
+    guess = START_GUESSES[0]
+    control = numpy.full(N + 1, guess['u'])
+    control[-1] = 0.0
+    metrics['strategy'] = 'stub'
+    metrics['converged'] = True
+    metrics['objective'] = 1.0
+    return {'time': guess['T'] * frac,
+            'mass': m0 + frac * (m1 - m0),
+            'speed': vel_eps + frac * (v_obj - vel_eps),
+            'altitude': frac * h_obj,
+            'control': control,
+            'body_curvature': numpy.zeros(N + 1),
+            'vertical_angle': 0.05 * cs.pi + frac * (q_obj - 0.05 * cs.pi)}
+
+
+def set_transcription(transcription):
+    """Sets the transcription used by the computations which do not specify
+    one.
+
+    :param transcription: one of :data:`TRANSCRIPTIONS`
+    """
+    if transcription not in TRANSCRIPTIONS:
+        raise ValueError('Unknown transcription {}'.format(transcription))
+    _transcription['default'] = transcription
+
+
+def get_solver(N, metrics=None, transcription='shooting'):
+    """Returns a solver for N intervals of the given transcription.
+
+    The solver is taken from memory, then from the on-disk cache (if
+    configured) and built only if neither has it. In the latter case it is also
+    stored into the on-disk cache. It is then reused for all the following
+    requests with the same N in this process.
+
+    :param metrics: if given, a dictionary which is updated with the source of
+        the solver (``solver_source``: ``memory``, ``disk`` or ``built``) and
+        the times spent on obtaining it (``build``, ``setup``, ``load``)
+    :rtype: GravityTurnSolver
+    """
+    if metrics is None:
+        metrics = dict()
+    key = (transcription, N)
+    try:
+        solver = _solvers[key]
+        metrics['solver_source'] = 'memory'
+        return solver
+    except KeyError:
+        pass
+    solver = None
+    if _cache['directory'] is not None:
+        solver = _load_solver(transcription, N)
+        metrics['solver_source'] = 'disk'
+    if solver is None:
+        solver = TRANSCRIPTIONS[transcription](N)
+        metrics['solver_source'] = 'built'
+        if _cache['directory'] is not None:
+            _store_solver(solver)
+    if _deadlines['prepare']:
+        solver.prepare_deadline()
+    metrics.update(solver.timings)
+    _solvers[key] = solver
+    return solver
+
+
+def solver_metrics(stats):
+    """Extracts the interesting numbers from the statistics of a CasADi
+    solver.
+
+    :param stats: result of ``Function.stats()`` of an IPOPT solver
+    :return: dictionary with the return status, iteration count, wall-clock and
+        CPU time of the solver and the numbers of calls and wall-clock times
+        of the NLP function evaluations
+    """
+    res = {'status': stats.get('return_status'),
+           'iterations': stats.get('iter_count'),
+           'wall': stats.get('t_wall_total'),
+           'cpu': stats.get('t_proc_total'),
+           'evaluations': dict(),
+           'evaluation_wall': dict()}
+    for key, value in stats.items():
+        if key.startswith('n_call_') and key != 'n_call_total':
+            res['evaluations'][key[len('n_call_'):]] = value
+        elif key.startswith('t_wall_') and key != 't_wall_total':
+            res['evaluation_wall'][key[len('t_wall_'):]] = value
+    return res
+
 
 # noinspection PyPep8Naming
 def compute_gravity_turn(m0, m1, g0, r0, Isp0, Isp1, Fmax, cd, A, H, rho, h_obj,
-                         v_obj, q_obj, N=300, vel_eps=1e-3):
+                         v_obj, q_obj, N=300, vel_eps=1e-3, metrics=None,
+                         progress_file=None, transcription=None, start=0,
+                         state=None, previous=None, elapsed=0.0,
+                         deadline=None):
     """Computes gravity turn profile
 
     :param m0: wet (launch) mass (kg)
@@ -30,132 +1129,267 @@ def compute_gravity_turn(m0, m1, g0, r0, Isp0, Isp1, Fmax, cd, A, H, rho, h_obj,
     :param N: number of shooting interval
     :param vel_eps: initial velocity (must be nonzero, e.g. a very small number)
         (m * s^-1)
-    :return: a dictionary with results
-    """
-    # Create symbolic variables
-    x = cs.SX.sym('[m, v, q, h, d]')  # Vehicle state
-    u = cs.SX.sym('u')  # Vehicle controls
-    T = cs.SX.sym('T')  # Time horizon (s)
-
-    # Introduce symbolic expressions for important composite terms
-    Fthrust = Fmax * u
-    Fdrag = 0.5 * A * cd * rho * cs.exp(-x[3] / H) * x[1] ** 2
-    r = x[3] + r0
-    g = g0 * (r0 / r) ** 2
-    vhor = x[1] * cs.sin(x[2])
-    vver = x[1] * cs.cos(x[2])
-    Isp = Isp1 + (Isp0 - Isp1) * cs.exp(-x[3] / H)
-
-    # Build symbolic expressions for ODE right hand side
-    mdot = -(Fthrust / (Isp * g0))
-    vdot = (Fthrust - Fdrag) / x[0] - g * cs.cos(x[2])
-    hdot = vver
-    ddot = vhor / r
-    qdot = g * cs.sin(x[2]) / x[1] - ddot
-
-    # Build the DAE function
-    ode = [
-        mdot,
-        vdot,
-        qdot,
-        hdot,
-        ddot
-    ]
-    quad = u
-    dae = {'x': x,
-           'p': cs.vertcat(u, T),
-           'ode': T * cs.vertcat(*ode),
-           'quad': T * quad}
-    I = cs.integrator('I', 'cvodes', dae,
-                      {'t0': 0.0,
-                       'tf': 1.0 / N,
-                       'nonlinear_solver_iteration': 'functional'
-                       })
-
-    # Specify upper and lower bounds as well as initial values for DAE
-    # parameters, states and controls
-    p_min = [0.0]
-    p_max = [600.0]
-    p_init = [300.0]
-
-    u_min = [0.0]
-    u_max = [1.0]
-    u_init = [0.5]
-
-    x0_min = [m0, vel_eps, 0.0, 0.0, 0.0]
-    x0_max = [m0, vel_eps, 0.5 * cs.pi, 0.0, 0.0]
-    x0_init = [m0, vel_eps, 0.05 * cs.pi, 0.0, 0.0]
-
-    xf_min = [m1, v_obj, q_obj, h_obj, 0.0]
-    xf_max = [m0, v_obj, q_obj, h_obj, cs.inf]
-    xf_init = [m1, v_obj, q_obj, h_obj, 0.0]
-
-    x_min = [m1, vel_eps, 0.0, 0.0, 0.0]
-    x_max = [m0, cs.inf, cs.pi, cs.inf, cs.inf]
-    x_init = [0.5 * (m0 + m1), 0.5 * v_obj, 0.5 * q_obj, 0.5 * h_obj, 0.0]
+    :param metrics: if given, a dictionary which is filled with the metrics of
+        the computation: how it was computed (``strategy``), the source of the
+        solver and the time it took to obtain it (see :func:`get_solver`) and
+        the solver statistics (``ipopt``, see :func:`solver_metrics`)
+    :param progress_file: if given, the progress of the solver is reported to
+        this file while it runs, see :class:`_progress.ProgressCallback`
+    :param transcription: transcription of the problem, one of
+        :data:`TRANSCRIPTIONS`: ``shooting`` (multiple shooting with the CVODES
+        integrator) or ``collocation`` (direct collocation, see
+        :class:`CollocationSolver`); if ``None``, the default one (see
+        :func:`set_transcription`) is used
+    :param start: index of the default initial guess in
+        :data:`START_GUESSES`; computations from other than the first one
+        (i.e. the alternative starts of a multi-start) are always solved from
+        it, ignoring the surrogate and the solution store
+    :param state: if given, the current state ``[m, v, q, h, d]`` of the
+        vehicle in flight and the remaining trajectory is re-planned from it
+        (m0 is still the launch mass); the surrogate, the solution store and
+        the mesh continuation are not used and the times of the result are
+        relative to the moment of the state
+    :param previous: the previous (e.g. the last published) result of the
+        flight, shifted in time (see :func:`shift_result`) to be the initial
+        guess of the re-planning
+    :param elapsed: time (s) since the start of the previous result
+    :param deadline: if given, the time (:func:`time.time`) by which the
+        computation returns; the solver is stopped in time and the fallbacks
+        of :data:`DEADLINE_LADDER` are tried, see :func:`_anytime`
+    :return: a dictionary with results; if the mesh continuation (see
+        :func:`set_continuation`) converged before reaching N or a coarser
+        fallback was taken, the result has the resolution of that grid
+    """
+    if metrics is None:
+        metrics = dict()
+    if transcription is None:
+        transcription = _transcription['default']
+    if transcription not in TRANSCRIPTIONS:
+        raise ValueError('Unknown transcription {}'.format(transcription))
+    metrics['transcription'] = transcription
+    if start:
+        metrics['start'] = start
+    inputs = dict(m0=m0, m1=m1, g0=g0, r0=r0, Isp0=Isp0, Isp1=Isp1, Fmax=Fmax,
+                  cd=cd, A=A, H=H, rho=rho, h_obj=h_obj, v_obj=v_obj,
+                  q_obj=q_obj)
+    if _stub['delay'] is not None:
+        return _stub_result(m0, m1, h_obj, v_obj, q_obj, N, vel_eps, metrics)
+    end = stop_at = None
+    if deadline is not None:
+        end = time.monotonic() + deadline - time.time() - DEADLINE_RESERVE
+        stop_at = time.monotonic() + DEADLINE_LADDER[0][1] * (
+            end - time.monotonic())
+    if state is not None:
+        return _replan(inputs, N, vel_eps, metrics, progress_file,
+                       transcription, start, state, previous, elapsed, end,
+                       stop_at)
+    surrogate = _surrogate_cfg['surrogate']
+    seed = None
+    if surrogate is not None and not start:
+        approx = surrogate.evaluate(dict(inputs, vel_eps=vel_eps), N,
+                                    transcription)
+        if approx is not None:
+            if not _surrogate_cfg['polish']:
+                print('RESULT: Surrogate')
+                metrics['strategy'] = 'surrogate'
+                return approx
+            print('SURROGATE: polishing interpolated profile')
+            metrics['strategy'] = 'polish'
+            seed = seed_from_result(approx)
+
+    store = _store['store']
+    if store is not None and seed is None and not start:
+        seed = store.nearest(inputs)
+        if seed is not None:
+            print('WARM START: N={} distance={}'.format(seed['N'],
+                                                        seed['distance']))
+            metrics['strategy'] = 'warm'
+            metrics['warm_start_distance'] = seed['distance']
+    levels = [N]
+    if seed is None:
+        levels = mesh_levels(N)
+        if len(levels) > 1:
+            metrics['strategy'] = 'continuation'
+            metrics['mesh'] = []
+    metrics.setdefault('strategy', 'cold')
+    first = 'full'
+
+    for i, n in enumerate(levels):
+        if i + 1 < len(levels):
+            level_metrics = {'N': n}
+            metrics['mesh'].append(level_metrics)
+        else:
+            level_metrics = metrics
+        solver = get_solver(n, level_metrics, transcription)
+        r, stats = solver.solve(vel_eps=vel_eps, seed=seed,
+                                progress_file=progress_file, start=start,
+                                stop_at=stop_at, **inputs)
+        level_metrics['ipopt'] = solver_metrics(stats)
+        if i + 1 == len(levels):
+            break
+        print('MESH: N={} {} after {} iterations'.format(
+            n, stats['return_status'], stats['iter_count']))
+        if stop_at is not None and time.monotonic() >= stop_at:
+            # out of time, the fallbacks start from this iterate
+            first = 'continuation'
+            break
+        if stats['return_status'] not in _SUCCESS:
+            # continue on the target grid from the default initial guess
+            seed = None
+            levels[i + 1:] = [N]
+            continue
+        x = r['x'].full().ravel()
+        if seed is not None and _continuation['tol'] is not None:
+            difference = solver.difference(x, seed)
+            level_metrics['difference'] = difference
+            if difference < _continuation['tol']:
+                print('MESH: converged at N={} (difference {})'.format(
+                    n, difference))
+                metrics.update(level_metrics)
+                metrics['mesh'].pop()
+                N = n
+                break
+        seed = {'N': n, 'x': x, 'lam_x': r['lam_x'].full().ravel(),
+                'lam_g': r['lam_g'].full().ravel(),
+                'transcription': transcription}
+    optimal = True
+    if end is not None:
+        best = _anytime(inputs, N, vel_eps, metrics, transcription, start,
+                        None, end, solver, r, stats, first=first)
+        if best is None:
+            return None
+        solver, r, stats = best
+        optimal = metrics['quality'] == 'optimal'
+    print('RESULT: {}'.format(stats['return_status']))
+    metrics['converged'] = stats['return_status'] in _SUCCESS
+    metrics['objective'] = float(r['f'])
+    if stats['return_status'] in {'Invalid_Number_Detected'}:
+        return None
+    if store is not None and stats['return_status'] in _SUCCESS and optimal:
+        store.add(inputs, solver.N, r['x'], r['lam_x'], r['lam_g'],
+                  transcription=transcription)
+    return solver.extract(r['x'])
+
+
+def _violation(r):
+    """Returns the maximum violation of the constraints (all equalities) of
+    a solver output."""
+    g = r['g'].full().ravel()
+    return float(numpy.abs(g).max()) if g.size else 0.0
+
+
+def _anytime(inputs, N, vel_eps, metrics, transcription, start, state, end,
+             solver, r, stats, first='full'):
+    """Tries the fallbacks of :data:`DEADLINE_LADDER` after the normal
+    computation (given by its solver, output and statistics) until one of
+    them converges or the time runs out and picks the best result.
+
+    A converged result of the normal computation is ``optimal``, one of a
+    fallback ``suboptimal``; if none converged, the iterate with the smallest
+    violation of the constraints is taken and is ``infeasible``. The quality,
+    the violation and the attempts (``ladder``) are added to the metrics.
+
+    :param end: the time (:func:`time.monotonic`) by which to return
+    :param first: ``full`` or ``continuation`` if the normal computation ran
+        out of time on a coarse grid of the mesh continuation (its result is
+        at most ``suboptimal``)
+    :return: tuple of the solver, the output and the statistics of the best
+        result or ``None`` if there is none
+    """
+    candidates = []
+    metrics['ladder'] = []
+
+    def add(attempt, solver, r, stats):
+        status = stats['return_status']
+        metrics['ladder'].append({'attempt': attempt,
+                                  'N': solver.N,
+                                  'status': status,
+                                  'iterations': stats['iter_count']})
+        if status == 'Invalid_Number_Detected':
+            return
+        if status not in _SUCCESS:
+            quality = 'infeasible'
+        elif attempt == 'full':
+            quality = 'optimal'
+        else:
+            quality = 'suboptimal'
+        candidates.append((QUALITIES.index(quality), _violation(r),
+                           float(r['f']), len(candidates), solver, r, stats))
+
+    add(first, solver, r, stats)
+    for attempt, share in DEADLINE_LADDER[1:]:
+        if candidates and min(candidates)[0] < QUALITIES.index('infeasible'):
+            break
+        if end - time.monotonic() < DEADLINE_MIN_ATTEMPT:
+            break
+        seed = None
+        if candidates:
+            best_solver, best = min(candidates)[4:6]
+            seed = {'N': best_solver.N,
+                    'x': best['x'].full().ravel(),
+                    'transcription': transcription}
+        warm = False
+        if attempt == 'loose':
+            if candidates:
+                solver = best_solver
+                seed['lam_x'] = best['lam_x'].full().ravel()
+                seed['lam_g'] = best['lam_g'].full().ravel()
+                warm = True
+        else:
+            n = max(DEADLINE_COARSE_N, N // DEADLINE_COARSE_FACTOR)
+            if n >= N:
+                continue
+            solver = get_solver(n, dict(), transcription)
+        # obtaining the solver may have taken time, see set_deadlines()
+        solver.variant(warm=warm, progress=True, loose=True)
+        left = end - time.monotonic()
+        if left < DEADLINE_MIN_ATTEMPT:
+            break
+        stop_at = time.monotonic() + share * left
+        print('DEADLINE: {} attempt N={} with {:.3f} s left'.format(
+            attempt, solver.N, left))
+        r, stats = solver.solve(vel_eps=vel_eps, seed=seed, start=start,
+                                state=state, stop_at=stop_at, loose=True,
+                                **inputs)
+        add(attempt, solver, r, stats)
+    if not candidates:
+        return None
+    quality, violation, _, _, solver, r, stats = min(candidates)
+    metrics['quality'] = QUALITIES[quality]
+    metrics['violation'] = violation
+    metrics['ipopt'] = solver_metrics(stats)
+    return solver, r, stats
 
-    # Useful variable block sizes
-    np = 1  # Number of parameters
-    nx = x.size1()  # Number of states
-    nu = u.size1()  # Number of controls
-    ns = nx + nu  # Number of variables per shooting interval
 
-    # Introduce symbolic variables and disassemble them into blocks
-    V = cs.MX.sym('X', N * ns + nx + np)
-    P = V[0]
-    X = [V[(np + i * ns):(np + i * ns + nx)] for i in range(0, N + 1)]
-    U = [V[(np + i * ns + nx):(np + (i + 1) * ns)] for i in range(0, N)]
-
-    # Nonlinear constraints and Lagrange objective
-    G = []
-    F = 0.0
-
-    # Build DMS structure
-    x0 = p_init + x0_init
-    for i in range(0, N):
-        Y = I(x0=X[i], p=cs.vertcat(U[i], P))
-        G += [Y['xf'] - X[i + 1]]
-        F = F + Y['qf']
-
-        frac = float(i + 1) / N
-        x0 = x0 + u_init + [x0_init[i] + frac * (xf_init[i] - x0_init[i])
-                            for i in range(0, nx)]
-
-    # Lower and upper bounds for solver
-    lbg = 0.0
-    ubg = 0.0
-    lbx = p_min + x0_min + u_min + (N - 1) * (x_min + u_min) + xf_min
-    ubx = p_max + x0_max + u_max + (N - 1) * (x_max + u_max) + xf_max
-
-    # Solve the problem using IPOPT
-    nlp = {'x': V, 'f': (m0 - X[-1][0]) / (m0 - m1), 'g': cs.vertcat(*G)}
-    S = cs.nlpsol('S', 'ipopt', nlp, {'ipopt': {'tol': 1e-4,
-                                                'print_level': 5,
-                                                'max_iter': 500}})
-    r = S(x0=x0,
-          lbx=lbx,
-          ubx=ubx,
-          lbg=lbg,
-          ubg=ubg)
-    print('RESULT: {}'.format(S.stats()['return_status']))
-    if S.stats()['return_status'] in {'Invalid_Number_Detected'}:
+def _replan(inputs, N, vel_eps, metrics, progress_file, transcription, start,
+            state, previous, elapsed, end=None, stop_at=None):
+    """Re-plans the remaining trajectory from the given state, see
+    :func:`compute_gravity_turn`."""
+    state = [float(value) for value in state]
+    if len(state) != GravityTurnSolver.nx:
+        raise ValueError('The state must have {} elements [m, v, q, h, d]'
+                         .format(GravityTurnSolver.nx))
+    metrics['strategy'] = 'replan'
+    seed = None
+    if previous is not None and not start:
+        shifted = shift_result(previous, elapsed, state)
+        if shifted is not None:
+            print('REPLAN: from the previous result at t={}'.format(elapsed))
+            seed = seed_from_result(shifted)
+    solver = get_solver(N, metrics, transcription)
+    r, stats = solver.solve(vel_eps=vel_eps, seed=seed,
+                            progress_file=progress_file, start=start,
+                            state=state, stop_at=stop_at, **inputs)
+    metrics['ipopt'] = solver_metrics(stats)
+    if end is not None:
+        best = _anytime(inputs, N, vel_eps, metrics, transcription, start,
+                        state, end, solver, r, stats)
+        if best is None:
+            return None
+        solver, r, stats = best
+    print('RESULT: {}'.format(stats['return_status']))
+    metrics['converged'] = stats['return_status'] in _SUCCESS
+    metrics['objective'] = float(r['f'])
+    if stats['return_status'] in {'Invalid_Number_Detected'}:
         return None
-    # Extract state sequences and parameters from result
-    x = r['x']
-    f = r['f']
-    T = float(x[0])
-
-    t = numpy.linspace(0, T, N + 1)
-    m = numpy.array(x[np::ns]).squeeze()
-    v = numpy.array(x[np + 1::ns]).squeeze()
-    q = numpy.array(x[np + 2::ns]).squeeze()
-    h = numpy.array(x[np + 3::ns]).squeeze()
-    d = numpy.array(x[np + 4::ns]).squeeze()
-    u = numpy.concatenate((numpy.array(x[np + nx::ns]).squeeze(), [0.0]))
-    return {'time': t,
-            'mass': m,
-            'speed': v,
-            'altitude': h,
-            'control': u,
-            'body_curvature': d,
-            'vertical_angle': q}
+    return solver.extract(r['x'])
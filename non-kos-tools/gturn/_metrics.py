@@ -0,0 +1,76 @@
+import collections
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+# Percentiles reported by RollingStats
+PERCENTILES = (50, 90, 95, 99)
+
+
+def flatten(metrics, prefix=''):
+    """Flattens nested metrics into a dictionary of numeric values whose keys
+    are the paths of the values joined by ``/``.
+    """
+    res = dict()
+    for key, value in metrics.items():
+        name = prefix + key
+        if isinstance(value, dict):
+            res.update(flatten(value, name + '/'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            res[name] = value
+    return res
+
+
+def write_json(path, data):
+    """Atomically writes the data to a JSON file."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode='w') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+
+class RollingStats(object):
+    """Percentiles of the metrics of the last ``window`` tasks."""
+
+    def __init__(self, window=1000):
+        self.window = window
+        self.count = 0
+        self.started = time.time()
+        self._values = collections.defaultdict(
+            lambda: collections.deque(maxlen=window))
+        self._strategies = collections.Counter()
+
+    def add(self, metrics):
+        """Adds the metrics of one task."""
+        self.count += 1
+        if 'strategy' in metrics:
+            self._strategies[metrics['strategy']] += 1
+        for key, value in flatten(metrics).items():
+            self._values[key].append(value)
+
+    def summary(self):
+        res = {'tasks': self.count,
+               'window': self.window,
+               'since': self.started,
+               'strategies': dict(self._strategies),
+               'metrics': dict()}
+        for key, values in sorted(self._values.items()):
+            arr = np.fromiter(values, dtype=float, count=len(values))
+            entry = {'n': len(arr),
+                     'mean': float(arr.mean()),
+                     'max': float(arr.max())}
+            for p, v in zip(PERCENTILES, np.percentile(arr, PERCENTILES)):
+                entry['p{}'.format(p)] = float(v)
+            res['metrics'][key] = entry
+        return res
+
+    def write(self, path):
+        write_json(path, self.summary())
@@ -0,0 +1,247 @@
+import numpy as np
+
+# Formats of the raw data file and the names of the files
+RAW_FORMATS = {'txt': 'output-raw.txt',
+               'npy': 'output-raw.npy',
+               'npz': 'output-raw.npz'}
+
+# Lookup tables of the derived quantities and the quantities they are keyed by
+TABLES = {'pitch': 'altitude',
+          'throttle': 'time',
+          'dynamic_pressure': 'altitude',
+          'twr': 'time',
+          'apoapsis': 'time'}
+DEFAULT_TABLE_POINTS = 32
+
+
+def parse_resample(spec):
+    """Checks a resampling specification and returns it in the normalized
+    form.
+
+    :param spec: ``None`` (no resampling) or a dictionary with exactly one of
+        the keys
+            * ``altitude`` - list of altitudes (m) to sample the profile at
+            * ``time`` - list of times (s) to sample the profile at
+            * ``tolerance`` - maximum error of the linear interpolation
+              between the samples relative to the range of every profile
+    :raises ValueError: if the specification is not valid
+    """
+    if spec is None:
+        return None
+    if not isinstance(spec, dict) or len(spec) != 1:
+        raise ValueError('resample must be a lexicon with exactly one of the '
+                         'keys altitude, time, tolerance')
+    (key, value), = spec.items()
+    if key in ('altitude', 'time'):
+        try:
+            points = np.asarray(value, dtype=float).ravel()
+        except (TypeError, ValueError):
+            raise ValueError('resample {} must be a list of numbers'.format(
+                key))
+        if points.size == 0 or not np.all(np.isfinite(points)):
+            raise ValueError('resample {} must be a non-empty list of finite '
+                             'numbers'.format(key))
+        return {key: points}
+    elif key == 'tolerance':
+        try:
+            tol = float(value)
+        except (TypeError, ValueError):
+            tol = -1.0
+        if not tol > 0:
+            raise ValueError('resample tolerance must be a positive number')
+        return {key: tol}
+    raise ValueError('unknown resample key {}'.format(key))
+
+
+def resample(result, spec):
+    """Resamples the profiles of a result according to the specification
+    (see :func:`parse_resample`). The first and the last samples are always
+    kept.
+    """
+    spec = parse_resample(spec)
+    if spec is None:
+        return result
+    if 'tolerance' in spec:
+        idx = simplify(result, spec['tolerance'])
+        return {key: np.asarray(value)[idx] for key, value in result.items()}
+    (key, points), = spec.items()
+    # the profiles are sampled in time, other quantities are made monotonous
+    x = np.maximum.accumulate(np.asarray(result[key], dtype=float))
+    points = np.unique(np.concatenate((np.clip(points, x[0], x[-1]),
+                                       [x[0], x[-1]])))
+    t = np.interp(points, x, result['time'])
+    return {name: np.interp(t, result['time'], value)
+            for name, value in result.items()}
+
+
+def simplify(result, tol):
+    """Selects the samples of a result such that the linear interpolation
+    between them deviates from every profile by at most ``tol`` times its
+    range (Ramer-Douglas-Peucker over all the profiles at once).
+
+    :return: sorted indices of the selected samples
+    """
+    t = np.asarray(result['time'], dtype=float)
+    names = sorted(result.keys())
+    y = np.column_stack([np.asarray(result[name], dtype=float)
+                         for name in names])
+    scale = y.max(axis=0) - y.min(axis=0)
+    y = y / np.where(scale > 0, scale, 1.0)
+    n = t.size
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, n - 1]] = True
+    stack = [(0, n - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2:
+            continue
+        frac = (t[i + 1:j] - t[i]) / (t[j] - t[i])
+        line = y[i] + frac[:, None] * (y[j] - y[i])
+        err = np.abs(y[i + 1:j] - line).max(axis=1)
+        k = int(err.argmax())
+        if err[k] > tol:
+            k += i + 1
+            keep[k] = True
+            stack.append((i, k))
+            stack.append((k, j))
+    return np.flatnonzero(keep)
+
+
+def parse_tables(spec, points=None):
+    """Checks a lookup table specification.
+
+    :param spec: ``None`` or ``False`` (no tables), ``True`` (all the tables
+        of :data:`TABLES`) or a list of the names of the tables
+    :param points: number of the breakpoints of every table, at least 2;
+        :data:`DEFAULT_TABLE_POINTS` if ``None``
+    :return: ``None`` or a tuple of the sorted names and the number of points
+    :raises ValueError: if the specification is not valid
+    """
+    if spec is None or spec is False:
+        return None
+    if spec is True:
+        names = sorted(TABLES)
+    elif isinstance(spec, (list, tuple)) and spec:
+        unknown = [name for name in spec if name not in TABLES]
+        if unknown:
+            raise ValueError('unknown tables {}'.format(
+                ', '.join(str(name) for name in unknown)))
+        names = sorted(set(spec))
+    else:
+        raise ValueError('tables must be true or a non-empty list of the '
+                         'names {}'.format(', '.join(sorted(TABLES))))
+    if points is None:
+        points = DEFAULT_TABLE_POINTS
+    if isinstance(points, bool) or not isinstance(points, (int, float)) or \
+            points != int(points) or points < 2:
+        raise ValueError('table_points must be an integer of at least 2')
+    return names, int(points)
+
+
+def derived(result, constants):
+    """Computes the derived quantities of a result, all the samples at once.
+
+    :param constants: the input data of the task (``g0``, ``r0``, ``Fmax``,
+        ``H`` and ``rho`` are used)
+    :return: dictionary of arrays of the same length as the profiles
+        * ``pitch`` - angle of the velocity above the horizon (deg)
+        * ``throttle`` - the control, constant over every interval
+        * ``dynamic_pressure`` - (Pa)
+        * ``twr`` - ratio of the thrust to the weight at the altitude
+        * ``apoapsis`` - altitude (m) of the apoapsis of the coasting
+          trajectory from the sample; negative for an escape trajectory
+    :raises ValueError: if the constants are missing
+    """
+    try:
+        g0, r0, Fmax, H, rho = (float(constants[key])
+                                for key in ('g0', 'r0', 'Fmax', 'H', 'rho'))
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('tables need the inputs g0, r0, Fmax, H and rho')
+    m, v, q, h, u = (np.asarray(result[key], dtype=float)
+                     for key in ('mass', 'speed', 'vertical_angle',
+                                 'altitude', 'control'))
+    r = r0 + h
+    mu = g0 * r0 ** 2
+    energy = 0.5 * v ** 2 - mu / r
+    momentum = r * v * np.sin(q)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        e = np.sqrt(np.maximum(0.0, 1.0 + 2.0 * energy * momentum ** 2 /
+                               mu ** 2))
+        apoapsis = np.where(energy < 0, -mu / (2.0 * energy) * (1.0 + e) - r0,
+                            -1.0)
+    return {'pitch': 90.0 - np.degrees(q),
+            'throttle': u,
+            'dynamic_pressure': 0.5 * rho * np.exp(-h / H) * v ** 2,
+            'twr': Fmax * u / (m * g0 * (r0 / r) ** 2),
+            'apoapsis': apoapsis}
+
+
+def lookup_tables(result, constants, spec, points=None):
+    """Tabulates the derived quantities (see :func:`derived`) at evenly
+    spaced breakpoints of the quantity they are keyed by (see :data:`TABLES`),
+    which is made monotonous like in :func:`resample`.
+
+    :param spec: the tables, see :func:`parse_tables`
+    :return: dictionary of the tables, each a dictionary of ``key`` (the name
+        of the quantity), ``start`` and ``step`` (the first breakpoint and
+        the stride, for indexing), ``breakpoints`` (sorted, for binary
+        search), ``values`` and ``hold`` (``True`` if the value holds from a
+        breakpoint to the next one instead of being interpolated)
+    """
+    spec = parse_tables(spec, points)
+    if spec is None:
+        return None
+    names, points = spec
+    t = np.asarray(result['time'], dtype=float)
+    quantities = derived(result, constants)
+    tables = dict()
+    for name in names:
+        key = TABLES[name]
+        x = np.maximum.accumulate(np.asarray(result[key], dtype=float))
+        if not x[-1] > x[0]:
+            raise ValueError('{} is constant, table {} cannot be made'.format(
+                key, name))
+        breakpoints = np.linspace(x[0], x[-1], points)
+        tb = np.interp(breakpoints, x, t)
+        y = quantities[name]
+        if name == 'throttle':
+            # the control holds over the intervals
+            y = y[np.clip(np.searchsorted(t, tb, side='right') - 1, 0,
+                          t.size - 1)]
+        else:
+            y = np.interp(tb, t, y)
+        tables[name] = {'key': key,
+                        'start': float(breakpoints[0]),
+                        'step': float(breakpoints[1] - breakpoints[0]),
+                        'breakpoints': breakpoints,
+                        'values': y,
+                        'hold': name == 'throttle'}
+    return tables
+
+
+def write_raw(f, result, fmt):
+    """Writes the raw data (all the samples) of a result.
+
+    :param f: file name or a binary file object
+    :param fmt: one of :data:`RAW_FORMATS`
+        * ``txt`` - gnuplot-compatible text table, columns in the alphabetical
+          order of the keys named in the header
+        * ``npy`` - structured array with one field per key, can be loaded
+          with ``numpy.load(..., mmap_mode='r')``
+        * ``npz`` - one array per key
+    """
+    keys = sorted(result.keys())
+    if fmt == 'txt':
+        np.savetxt(f, np.column_stack([result[key] for key in keys]),
+                   delimiter='\t', header='\t'.join(keys))
+    elif fmt == 'npy':
+        data = np.empty(len(result[keys[0]]),
+                        dtype=[(key, np.float64) for key in keys])
+        for key in keys:
+            data[key] = result[key]
+        np.save(f, data)
+    elif fmt == 'npz':
+        np.savez(f, **{key: np.asarray(result[key], dtype=np.float64)
+                       for key in keys})
+    else:
+        raise ValueError('unknown raw data format {}'.format(fmt))
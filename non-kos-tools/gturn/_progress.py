@@ -0,0 +1,124 @@
+import os
+import os.path as pth
+import tempfile
+import time
+
+import casadi as cs
+import numpy
+
+import koson as ks
+
+
+def write_progress(path, data):
+    """Atomically writes the progress data to a kOS-JSON file, so that a
+    reader never sees a partially written file.
+    """
+    fd, tmp = tempfile.mkstemp(dir=pth.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode='w') as f:
+            ks.dump(data, f)
+        os.replace(tmp, path)
+    finally:
+        if pth.exists(tmp):
+            os.unlink(tmp)
+
+
+class ProgressCallback(cs.Callback):
+    """IPOPT iteration callback writing a compact progress report.
+
+    The report is a lexicon with the keys ``status`` (``running`` while the
+    solver runs, the return status of the solver afterwards), ``iteration``,
+    ``objective``, ``infeasibility`` (maximum violation of the constraints)
+    and ``elapsed`` (seconds since the start of the solver). While the solver
+    runs, the report is rewritten at most once per ``min_interval`` seconds.
+
+    The callback does nothing unless it has been given a file or a stop time
+    by :meth:`start`. After the stop time, it stops the solver, which then
+    returns its current iterate with the status ``User_Requested_Stop``.
+    """
+
+    def __init__(self, nx, ng, np, min_interval=0.1):
+        cs.Callback.__init__(self)
+        self.nx = nx
+        self.ng = ng
+        self.np = np
+        self.min_interval = min_interval
+        self.path = None
+        self.stop_at = None
+        self.lbg = 0.0
+        self.ubg = 0.0
+        self.iteration = 0
+        self.started = 0.0
+        self.last_write = 0.0
+        self.report = None
+        self.construct('progress', {})
+
+    def get_n_in(self):
+        return cs.nlpsol_n_out()
+
+    def get_n_out(self):
+        return 1
+
+    def get_name_in(self, i):
+        return cs.nlpsol_out(i)
+
+    def get_name_out(self, i):
+        return 'ret'
+
+    def get_sparsity_in(self, i):
+        n = cs.nlpsol_out(i)
+        if n == 'f':
+            return cs.Sparsity.scalar()
+        elif n in ('x', 'lam_x'):
+            return cs.Sparsity.dense(self.nx)
+        elif n in ('g', 'lam_g'):
+            return cs.Sparsity.dense(self.ng)
+        return cs.Sparsity.dense(self.np)
+
+    def start(self, path, lbg=0.0, ubg=0.0, stop_at=None):
+        """Starts reporting the progress of a new solver run to the file.
+
+        :param path: the file or ``None`` for no reports
+        :param stop_at: if given, the time (:func:`time.monotonic`) when the
+            solver is stopped
+        """
+        self.path = path
+        self.stop_at = stop_at
+        self.lbg = lbg
+        self.ubg = ubg
+        self.iteration = 0
+        self.started = time.perf_counter()
+        self.last_write = 0.0
+        self.report = None
+
+    def finish(self, status):
+        """Writes the final report and stops reporting."""
+        self.stop_at = None
+        if self.path is None:
+            return
+        report = self.report or {'iteration': 0}
+        report['status'] = status
+        report['elapsed'] = time.perf_counter() - self.started
+        write_progress(self.path, report)
+        self.path = None
+
+    def eval(self, arg):
+        stop = int(self.stop_at is not None and
+                   time.monotonic() >= self.stop_at)
+        if self.path is None:
+            return [stop]
+        now = time.perf_counter()
+        self.iteration += 1
+        g = numpy.asarray(arg[cs.nlpsol_out().index('g')]).ravel()
+        violation = numpy.maximum(self.lbg - g, g - self.ubg)
+        self.report = {
+            'status': 'running',
+            'iteration': self.iteration,
+            'objective': float(arg[cs.nlpsol_out().index('f')]),
+            'infeasibility': float(violation.max()) if violation.size
+            else 0.0,
+            'elapsed': now - self.started}
+        if now - self.last_write >= self.min_interval:
+            self.last_write = now
+            write_progress(self.path, self.report)
+        return [stop]
@@ -0,0 +1,149 @@
+import logging
+import time
+
+import _scheduler as sc
+
+# Ways of choosing the result of a race
+POLICIES = ('first', 'best')
+
+
+def acceptable(result, metrics):
+    """Tells whether a computation ended with a usable solution (a solver
+    which did not converge still returns its last iterate)."""
+    return result is not None and metrics.get('converged', True)
+
+
+class Race(object):
+    """Multi-start race of the computations of one task from several initial
+    guesses.
+
+    The computations are started by ``submit(start)`` for ``start`` in
+    ``range(starts)``. With the ``first`` policy, the first acceptable result
+    (see :func:`acceptable`) wins; with the ``best`` policy, all the
+    computations are awaited and the acceptable result with the lowest
+    objective wins. If there is no acceptable result, the result with the
+    lowest objective wins, if any. The computations still running when the
+    winner is known are cancelled by ``cancel(handle)``.
+
+    If ``parallel`` is ``False`` (e.g. in the synchronous mode where
+    ``submit`` blocks), the computations are started one after another and
+    only until the race is decided.
+
+    Has the same ``ready``/``get`` interface as :class:`_scheduler.Task`.
+    If there is more than one start, the metrics of the winner are extended
+    with ``race`` - the numbers of the ``starts``, ``finished`` and
+    ``succeeded`` computations.
+    """
+
+    def __init__(self, submit, starts, policy='first', cancel=None,
+                 parallel=True):
+        if policy not in POLICIES:
+            raise ValueError('Unknown race policy {}'.format(policy))
+        self.submit = submit
+        self.starts = starts
+        self.policy = policy
+        self.cancel_handle = cancel
+        self.parallel = parallel
+        self.submitted = time.monotonic()
+        self.started = None
+        self._handles = []
+        self._finished = dict()
+        self._errors = []
+        self._decided = False
+        self._result = None
+        self._error = None
+        self._submit(starts if parallel else 1)
+
+    def _submit(self, n):
+        for _ in range(n):
+            start = len(self._handles)
+            self._handles.append(self.submit(start))
+
+    def _collect(self):
+        for start, handle in enumerate(self._handles):
+            if start in self._finished or not handle.ready():
+                continue
+            try:
+                self._finished[start] = handle.get()
+            except sc.TaskError as e:
+                self._finished[start] = (None, dict())
+                self._errors.append(str(e))
+
+    def _winner(self):
+        """Returns the start of the winner, ``None`` if the race is not
+        decided yet or -1 if all the computations failed."""
+        good = [(metrics.get('objective', float('inf')), start)
+                for start, (result, metrics) in self._finished.items()
+                if acceptable(result, metrics)]
+        if good and (self.policy == 'first' or
+                     len(self._finished) == self.starts):
+            return min(good)[1]
+        if len(self._finished) < self.starts:
+            return None
+        results = [(metrics.get('objective', float('inf')), start)
+                   for start, (result, metrics) in self._finished.items()
+                   if result is not None]
+        if results:
+            return min(results)[1]
+        # no result at all, report the metrics of a failed computation if any
+        for start, (_, metrics) in sorted(self._finished.items()):
+            if metrics:
+                return start
+        return -1
+
+    def ready(self):
+        if self._decided:
+            return True
+        self._collect()
+        winner = self._winner()
+        if winner is None and not self.parallel and \
+                len(self._handles) == len(self._finished):
+            self._submit(1)
+            return self.ready()
+        if winner is None:
+            return False
+        self._decide(winner)
+        return True
+
+    def _decide(self, winner):
+        self._decided = True
+        for start, handle in enumerate(self._handles):
+            if start not in self._finished and self.cancel_handle is not None:
+                logging.debug('Cancelling start %d of the race.', start)
+                self.cancel_handle(handle)
+        if winner < 0:
+            self._error = '; '.join(self._errors) or 'computation failed'
+            return
+        result, metrics = self._finished[winner]
+        if self.starts > 1:
+            metrics['race'] = {
+                'starts': self.starts,
+                'finished': len(self._finished),
+                'succeeded': sum(1 for r, m in self._finished.values()
+                                 if acceptable(r, m))}
+        handle = self._handles[winner]
+        self.submitted = getattr(handle, 'submitted', self.submitted)
+        self.started = getattr(handle, 'started', None)
+        self._result = (result, metrics)
+
+    def cancel(self):
+        """Cancels all the computations of the race."""
+        self._decided = True
+        self._error = 'cancelled'
+        if self.cancel_handle is None:
+            return
+        for start, handle in enumerate(self._handles):
+            if start not in self._finished:
+                self.cancel_handle(handle)
+
+    def get(self, poll_interval=0.01):
+        """Waits for the race to be decided and returns the result of the
+        winner.
+
+        :raises _scheduler.TaskError: if no computation returned a result
+        """
+        while not self.ready():
+            time.sleep(poll_interval)
+        if self._error is not None:
+            raise sc.TaskError(self._error)
+        return self._result
@@ -0,0 +1,122 @@
+import hashlib
+import json
+import logging
+import os
+import os.path as pth
+import tempfile
+import time
+
+import numpy as np
+
+
+def canonical(data):
+    """Converts the data to a canonical JSON-compatible form: integers (but
+    not booleans) become floats and arrays become lists, so that inputs which
+    differ only in the representation of the numbers are equal.
+    """
+    if isinstance(data, dict):
+        return {str(key): canonical(value) for key, value in data.items()}
+    elif isinstance(data, (list, tuple, np.ndarray)):
+        return [canonical(item) for item in data]
+    elif isinstance(data, np.generic):
+        return canonical(data.item())
+    elif isinstance(data, int) and not isinstance(data, bool):
+        return float(data)
+    return data
+
+
+def result_key(inputs, config):
+    """Returns the key of the result of a computation.
+
+    :param inputs: the input data of the computation
+    :param config: dictionary with everything else influencing the result
+        (solver configuration)
+    """
+    text = json.dumps({'inputs': canonical(inputs),
+                       'config': canonical(config)},
+                      sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class ResultCache(object):
+    """Disk-backed cache of computation results keyed by :func:`result_key`.
+
+    Every result is stored in its own ``.npz`` file named by its key, so the
+    cache can be shared by several processes. The modification time of a file
+    is its last use; when the cache grows over ``max_bytes`` the least
+    recently used results are removed, and results not used for more than
+    ``max_age`` seconds are removed as well.
+    """
+
+    def __init__(self, directory, max_bytes=None, max_age=None):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    def _path(self, key):
+        return pth.join(self.directory, key + '.npz')
+
+    def get(self, key):
+        """Returns the cached result or ``None``."""
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                result = {name: data[name] for name in data.files}
+        except (OSError, ValueError):
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        logging.debug('Result cache hit %s', key)
+        return result
+
+    def put(self, key, result):
+        """Stores a result (a dictionary of arrays) and evicts old results if
+        necessary.
+        """
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, mode='wb') as f:
+                np.savez(f, **result)
+            os.replace(tmp, self._path(key))
+        finally:
+            if pth.exists(tmp):
+                os.unlink(tmp)
+        self.evict()
+
+    def evict(self):
+        """Removes the results over the size and age limits.
+
+        :return: number of removed results
+        """
+        if self.max_bytes is None and self.max_age is None:
+            return 0
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.npz'):
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry.path))
+        entries.sort()
+        total = sum(e[1] for e in entries)
+        now = time.time()
+        removed = 0
+        for mtime, size, path in entries:
+            too_old = self.max_age is not None and now - mtime > self.max_age
+            too_big = self.max_bytes is not None and total > self.max_bytes
+            if not too_old and not too_big:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        if removed:
+            logging.debug('Evicted %d results from the result cache.', removed)
+        return removed
@@ -0,0 +1,311 @@
+import heapq
+import itertools
+import logging
+import math
+import multiprocessing as mp
+import multiprocessing.connection as mpc
+import threading
+import time
+import traceback
+
+
+class TaskError(Exception):
+    """Raised by :meth:`Task.get` if the task did not finish successfully."""
+    pass
+
+
+def finite(x):
+    """Tells whether x is a finite number (and not a bool)."""
+    return (isinstance(x, (int, float)) and not isinstance(x, bool) and
+            math.isfinite(x))
+
+
+class Task(object):
+    """Handle of a task submitted to the :class:`Scheduler`.
+
+    Has the same ``ready``/``get`` interface as the results of
+    ``multiprocessing.Pool.apply_async``.
+    """
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+
+    def __init__(self, func, args, kwds, priority, timeout, callback):
+        self.func = func
+        self.args = args
+        self.kwds = kwds
+        self.priority = priority
+        self.timeout = timeout
+        self.callback = callback
+        self.state = Task.PENDING
+        self.submitted = time.monotonic()
+        self.started = None
+        self.finished = None
+        self._cancel_requested = False
+        self._result = None
+        self._error = None
+        self._event = threading.Event()
+
+    def ready(self):
+        return self._event.is_set()
+
+    def get(self):
+        """Returns the result of the task.
+
+        :raises TaskError: if the task failed, timed out or was cancelled
+        """
+        self._event.wait()
+        if self.state != Task.DONE:
+            raise TaskError(self._error)
+        return self._result
+
+    def _finish(self, state, result=None, error=None):
+        self.state = state
+        self._result = result
+        self._error = error
+        self.finished = time.monotonic()
+        self._event.set()
+        if self.callback is not None:
+            try:
+                self.callback(self)
+            except Exception:
+                logging.exception('Task callback failed.')
+
+
+def _worker_main(conn, initializer, initargs):
+    if initializer is not None:
+        initializer(*initargs)
+    conn.send(('ready', None))
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            break
+        if msg is None:
+            break
+        func, args, kwds = msg
+        try:
+            conn.send(('ok', func(*args, **kwds)))
+        except Exception:
+            conn.send(('error', traceback.format_exc()))
+
+
+class _Worker(object):
+    def __init__(self, ctx, initializer, initargs):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main,
+                                   args=(child_conn, initializer, initargs),
+                                   daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.ready = False
+        self.task = None
+
+    def kill(self):
+        self.process.terminate()
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class Scheduler(object):
+    """Runs tasks in a bounded set of long-lived worker processes.
+
+    Pending tasks are dispatched to idle workers in the order of decreasing
+    priority (and submission within the same priority). A task running longer
+    than its timeout is stopped by killing its worker; the same happens to a
+    running task which is cancelled. Killed (or crashed) workers are replaced
+    by new ones, initialized by the initializer, so the pool size is kept.
+    """
+
+    def __init__(self, processes, initializer=None, initargs=()):
+        self._ctx = mp.get_context()
+        self._initializer = initializer
+        self._initargs = initargs
+        self._lock = threading.Lock()
+        self._pending = []
+        self._seq = itertools.count()
+        self._closed = False
+        self._wake_r, self._wake_w = self._ctx.Pipe(duplex=False)
+        self._workers = [self._spawn() for _ in range(processes)]
+        self._thread = threading.Thread(target=self._loop,
+                                        name='gturn-scheduler', daemon=True)
+        self._thread.start()
+
+    def _spawn(self):
+        return _Worker(self._ctx, self._initializer, self._initargs)
+
+    def _wake(self):
+        self._wake_w.send(None)
+
+    def submit(self, func, args=(), kwds=None, priority=0, timeout=None,
+               callback=None):
+        """Submits a task.
+
+        :param priority: tasks with higher priority are started first
+        :param timeout: maximum wall-clock run time of the task (s); ``None``
+            means unlimited
+        :param callback: called with the task when it finishes in any way;
+            it is called from the scheduler thread and must not call the
+            scheduler
+        :rtype: Task
+        :raises ValueError: if the priority is not a finite number or the
+            timeout is not a finite number greater than 0
+        """
+        if not finite(priority):
+            raise ValueError('Priority must be a finite number.')
+        if timeout is not None and not (finite(timeout) and timeout > 0):
+            raise ValueError('Timeout must be a finite number greater than '
+                             '0.')
+        task = Task(func, tuple(args), dict(kwds or {}), priority, timeout,
+                    callback)
+        with self._lock:
+            heapq.heappush(self._pending, (-priority, next(self._seq), task))
+        self._wake()
+        return task
+
+    def cancel(self, task):
+        """Cancels a pending or running task. Does nothing if the task has
+        already finished.
+        """
+        with self._lock:
+            if task.state == Task.PENDING:
+                self._pending = [e for e in self._pending if e[2] is not task]
+                heapq.heapify(self._pending)
+                task._finish(Task.CANCELLED, error='cancelled')
+                return
+            if task.state != Task.RUNNING:
+                return
+            # the worker is killed by the scheduler thread
+            task._cancel_requested = True
+        self._wake()
+
+    def close(self):
+        """Stops all the workers. Unfinished tasks are cancelled."""
+        with self._lock:
+            self._closed = True
+            for _, _, task in self._pending:
+                task._finish(Task.CANCELLED, error='scheduler closed')
+            self._pending = []
+        self._wake()
+        self._thread.join()
+        for w in self._workers:
+            if w.task is not None:
+                w.task._finish(Task.CANCELLED, error='scheduler closed')
+            try:
+                w.conn.send(None)
+            except OSError:
+                pass
+            w.process.join(1)
+            if w.process.is_alive():
+                w.kill()
+
+    def _dispatch(self):
+        now = time.monotonic()
+        for w in self._workers:
+            if not self._pending:
+                break
+            if not w.ready or w.task is not None:
+                continue
+            _, _, task = heapq.heappop(self._pending)
+            task.state = Task.RUNNING
+            task.started = now
+            w.task = task
+            w.conn.send((task.func, task.args, task.kwds))
+
+    def _next_deadline(self):
+        deadlines = [w.task.started + w.task.timeout for w in self._workers
+                     if w.task is not None and w.task.timeout is not None]
+        if not deadlines:
+            return None
+        return min(deadlines)
+
+    def _loop(self):
+        while True:
+            try:
+                if not self._step():
+                    return
+            except Exception:
+                # the thread serves all the tasks, it must not die
+                logging.exception('Error in the scheduler thread.')
+                time.sleep(0.1)
+
+    def _step(self):
+        """Dispatches the pending tasks and waits for an event.
+
+        :return: ``False`` if the scheduler is closed
+        """
+        with self._lock:
+            if self._closed:
+                return False
+            self._dispatch()
+            deadline = self._next_deadline()
+            waitables = {self._wake_r: None}
+            for w in self._workers:
+                waitables[w.conn] = w
+                waitables[w.process.sentinel] = w
+        timeout = None
+        if deadline is not None:
+            timeout = max(0.0, deadline - time.monotonic())
+        ready = mpc.wait(list(waitables.keys()), timeout)
+        with self._lock:
+            if self._wake_r in ready:
+                while self._wake_r.poll():
+                    self._wake_r.recv()
+            for obj in ready:
+                w = waitables[obj]
+                if w is None or w not in self._workers:
+                    continue
+                if obj is w.conn:
+                    self._receive(w)
+                elif not w.process.is_alive():
+                    self._replace(w, 'worker died')
+            self._check_running()
+        return True
+
+    def _receive(self, w):
+        try:
+            status, value = w.conn.recv()
+        except (EOFError, OSError):
+            self._replace(w, 'worker died')
+            return
+        if status == 'ready':
+            w.ready = True
+            return
+        task = w.task
+        w.task = None
+        if task is None:
+            return
+        if status == 'ok':
+            task._finish(Task.DONE, result=value)
+        else:
+            logging.error('Task failed:\n%s', value)
+            task._finish(Task.FAILED, error=value.strip().splitlines()[-1])
+
+    def _replace(self, w, reason, state=Task.FAILED):
+        task = w.task
+        i = self._workers.index(w)
+        w.kill()
+        self._workers[i] = self._spawn()
+        if task is not None:
+            task._finish(state, error=reason)
+
+    def _check_running(self):
+        now = time.monotonic()
+        for w in list(self._workers):
+            task = w.task
+            if task is None:
+                continue
+            if task._cancel_requested:
+                logging.debug('Killing worker running a cancelled task.')
+                self._replace(w, 'cancelled', state=Task.CANCELLED)
+            elif (task.timeout is not None and
+                  now - task.started >= task.timeout):
+                logging.warning('Task timed out after %s s, killing its '
+                                'worker.', task.timeout)
+                self._replace(w, 'timeout')
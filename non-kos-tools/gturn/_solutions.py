@@ -0,0 +1,128 @@
+import hashlib
+import logging
+import os
+import os.path as pth
+import tempfile
+
+import numpy as np
+
+# Inputs identifying a problem, in the order of the feature vector. All of
+# them but the target angle are positive scale quantities and are compared on
+# a logarithmic scale, i.e. by their relative difference.
+FEATURES = ('m0', 'm1', 'g0', 'r0', 'Isp0', 'Isp1', 'Fmax', 'cd', 'A', 'H',
+            'rho', 'h_obj', 'v_obj', 'q_obj')
+_LINEAR_FEATURES = ('q_obj',)
+
+
+def features(inputs):
+    """Returns the normalized feature vector of the given inputs.
+
+    :param inputs: dictionary with (at least) all the :data:`FEATURES`
+    :rtype: numpy.ndarray
+    """
+    f = np.array([float(inputs[name]) for name in FEATURES])
+    log = np.array([name not in _LINEAR_FEATURES for name in FEATURES])
+    f[log] = np.log(np.maximum(f[log], 1e-12))
+    return f
+
+
+class SolutionStore(object):
+    """Persistent store of past solutions indexed by their normalized inputs.
+
+    Every solution is stored in its own ``.npz`` file in the store directory so
+    that several processes can share one store. Only the feature vectors are
+    kept in memory; the index is refreshed whenever the directory changes.
+    """
+
+    def __init__(self, directory, max_distance=1.0):
+        """
+        :param directory: directory of the store (created if necessary)
+        :param max_distance: solutions whose normalized inputs are further
+            than this (in the Euclidean norm) are not offered as initial
+            guesses
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_distance = max_distance
+        self._mtime = None
+        self._files = []
+        self._features = np.empty((0, len(FEATURES)))
+
+    def _refresh(self):
+        mtime = os.stat(self.directory).st_mtime_ns
+        if mtime == self._mtime:
+            return
+        files = []
+        feats = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.npz'):
+                continue
+            try:
+                with np.load(entry.path) as data:
+                    feats.append(data['features'])
+            except (OSError, ValueError, KeyError):
+                logging.debug('Skipping unreadable solution %s', entry.path)
+                continue
+            files.append(entry.path)
+        self._mtime = mtime
+        self._files = files
+        if feats:
+            self._features = np.vstack(feats)
+        else:
+            self._features = np.empty((0, len(FEATURES)))
+
+    def nearest(self, inputs):
+        """Returns the stored solution with the closest inputs.
+
+        :return: ``None`` if there is no solution close enough, otherwise a
+            dictionary with keys ``N``, ``x``, ``lam_x``, ``lam_g`` (these two
+            may be ``None``), ``transcription`` and ``distance``
+        """
+        self._refresh()
+        if not self._files:
+            return None
+        dist = np.linalg.norm(self._features - features(inputs), axis=1)
+        i = int(np.argmin(dist))
+        if dist[i] > self.max_distance:
+            return None
+        try:
+            with np.load(self._files[i]) as data:
+                seed = {'N': int(data['N']),
+                        'x': data['x'],
+                        'lam_x': data['lam_x'] if 'lam_x' in data else None,
+                        'lam_g': data['lam_g'] if 'lam_g' in data else None,
+                        'transcription': str(data['transcription'])
+                        if 'transcription' in data else 'shooting',
+                        'distance': float(dist[i])}
+        except (OSError, ValueError, KeyError):
+            logging.debug('Solution %s disappeared', self._files[i])
+            return None
+        logging.debug('Nearest solution %s at distance %f', self._files[i],
+                      dist[i])
+        return seed
+
+    def add(self, inputs, N, x, lam_x=None, lam_g=None,
+            transcription='shooting'):
+        """Stores a solution.
+
+        A solution with exactly the same inputs, N and transcription replaces
+        the old one.
+        """
+        f = features(inputs)
+        key = f.tobytes() + str(N).encode('ascii')
+        if transcription != 'shooting':
+            key += transcription.encode('ascii')
+        name = hashlib.sha1(key).hexdigest()
+        data = {'features': f, 'N': N, 'x': np.asarray(x).ravel(),
+                'transcription': transcription}
+        if lam_x is not None and lam_g is not None:
+            data['lam_x'] = np.asarray(lam_x).ravel()
+            data['lam_g'] = np.asarray(lam_g).ravel()
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, mode='wb') as f:
+                np.savez(f, **data)
+            os.replace(tmp, pth.join(self.directory, name + '.npz'))
+        finally:
+            if pth.exists(tmp):
+                os.unlink(tmp)
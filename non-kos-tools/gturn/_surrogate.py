@@ -0,0 +1,186 @@
+import itertools
+import json
+import logging
+
+import numpy as np
+
+# Keys of the profiles stored in the grid, in the order of the stored arrays.
+PROFILE_KEYS = ('time', 'mass', 'speed', 'altitude', 'control',
+                'body_curvature', 'vertical_angle')
+
+# Inputs of the model a request is answered for (the constants and vel_eps of
+# _gturn.compute_gravity_turn); the grid is compared with the requests in
+# these only.
+INPUTS = ('m0', 'm1', 'g0', 'r0', 'Isp0', 'Isp1', 'Fmax', 'cd', 'A', 'H',
+          'rho', 'h_obj', 'v_obj', 'q_obj', 'vel_eps')
+
+
+def load_spec(fp):
+    """Loads a grid specification from a (plain) JSON file.
+
+    The specification is an object with these members:
+        * ``base`` - complete input data (as for ``compute_gravity_turn``);
+          the values of the inputs spanned by the axes are ignored and the
+          inputs of :data:`INPUTS` must be numbers
+        * ``axes`` - object mapping the names of :data:`INPUTS` to the values
+          the grid spans; the values are either a list or an object with
+          ``start``, ``stop`` and ``num`` members (evenly spaced values, both
+          ends included)
+        * ``N`` - number of shooting intervals of the computed profiles
+          (optional, defaults to ``base.N`` or 300)
+    The transcription (``base.transcription``) is taken out of the base
+    input data into ``transcription`` (``None`` if not given).
+
+    :return: the specification with the axes expanded to sorted lists
+    :raises ValueError: if the specification is invalid
+    """
+    spec = json.load(fp)
+    base = dict(spec['base'])
+    N = int(spec.get('N', base.pop('N', 300)))
+    base.pop('N', None)
+    transcription = base.pop('transcription', None)
+    for name in spec['axes']:
+        if name not in INPUTS:
+            raise ValueError('Axis {} is not an input of the model.'.format(
+                name))
+        base.pop(name, None)
+    for name in INPUTS:
+        value = base.get(name, 0.0)
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError('Base input {} must be a number.'.format(name))
+    axes = []
+    for name in sorted(spec['axes']):
+        values = spec['axes'][name]
+        if isinstance(values, dict):
+            values = np.linspace(values['start'], values['stop'],
+                                 int(values['num']))
+        values = sorted(float(v) for v in values)
+        if len(values) < 2:
+            raise ValueError('Axis {} must have at least two '
+                             'values.'.format(name))
+        axes.append((name, values))
+    return {'base': base, 'axes': axes, 'N': N,
+            'transcription': transcription}
+
+
+def grid_points(spec):
+    """Generates all the grid points of the specification.
+
+    :return: iterator over tuples ``(index, inputs)`` where ``index`` is the
+        multi-index of the grid point and ``inputs`` is the complete input data
+        including ``N``
+    """
+    names = [name for name, _ in spec['axes']]
+    ranges = [range(len(values)) for _, values in spec['axes']]
+    for index in itertools.product(*ranges):
+        inputs = dict(spec['base'], N=spec['N'])
+        if spec['transcription'] is not None:
+            inputs['transcription'] = spec['transcription']
+        for name, (_, values), i in zip(names, spec['axes'], index):
+            inputs[name] = values[i]
+        yield index, inputs
+
+
+def save_grid(path, spec, results):
+    """Saves the computed profiles of the grid into a compressed ``.npz`` file.
+
+    :param results: dictionary mapping grid multi-indices to the results of
+        ``compute_gravity_turn`` (``None`` for failed computations)
+    """
+    shape = tuple(len(values) for _, values in spec['axes'])
+    profiles = np.full(shape + (len(PROFILE_KEYS), spec['N'] + 1), np.nan,
+                       dtype=np.float32)
+    ok = np.zeros(shape, dtype=bool)
+    for index, result in results.items():
+        if result is None:
+            continue
+        profiles[index] = [result[key] for key in PROFILE_KEYS]
+        ok[index] = True
+    base_names = sorted(name for name in spec['base'] if name in INPUTS)
+    data = {'base_names': np.array(base_names),
+            'base_values': np.array([spec['base'][n] for n in base_names],
+                                    dtype=float),
+            'axis_names': np.array([name for name, _ in spec['axes']]),
+            'profiles': profiles,
+            'ok': ok}
+    if spec['transcription'] is not None:
+        data['transcription'] = np.array(spec['transcription'])
+    for i, (_, values) in enumerate(spec['axes']):
+        data['axis_{}'.format(i)] = np.array(values)
+    np.savez_compressed(path, **data)
+    logging.info('Saved grid of %d profiles (%d failed) to %s', ok.size,
+                 ok.size - np.count_nonzero(ok), path)
+
+
+class Surrogate(object):
+    """Answers computation requests by multilinear interpolation between the
+    profiles of a precomputed grid.
+    """
+
+    def __init__(self, path, rtol=1e-6):
+        """
+        :param path: grid file written by :func:`save_grid`
+        :param rtol: relative tolerance of the comparison of the inputs not
+            spanned by the grid with the base input data of the grid
+        """
+        with np.load(path) as data:
+            self.base = dict(zip([str(n) for n in data['base_names']],
+                                 data['base_values']))
+            self.axis_names = [str(n) for n in data['axis_names']]
+            self.axes = [data['axis_{}'.format(i)]
+                         for i in range(len(self.axis_names))]
+            self.profiles = data['profiles'].astype(float)
+            self.ok = data['ok']
+            # None for the grids saved without it, they answer any request
+            self.transcription = (str(data['transcription'])
+                                  if 'transcription' in data.files else None)
+        self.rtol = rtol
+        self.N = self.profiles.shape[-1] - 1
+
+    def evaluate(self, inputs, N=None, transcription=None):
+        """Interpolates the profile for the given input data.
+
+        :param N: number of intervals of the returned profile; the profile of
+            the grid is resampled if it differs
+        :param transcription: transcription of the request; if given, only a
+            grid computed with the same one answers
+        :return: dictionary with results as returned by
+            ``compute_gravity_turn`` or ``None`` if the input data lie outside
+            the grid (or the neighbouring grid points failed)
+        """
+        if (transcription is not None and self.transcription is not None and
+                transcription != self.transcription):
+            return None
+        for name, value in self.base.items():
+            if name in self.axis_names or name not in INPUTS:
+                continue
+            if not np.isclose(inputs[name], value, rtol=self.rtol, atol=0.0):
+                return None
+        lo = []
+        weights = []
+        for name, axis in zip(self.axis_names, self.axes):
+            v = inputs[name]
+            if not axis[0] <= v <= axis[-1]:
+                return None
+            i = min(int(np.searchsorted(axis, v, side='right')) - 1,
+                    len(axis) - 2)
+            lo.append(i)
+            weights.append((v - axis[i]) / (axis[i + 1] - axis[i]))
+
+        profile = np.zeros(self.profiles.shape[-2:])
+        for corner in itertools.product((0, 1), repeat=len(lo)):
+            w = 1.0
+            for c, wi in zip(corner, weights):
+                w *= wi if c else 1.0 - wi
+            if w == 0.0:
+                continue
+            index = tuple(i + c for i, c in zip(lo, corner))
+            if not self.ok[index]:
+                return None
+            profile += w * self.profiles[index]
+
+        if N is not None and N != self.N:
+            tau = np.linspace(0.0, 1.0, self.N + 1)
+            new_tau = np.linspace(0.0, 1.0, N + 1)
+            profile = np.array([np.interp(new_tau, tau, p) for p in profile])
+        return dict(zip(PROFILE_KEYS, profile))
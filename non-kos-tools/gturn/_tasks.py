@@ -0,0 +1,174 @@
+import logging
+import os
+import os.path as pth
+import shutil
+import time
+
+import koson as ks
+
+INPUT = 'input.json'
+INPUT_LOCK = 'input.lock'
+OUTPUT = 'output.json'
+
+# Modification times closer to the present than this (ns) are not trusted to
+# reflect all the changes of a directory (coarse timestamps of some file
+# systems), so such directories are examined again by the next scan.
+_SETTLE_NS = 2 * 10 ** 9
+
+
+def _settled(mtime, now):
+    """Returns the modification time if it is old enough to be trusted,
+    otherwise ``None`` (so the directory is examined again).
+    """
+    return mtime if now - mtime > _SETTLE_NS else None
+
+
+class TaskIndex(object):
+    """Incremental index of the task dirs of a master directory.
+
+    Every task dir is in one of the states:
+        * ``waiting``  - no input data yet, or the input is locked
+        * ``invalid``  - the input data could not be loaded
+        * ``running``  - the task has been handed out by :meth:`scan`
+        * ``done``     - the output has been written (successfully)
+        * ``failed``   - the output has been written and contains an error
+    A scan lists the master directory once and looks into a task dir only if
+    its modification time changed since it was last examined (creating or
+    removing input.json, input.lock or output.json changes it). Running tasks
+    are never examined; they are released by :meth:`finished`.
+
+    Optionally, task dirs which have been done or failed for longer than
+    ``archive_age`` seconds are moved into the ``archive`` directory.
+    """
+
+    WAITING = 'waiting'
+    INVALID = 'invalid'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, directory, archive=None, archive_age=None):
+        self.directory = directory
+        self.archive = archive
+        self.archive_age = archive_age
+        if archive is not None:
+            os.makedirs(archive, exist_ok=True)
+        # name -> [state, mtime (ns) of the task dir when examined]
+        self._entries = dict()
+
+    def state(self, name):
+        entry = self._entries.get(name)
+        return None if entry is None else entry[0]
+
+    def counts(self):
+        """Returns the numbers of the task dirs in every state."""
+        res = dict()
+        for state, _ in self._entries.values():
+            res[state] = res.get(state, 0) + 1
+        return res
+
+    def scan(self):
+        """Scans the master directory for fresh tasks.
+
+        :return: list of tuples ``(name, task dir, data, metrics)`` where
+            metrics hold the time the task was detected (``time.monotonic``)
+            and the time it took to load its input data
+        """
+        logging.debug('Scanning master directory %s', self.directory)
+        now = time.time_ns()
+        seen = set()
+        tasks = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                try:
+                    if not entry.is_dir():
+                        continue
+                    mtime = entry.stat().st_mtime_ns
+                except FileNotFoundError:
+                    continue
+                name = entry.name
+                seen.add(name)
+                known = self._entries.get(name)
+                if known is not None and (known[0] == TaskIndex.RUNNING or
+                                          known[1] == mtime):
+                    continue
+                state, task = self._examine(name, entry.path)
+                if (state == TaskIndex.DONE and known is not None and
+                        known[0] == TaskIndex.FAILED):
+                    state = TaskIndex.FAILED
+                self._entries[name] = [state, _settled(mtime, now)]
+                if task is not None:
+                    tasks.append(task)
+        for name in set(self._entries) - seen:
+            del self._entries[name]
+        if self.archive is not None and self.archive_age is not None:
+            self._archive(now)
+        return tasks
+
+    def _examine(self, name, tskdir):
+        logging.debug('Examining %s', tskdir)
+        try:
+            with os.scandir(tskdir) as it:
+                files = {e.name for e in it}
+        except (FileNotFoundError, NotADirectoryError):
+            return TaskIndex.WAITING, None
+        if OUTPUT in files:
+            logging.debug('Skipping because result file already exists.')
+            return TaskIndex.DONE, None
+        if INPUT_LOCK in files:
+            logging.debug('Skipping because lock file exists.')
+            return TaskIndex.WAITING, None
+        if INPUT not in files:
+            logging.debug('Skipping because input file does not exist.')
+            return TaskIndex.WAITING, None
+        logging.debug('Found fresh data.')
+        detected = time.monotonic()
+        try:
+            with open(pth.join(tskdir, INPUT), mode='r') as f:
+                data = ks.load(f)
+        except (OSError, ValueError, AssertionError) as e:
+            logging.error('Input data of task %s could not be loaded: %s',
+                          name, e)
+            return TaskIndex.INVALID, None
+        logging.debug('Loaded data: %s', str(data))
+        return TaskIndex.RUNNING, (name, tskdir, data,
+                                   {'detected': detected,
+                                    'input_load': time.monotonic() - detected})
+
+    def finished(self, name, ok=True):
+        """Marks a running task done (or failed) after its output has been
+        written.
+        """
+        try:
+            mtime = os.stat(pth.join(self.directory, name)).st_mtime_ns
+        except FileNotFoundError:
+            self._entries.pop(name, None)
+            return
+        self._entries[name] = [TaskIndex.DONE if ok else TaskIndex.FAILED,
+                               _settled(mtime, time.time_ns())]
+
+    def cancelled(self, name):
+        """Forgets a running task which has been cancelled, so that its task
+        dir is examined by the next scan.
+        """
+        self._entries.pop(name, None)
+
+    def _archive(self, now):
+        limit = now - int(self.archive_age * 1e9)
+        for name, (state, mtime) in list(self._entries.items()):
+            if state not in (TaskIndex.DONE, TaskIndex.FAILED):
+                continue
+            if mtime is None or mtime > limit:
+                continue
+            target = pth.join(self.archive, name)
+            n = 1
+            while pth.exists(target):
+                target = pth.join(self.archive, '{}.{}'.format(name, n))
+                n += 1
+            logging.info('Archiving task %s to %s', name, target)
+            try:
+                shutil.move(pth.join(self.directory, name), target)
+            except OSError as e:
+                logging.warning('Task %s could not be archived: %s', name, e)
+                continue
+            del self._entries[name]
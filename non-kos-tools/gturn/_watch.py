@@ -0,0 +1,199 @@
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import os.path as pth
+import select
+import socket
+import struct
+import time
+
+# inotify constants from <sys/inotify.h>
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_IN_ISDIR = 0x40000000
+
+_MASTER_MASK = (_IN_CREATE | _IN_DELETE | _IN_MOVED_FROM | _IN_MOVED_TO |
+                _IN_ONLYDIR)
+_TASK_MASK = (_IN_CLOSE_WRITE | _IN_CREATE | _IN_DELETE | _IN_MOVED_FROM |
+              _IN_MOVED_TO | _IN_DELETE_SELF | _IN_ONLYDIR)
+
+_EVENT = struct.Struct('iIII')
+
+# Files in task dirs whose changes may make a task ready (or cancel it).
+# Changes of other files, most notably of those written by this program, are
+# ignored.
+WATCHED_FILES = {'input.json', 'input.lock'}
+
+
+class _Inotify(object):
+    """Minimal ctypes binding of the Linux inotify API."""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                    ctypes.c_uint32]
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+    def add_watch(self, path, mask):
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def read(self):
+        """Reads all pending events.
+
+        :return: list of tuples ``(wd, mask, name)``
+        """
+        events = []
+        while True:
+            try:
+                buf = os.read(self.fd, 64 * 1024)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return events
+                raise
+            pos = 0
+            while pos < len(buf):
+                wd, mask, _, length = _EVENT.unpack_from(buf, pos)
+                pos += _EVENT.size
+                name = buf[pos:pos + length].rstrip(b'\0')
+                pos += length
+                events.append((wd, mask, os.fsdecode(name)))
+
+    def close(self):
+        os.close(self.fd)
+
+
+class DirectoryWatcher(object):
+    """Waits for changes of the master directory and its task dirs.
+
+    On Linux the changes are detected by inotify, elsewhere (or if inotify is
+    not available) the waiting simply times out. The master directory should
+    be rescanned after every wait anyway, because some changes (e.g. on network
+    file systems) are not reported by inotify.
+
+    The waiting can be interrupted from any thread by :meth:`wake`, e.g. when
+    a computation finishes.
+    """
+
+    def __init__(self, directory, use_inotify=True):
+        self.directory = directory
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._inotify = None
+        self._watches = dict()
+        if use_inotify:
+            try:
+                self._inotify = _Inotify()
+                self._inotify.add_watch(directory, _MASTER_MASK)
+            except (OSError, AttributeError) as e:
+                logging.info('inotify not available (%s), polling the '
+                             'directory instead.', e)
+                self._close_inotify()
+        if self._inotify is not None:
+            for entry in os.scandir(directory):
+                if entry.is_dir():
+                    self._watch_task(entry.name)
+
+    @property
+    def event_driven(self):
+        return self._inotify is not None
+
+    def _close_inotify(self):
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+        self._watches = dict()
+
+    def _watch_task(self, name):
+        try:
+            wd = self._inotify.add_watch(pth.join(self.directory, name),
+                                         _TASK_MASK)
+        except OSError as e:
+            # the task dir is already gone or is not a directory
+            logging.debug('Cannot watch %s: %s', name, e)
+            return
+        self._watches[wd] = name
+
+    def wake(self, *args):
+        """Interrupts a waiting :meth:`wait`. Thread-safe.
+
+        Accepts and ignores any arguments so that it can be used directly as
+        a callback.
+        """
+        try:
+            self._wake_w.send(b'\0')
+        except (BlockingIOError, OSError):
+            # the wake-up is already pending or the watcher is closed
+            pass
+
+    def wait(self, timeout):
+        """Waits until a relevant change occurs, :meth:`wake` is called or
+        the timeout (in seconds) expires.
+
+        :return: ``True`` if woken by a change or :meth:`wake`, ``False`` on
+            timeout
+        """
+        deadline = time.monotonic() + timeout
+        fds = [self._wake_r]
+        if self._inotify is not None:
+            fds.append(self._inotify.fd)
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            ready, _, _ = select.select(fds, [], [], remaining)
+            woken = False
+            if self._wake_r in ready:
+                self._drain_wakeups()
+                woken = True
+            if self._inotify is not None and self._inotify.fd in ready:
+                woken = self._process_events() or woken
+            if woken:
+                return True
+
+    def _drain_wakeups(self):
+        try:
+            while self._wake_r.recv(4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+    def _process_events(self):
+        relevant = False
+        for wd, mask, name in self._inotify.read():
+            if mask & _IN_Q_OVERFLOW:
+                logging.debug('inotify queue overflow')
+                relevant = True
+            elif mask & _IN_IGNORED:
+                self._watches.pop(wd, None)
+            elif wd in self._watches:
+                if mask & _IN_DELETE_SELF or name in WATCHED_FILES:
+                    relevant = True
+            elif mask & _IN_ISDIR:
+                # change in the master directory
+                if mask & (_IN_CREATE | _IN_MOVED_TO):
+                    self._watch_task(name)
+                relevant = True
+        return relevant
+
+    def close(self):
+        self._close_inotify()
+        self._wake_r.close()
+        self._wake_w.close()
@@ -0,0 +1,364 @@
+# ----------------------------------------------------------------
+# Micro-benchmarks of the gravity turn computation server
+# ----------------------------------------------------------------
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import logging
+import math
+import multiprocessing as mp
+import os.path as pth
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import textwrap
+import time
+
+import casadi as cs
+import numpy as np
+
+import _gturn as gt
+import _output as ot
+import koson as ks
+
+# Vehicle profiles the solver is benchmarked with (Kerbin-like body).
+_BODY = dict(g0=9.81, r0=600000.0, H=5600.0, rho=1.2230948554874)
+PROFILES = {
+    'light': dict(_BODY, m0=20000.0, m1=6000.0, Isp0=270.0, Isp1=300.0,
+                  Fmax=400000.0, cd=0.2, A=1.5, h_obj=75000.0, v_obj=2250.0,
+                  q_obj=0.5 * math.pi),
+    'heavy': dict(_BODY, m0=120000.0, m1=40000.0, Isp0=290.0, Isp1=320.0,
+                  Fmax=2000000.0, cd=0.25, A=7.0, h_obj=80000.0,
+                  v_obj=2280.0, q_obj=0.5 * math.pi),
+    'draggy': dict(_BODY, m0=20000.0, m1=6000.0, Isp0=270.0, Isp1=300.0,
+                   Fmax=400000.0, cd=0.6, A=3.0, h_obj=75000.0,
+                   v_obj=2250.0, q_obj=0.5 * math.pi),
+}
+
+DEFAULT_BASELINE = pth.join(pth.dirname(pth.abspath(__file__)),
+                            'bench-baseline.json')
+
+
+def timed(func, repeat):
+    """Runs the function repeatedly.
+
+    :return: tuple of the median wall-clock time (s) and the last return value
+    """
+    times = []
+    res = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        res = func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), res
+
+
+def bench_solver(ns, profiles, transcriptions, repeat):
+    """Times the three phases of a computation: building the symbolic NLP,
+    creating the IPOPT solver and solving, for every transcription.
+    """
+    results = dict()
+    info = dict()
+    for N in ns:
+        for tr in transcriptions:
+            cls = gt.TRANSCRIPTIONS[tr]
+            prefix = 'solver/{}/N{}'.format(tr, N)
+            t_build, nlp = timed(lambda: cls.build_nlp(N), repeat)
+            results[prefix + '/build'] = t_build
+            t_create, S = timed(lambda: cs.nlpsol('S', 'ipopt', nlp,
+                                                  gt.SOLVER_OPTIONS), repeat)
+            results[prefix + '/create'] = t_create
+            solver = cls(N, S)
+            for name in profiles:
+                inputs = PROFILES[name]
+
+                def solve():
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        return solver.solve(**inputs)
+                t_solve, (r, stats) = timed(solve, repeat)
+                key = '{}/{}/solve'.format(prefix, name)
+                results[key] = t_solve
+                info[key] = {'status': stats['return_status'],
+                             'iterations': stats['iter_count'],
+                             'objective': float(r['f']),
+                             'time_horizon': float(r['x'][0])}
+                logging.info('%s: %.3f s (%s, %d iterations, objective %f)',
+                             key, t_solve, stats['return_status'],
+                             stats['iter_count'], float(r['f']))
+    return results, info
+
+
+def _build(transcription, N, threads=1):
+    """Builds the NLP and creates the IPOPT solver, meant to run in a fresh
+    process.
+
+    :return: tuple of the times (s) of building and of creating and the
+        growth of the peak resident set size (MiB)
+    """
+    gt.set_threads(threads)
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    cls = gt.TRANSCRIPTIONS[transcription]
+    start = time.perf_counter()
+    nlp = cls.build_nlp(N)
+    t_build = time.perf_counter() - start
+    start = time.perf_counter()
+    cs.nlpsol('S', 'ipopt', nlp, gt.SOLVER_OPTIONS)
+    t_create = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return t_build, t_create, (after - before) / 1024.0
+
+
+def bench_build(ns, transcriptions, repeat, threads=1):
+    """Times building the NLP and creating the solver for large numbers of
+    intervals and measures the memory it takes, every run in a fresh process.
+    The peak RSS growth (MiB) goes to the info.
+    """
+    results = dict()
+    info = dict()
+    ctx = mp.get_context('spawn')
+    for tr in transcriptions:
+        for N in ns:
+            runs = []
+            for _ in range(repeat):
+                with ctx.Pool(1) as pool:
+                    runs.append(pool.apply(_build, (tr, N, threads)))
+            prefix = 'build/{}/N{}'.format(tr, N)
+            results[prefix + '/build'] = statistics.median(r[0] for r in runs)
+            results[prefix + '/create'] = statistics.median(r[1]
+                                                            for r in runs)
+            info[prefix + '/rss'] = max(r[2] for r in runs)
+            logging.info('%s: build %.3f s, create %.3f s, peak RSS +%.1f MiB',
+                         prefix, results[prefix + '/build'],
+                         results[prefix + '/create'], info[prefix + '/rss'])
+    return results, info
+
+
+def compare_transcriptions(results, info, ns, profiles, transcriptions):
+    """Prints the solve times of the transcriptions side by side and the
+    fastest one for every N and profile.
+    """
+    print('{:<6} {:<8}'.format('N', 'profile') +
+          ''.join(' {:>24}'.format(tr) for tr in transcriptions) +
+          '  fastest')
+    for N in ns:
+        for name in profiles:
+            times = dict()
+            row = '{:<6} {:<8}'.format(N, name)
+            for tr in transcriptions:
+                key = 'solver/{}/N{}/{}/solve'.format(tr, N, name)
+                times[tr] = results[key]
+                row += ' {:>9.3f} s (obj {:.4f})'.format(
+                    results[key], info[key]['objective'])
+            print(row + '  ' + min(times, key=times.get))
+
+
+def _payload(n):
+    rng = np.random.default_rng(0)
+    return {key: rng.random(n + 1) for key in
+            ('time', 'mass', 'speed', 'altitude', 'control',
+             'body_curvature', 'vertical_angle')}
+
+
+def bench_koson(sizes, repeat):
+    results = dict()
+    for n in sizes:
+        data = _payload(n)
+        t_dump, text = timed(lambda: ks.dumps(data), repeat)
+        results['koson/N{}/dump'.format(n)] = t_dump
+        t_load, _ = timed(lambda: ks.loads(text), repeat)
+        results['koson/N{}/load'.format(n)] = t_load
+    return results
+
+
+def bench_raw(sizes, repeat):
+    """Times the raw data output path of ``gturn.write_result`` in every
+    format.
+    """
+    results = dict()
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            data = _payload(n)
+            for fmt, name in sorted(ot.RAW_FORMATS.items()):
+                fname = pth.join(tmp, name)
+                results['raw/N{}/{}'.format(n, fmt)], _ = timed(
+                    lambda: ot.write_raw(fname, data, fmt), repeat)
+    return results
+
+
+def compare(results, baseline, tolerance, min_diff):
+    """Compares the results with the baseline.
+
+    :return: list of the keys which regressed, i.e. are slower than the
+        baseline by more than the relative tolerance and by more than
+        ``min_diff`` seconds
+    """
+    regressions = []
+    print('{:<36} {:>11} {:>11} {:>8}'.format('benchmark', 'baseline',
+                                              'current', 'ratio'))
+    for key in sorted(results):
+        cur = results[key]
+        if key not in baseline:
+            print('{:<36} {:>11} {:>11.6f} {:>8}'.format(key, '-', cur, '-'))
+            continue
+        base = baseline[key]
+        ratio = cur / base if base > 0 else float('inf')
+        flag = ''
+        if ratio > 1.0 + tolerance and cur - base > min_diff:
+            regressions.append(key)
+            flag = '  REGRESSION'
+        print('{:<36} {:>11.6f} {:>11.6f} {:>8.2f}{}'.format(
+            key, base, cur, ratio, flag))
+    return regressions
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    epilog = '''
+    The benchmarks time:
+        * solver/<transcription>/N<N>/build - building the symbolic NLP
+        * solver/<transcription>/N<N>/create - creating the IPOPT solver
+        * solver/<transcription>/N<N>/<profile>/solve - solving for a vehicle
+                                       profile
+        * koson/N<N>/dump, load      - kOS-JSON encoding/decoding of a result
+                                       with N + 1 samples
+        * raw/N<N>/<format>          - writing the raw data file in the
+                                       given --raw-format
+        * build/<transcription>/N<N>/build, create - building the NLP and
+                                       creating the solver for the large
+                                       numbers of intervals --build-intervals,
+                                       each in a fresh process; the growth of
+                                       the peak RSS (MiB) is reported in the
+                                       info as build/<transcription>/N<N>/rss
+    If more than one transcription is benchmarked, their solve times (and
+    the objectives reached) are printed side by side together with the fastest
+    one for every N and profile.
+    Every benchmark is run --repeat times and the median is reported. The
+    results are written as JSON to --output (if given) and compared with the
+    baseline file. The program exits with status 1 if any benchmark regressed.
+    '''
+    ap = argparse.ArgumentParser(prog='bench.py',
+                                 description='Micro-benchmarks of gturn.',
+                                 epilog=textwrap.dedent(epilog),
+                                 formatter_class=argparse.RawTextHelpFormatter)
+    ap.add_argument('-n', '--shooting-intervals',
+                    nargs='+',
+                    type=int,
+                    default=[20, 50, 100],
+                    help='Numbers of shooting intervals (solver benchmarks) '
+                         'and of samples (koson and raw benchmarks). Default '
+                         'is 20 50 100.')
+    ap.add_argument('--profiles',
+                    nargs='+',
+                    choices=sorted(PROFILES),
+                    default=sorted(PROFILES),
+                    help='Vehicle profiles to solve. Default is all.')
+    ap.add_argument('--transcriptions',
+                    nargs='+',
+                    choices=sorted(gt.TRANSCRIPTIONS),
+                    default=sorted(gt.TRANSCRIPTIONS),
+                    help='Transcriptions to benchmark. Default is all.')
+    ap.add_argument('--suites',
+                    nargs='+',
+                    choices=['solver', 'koson', 'raw', 'build'],
+                    default=['solver', 'koson', 'raw'],
+                    help='Benchmark suites to run. Default is solver, koson '
+                         'and raw.')
+    ap.add_argument('--build-intervals',
+                    nargs='+',
+                    type=int,
+                    default=[250, 500, 1000, 2000],
+                    help='Numbers of intervals of the build benchmarks. '
+                         'Default is 250 500 1000 2000.')
+    ap.add_argument('-r', '--repeat',
+                    type=int,
+                    default=3,
+                    help='Number of repetitions of every benchmark. Default '
+                         'is 3.')
+    ap.add_argument('--intra-task-threads',
+                    type=int,
+                    default=1,
+                    help='Number of threads evaluating the shooting '
+                         'intervals of one solve, see gturn.py. Default is '
+                         '1.')
+    ap.add_argument('-o', '--output',
+                    help='File to write the results to (JSON).')
+    ap.add_argument('-b', '--baseline',
+                    default=DEFAULT_BASELINE,
+                    help='Baseline file to compare with. Default is '
+                         'bench-baseline.json next to this script.')
+    ap.add_argument('--save-baseline',
+                    action='store_true',
+                    help='Store the results as the new baseline instead of '
+                         'comparing with it.')
+    ap.add_argument('--tolerance',
+                    type=float,
+                    default=0.25,
+                    help='Relative slowdown considered a regression. Default '
+                         'is 0.25.')
+    ap.add_argument('--min-diff',
+                    type=float,
+                    default=1e-3,
+                    help='Absolute slowdown (s) below which a benchmark is '
+                         'never considered a regression. Default is 0.001.')
+    args = ap.parse_args()
+
+    results = dict()
+    info = dict()
+    ns = args.shooting_intervals
+    gt.set_threads(args.intra_task_threads)
+    if 'solver' in args.suites:
+        res, info = bench_solver(ns, args.profiles, args.transcriptions,
+                                 args.repeat)
+        results.update(res)
+        if len(args.transcriptions) > 1:
+            compare_transcriptions(res, info, ns, args.profiles,
+                                   args.transcriptions)
+    if 'koson' in args.suites:
+        results.update(bench_koson([n * 100 for n in ns] + ns, args.repeat))
+    if 'raw' in args.suites:
+        results.update(bench_raw([n * 100 for n in ns] + ns, args.repeat))
+    if 'build' in args.suites:
+        res, build_info = bench_build(args.build_intervals,
+                                      args.transcriptions, args.repeat,
+                                      args.intra_task_threads)
+        results.update(res)
+        info.update(build_info)
+
+    report = {'meta': {'date': datetime.datetime.now().isoformat(),
+                       'python': platform.python_version(),
+                       'casadi': cs.__version__,
+                       'numpy': np.__version__,
+                       'machine': platform.platform(),
+                       'repeat': args.repeat,
+                       'intra_task_threads': args.intra_task_threads},
+              'results': results,
+              'info': info}
+    if args.output is not None:
+        with open(args.output, mode='w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.save_baseline:
+        with open(args.baseline, mode='w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        logging.info('Baseline saved to %s', args.baseline)
+        return
+    if not pth.isfile(args.baseline):
+        logging.info('No baseline %s, nothing to compare with.',
+                     args.baseline)
+        compare(results, dict(), args.tolerance, args.min_diff)
+        return
+    with open(args.baseline, mode='r') as f:
+        baseline = json.load(f)['results']
+    regressions = compare(results, baseline, args.tolerance, args.min_diff)
+    if regressions:
+        logging.error('%d benchmark(s) regressed: %s', len(regressions),
+                      ', '.join(regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+# ----------------------------------------------------------------
+# Reference client of the socket endpoint of the gravity turn server
+# ----------------------------------------------------------------
+import argparse
+import itertools
+import logging
+import sys
+import textwrap
+
+import _endpoint as ep
+import koson as ks
+
+
+class Client(object):
+    """Client of the socket endpoint of the server (see --socket).
+
+    Requests are sent by :meth:`send` and the responses are read by
+    :meth:`receive` in the order the computations finish, so several requests
+    can be computed at once. :meth:`request` does both for a single request.
+    """
+
+    def __init__(self, address, timeout=None):
+        self.sock = ep.connect(address, timeout=timeout)
+        self._file = self.sock.makefile('rb')
+        self._ids = itertools.count()
+
+    def send(self, data, rid=None, metrics=False):
+        """Sends a request.
+
+        :param data: the input data (the content of input.json)
+        :param rid: id of the request returned in the response; if ``None``,
+            a new one is generated
+        :param metrics: if ``True``, the response contains the metrics of the
+            computation
+        :return: the id of the request
+        """
+        if rid is None:
+            rid = next(self._ids)
+        request = dict(data, id=rid)
+        if metrics:
+            request['metrics'] = True
+        self.sock.sendall((ks.dumps(request) + '\n').encode('utf-8'))
+        return rid
+
+    def receive(self):
+        """Waits for the next response.
+
+        :return: the result (with ``id`` and possibly ``metrics``)
+        :raises ConnectionError: if the server closed the connection
+        """
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError('Connection closed by the server.')
+        return ks.loads(line.decode('utf-8'))
+
+    def request(self, data, metrics=False):
+        """Sends a request and waits for its response (the client must not
+        have other requests pending)."""
+        rid = self.send(data, metrics=metrics)
+        response = self.receive()
+        if response.get('id') != rid:
+            raise ValueError('Unexpected response {}'.format(
+                response.get('id')))
+        return response
+
+    def close(self):
+        self._file.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    epilog = '''
+    Sends the input files (kOS-JSON, the same as input.json of the task dirs)
+    to the server at the given address (HOST:PORT or the path of a Unix
+    socket, see the --socket option of gturn.py) all at once and writes the
+    results, one kOS-JSON document per line, in the order of the input files.
+    '''
+    ap = argparse.ArgumentParser(prog='client.py',
+                                 description='Client of the gturn server.',
+                                 epilog=textwrap.dedent(epilog),
+                                 formatter_class=argparse.RawTextHelpFormatter)
+    ap.add_argument('address',
+                    help='Address of the server.')
+    ap.add_argument('inputs',
+                    nargs='+',
+                    help='Input files, - for the standard input.')
+    ap.add_argument('--metrics',
+                    action='store_true',
+                    help='If specified, the results contain the metrics of '
+                         'the computations.')
+    ap.add_argument('--timeout',
+                    type=float,
+                    help='Timeout (s) of the socket operations. Default is '
+                         'none.')
+    args = ap.parse_args()
+
+    data = []
+    for fname in args.inputs:
+        if fname == '-':
+            data.append(ks.load(sys.stdin))
+        else:
+            with open(fname, mode='r') as f:
+                data.append(ks.load(f))
+    failed = False
+    with Client(args.address, timeout=args.timeout) as client:
+        for rid, inputs in enumerate(data):
+            client.send(inputs, rid=rid, metrics=args.metrics)
+        responses = dict()
+        while len(responses) < len(data):
+            response = client.receive()
+            if 'id' not in response:
+                logging.error('Request rejected: %s', response.get('error'))
+                failed = True
+                break
+            responses[response['id']] = response
+    for rid in sorted(responses):
+        if 'error' in responses[rid]:
+            logging.error('%s: %s', args.inputs[rid], responses[rid]['error'])
+            failed = True
+        ks.dump(responses[rid], sys.stdout)
+        sys.stdout.write('\n')
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -8,6 +8,7 @@
 # https://mintoc.de/index.php/Gravity_Turn_Maneuver_(Casadi)
 # ----------------------------------------------------------------
 import argparse
+import functools
 import logging
 import multiprocessing as mp
 import os
@@ -15,31 +16,73 @@ import os.path as pth
 import sys
 import textwrap
 import time
-import numpy as np
 import subprocess
 
+import _batch as bt
+import _endpoint as ep
+import _feasibility as fs
 import _gturn as gt
+import _metrics as mt
+import _output as ot
+import _race as rc
+import _results as rs
+import _scheduler as sc
+import _surrogate as sg
+import _tasks as tk
+import _watch as wt
 import koson as ks
 
 
 class ProcessorLogger(object):
+    """File-like object forwarding the output of the computation to the log,
+    line by line, and optionally to a file.
+
+    The file is kept open and written through a buffer, so it has to be closed
+    by :meth:`close`, which also logs the last unterminated line.
+    """
+
     def __init__(self, level, name, file):
         self.level = level
         self.logger = logging.getLogger(name)
-        self.file = file
+        self.enabled = self.logger.isEnabledFor(level)
+        self._pending = ''
+        self.file = None
+        if file is not None:
+            self.file = open(file, mode='w')
+
+    def write(self, message):
+        if self.file is not None:
+            self.file.write(message)
+        if self.enabled:
+            lines = (self._pending + message).split('\n')
+            self._pending = lines.pop()
+            for m in lines:
+                self.logger.log(self.level, m)
+        return len(message)
 
+    def flush(self):
         if self.file is not None:
-            open(self.file, mode='w').close()
+            self.file.flush()
 
-    def write(self, message):
+    def close(self):
+        if self._pending:
+            self.logger.log(self.level, self._pending)
+            self._pending = ''
         if self.file is not None:
-            with open(self.file, mode='a') as f:
-                f.write(message)
-        for m in message.splitlines():
-            self.logger.log(self.level, m)
+            self.file.close()
+            self.file = None
 
 
-def gturn_wrapper(name, task_dir, store_logs, **kwargs):
+def gturn_wrapper(name, task_dir, store_logs, write_progress=False, **kwargs):
+    """Computes the gravity turn with the output of the computation
+    redirected to the log.
+
+    :param write_progress: if ``True``, the progress of the solver is written
+        to ``progress.json`` in the task dir
+    :return: tuple of the result of :func:`_gturn.compute_gravity_turn` and a
+        dictionary with the metrics of the computation
+    """
+    metrics = dict()
     sout = sys.stdout
     serr = sys.stderr
     if store_logs:
@@ -50,56 +93,141 @@ def gturn_wrapper(name, task_dir, store_logs, **kwargs):
     else:
         sys.stdout = ProcessorLogger(logging.DEBUG, 'gturn-' + name, None)
         sys.stderr = ProcessorLogger(logging.INFO, 'gturn-' + name, None)
+    if write_progress and task_dir is not None:
+        kwargs['progress_file'] = pth.join(task_dir, 'progress.json')
+    if isinstance(kwargs.get('previous'), str):
+        kwargs['previous'] = load_previous(kwargs['previous'])
+    wall = time.perf_counter()
+    cpu = time.process_time()
     try:
-        res = gt.compute_gravity_turn(**kwargs)
+        res = gt.compute_gravity_turn(metrics=metrics, **kwargs)
     finally:
+        sys.stdout.close()
+        sys.stderr.close()
         sys.stdout = sout
         sys.stderr = serr
-    return res
+    metrics['compute_wall'] = time.perf_counter() - wall
+    metrics['compute_cpu'] = time.process_time() - cpu
+    return res, metrics
 
 
-def scan_tasks(directory, skip_tasks):
-    logging.debug('Scanning master directory %s', directory)
-    ilock = 'input.lock'
-    idata = 'input.json'
-    odata = 'output.json'
-    tasks = []
-    for d in os.listdir(directory):
-        tskdir = pth.join(directory, d)
-        logging.debug('Scanning %s', tskdir)
-        if not pth.isdir(tskdir):
-            logging.debug('Skipping because %s is not a directory.', tskdir)
-            continue
-        if d in skip_tasks:
-            logging.debug('Skipping because %s is among skip tasks.', d)
-            continue
-        lockfile = pth.join(tskdir, ilock)
-        if pth.isfile(lockfile):
-            logging.debug('Skipping because lock file %s exists.', lockfile)
-            continue
-        datfile = pth.join(tskdir, idata)
-        if not pth.isfile(datfile):
-            logging.debug('Skipping because %s does not exist or is not '
-                          'a file.', datfile)
-            continue
-        outfile = pth.join(tskdir, odata)
-        if pth.isfile(outfile):
-            logging.debug('Skipping because result file %s already.', outfile)
-            continue
-        logging.debug('Found fresh data.')
-        with open(pth.join(tskdir, idata), mode='r') as f:
-            data = ks.load(f)
-            logging.debug('Loaded data: %s', str(data))
-            tasks.append((d, tskdir, data))
-    return tasks
-
-
-def write_result(directory, name, result, indent, write_raw_data):
-    if indent:
-        indent = 2
+def resolve_previous(data, base):
+    """Makes the path to the previous result of a re-planning task (the
+    "previous" entry of the input data) relative to the given directory."""
+    if isinstance(data.get('previous'), str):
+        data['previous'] = pth.join(base, data['previous'])
+
+
+def load_previous(path):
+    """Loads the previous result of a re-planning task.
+
+    :return: the result or ``None`` if it cannot be used, in which case the
+        re-planning starts from the default initial guess
+    """
+    try:
+        with open(path, mode='r') as f:
+            previous = ks.load(f)
+    except (OSError, ValueError, AssertionError) as e:
+        logging.warning('Previous result %s could not be loaded: %s', path, e)
+        return None
+    if not isinstance(previous, dict) or 'time' not in previous:
+        logging.warning('Previous result %s is not a result.', path)
+        return None
+    return previous
+
+
+def screen_task(name, issues):
+    """Logs the issues found by the feasibility screening of a task (see
+    :func:`_feasibility.screen`).
+
+    :return: ``False`` if the task is rejected
+    """
+    for issue in issues:
+        if issue['severity'] == 'error':
+            logging.error('Task %s rejected: %s', name, issue['message'])
+        else:
+            logging.warning('Task %s: %s', name, issue['message'])
+    return not fs.errors(issues)
+
+
+def compute_start(submit, name, task_dir, store_logs, write_progress, data,
+                  start, **kwargs):
+    """Submits the computation of a task from the given start of the
+    multi-start (see :class:`_race.Race`). Only the first start stores the
+    logs and writes the progress.
+
+    :param submit: ``SwitchPool.apply`` or ``Scheduler.submit``
+    :param kwargs: the priority, timeout and callback of the computation
+    """
+    first = start == 0
+    kwds = dict(data, start=start) if start else data
+    return submit(gturn_wrapper,
+                  args=(name, task_dir, store_logs and first,
+                        write_progress and first),
+                  kwds=kwds, **kwargs)
+
+
+def task_deadline(data, default, detected=None):
+    """Replaces the "deadline" entry of the input data, the seconds the
+    computation may take since the task was detected (see --deadline), by the
+    time (:func:`time.time`) by which the computation returns.
+
+    :param default: the seconds used if the input data have no deadline;
+        ``None`` for no deadline
+    :param detected: the time (:func:`time.monotonic`) the task was detected;
+        if ``None``, now
+    """
+    budget = data.pop('deadline', default)
+    if budget is None:
+        return
+    now = time.monotonic()
+    if detected is None:
+        detected = now
+    data['deadline'] = time.time() - (now - detected) + budget
+
+
+def output_spec(data, defaults):
+    """Takes the output options (the entries resample, tables and
+    table_points, see information about output) out of the input data, the
+    options not given fall back to the defaults.
+
+    :return: dictionary of the options and the remaining input data
+        (``constants``)
+    """
+    spec = {key: data.pop(key, (defaults or dict()).get(key))
+            for key in ('resample', 'tables', 'table_points')}
+    spec['constants'] = data
+    return spec
+
+
+def compact_result(name, result, spec=None, quality=None):
+    """Resamples a successful result for the output (see --resample-*) and
+    adds the lookup tables (see --tables) and the quality of a computation
+    with a deadline (see --deadline). A result for which this fails is
+    replaced by an error.
+    """
+    if 'error' in result or spec is None:
+        return result
+    try:
+        compact = dict(ot.resample(result, spec['resample']))
+        tables = ot.lookup_tables(result, spec['constants'], spec['tables'],
+                                  spec['table_points'])
+        if tables is not None:
+            compact['tables'] = tables
+        if quality is not None:
+            compact['quality'] = quality
+        return compact
+    except ValueError as e:
+        logging.error('Output of task %s could not be made: %s', name, e)
+        return {'error': str(e)}
+
+
+def write_result(directory, name, result, indent, write_raw_data,
+                 raw_format='txt', spec=None, quality=None):
+    indent = 2 if indent else None
     olock = 'output.lock'
     odata = 'output.json'
-    odata_raw = 'output-raw.txt'
+    odata_raw = ot.RAW_FORMATS[raw_format]
     tskdir = pth.join(directory, name)
     ofile = pth.join(tskdir, odata)
     ofile_raw = pth.join(tskdir, odata_raw)
@@ -110,106 +238,381 @@ def write_result(directory, name, result, indent, write_raw_data):
     with open(lockfile, mode='w') as f:
         f.write('')
 
+    compact = compact_result(name, result, spec, quality)
+
     logging.debug('Writing results file %s', ofile)
     with open(ofile, mode='w') as f:
-        ks.dump(result, f, indent=indent)
+        ks.dump(compact, f, indent=indent)
 
-    if write_raw_data:
+    if write_raw_data and 'error' not in result:
         logging.debug('Writing raw results file %s', ofile_raw)
-        bigdata = np.column_stack([result[key]
-                                   for key in sorted(result.keys())])
-        np.savetxt(ofile_raw, bigdata, delimiter='\t',
-                   header='\t'.join(sorted(result.keys())))
+        ot.write_raw(ofile_raw, result, raw_format)
 
     logging.debug('Removing lock file %s', lockfile)
     os.unlink(lockfile)
     logging.debug('Done.')
 
 
+def write_metrics(directory, name, metrics):
+    mfile = pth.join(directory, name, 'metrics.json')
+    logging.debug('Writing metrics file %s', mfile)
+    mt.write_json(mfile, metrics)
+
+
+def queue_wait(res):
+    """Returns the time (s) the task spent waiting for a worker."""
+    started = getattr(res, 'started', None)
+    if started is None:
+        return 0.0
+    return started - res.submitted
+
+
 class SwitchPool(object):
     class SyncResult(object):
-        def __init__(self, r):
+        def __init__(self, r, error=None):
             self.r = r
+            self.error = error
 
         def ready(self):
             return True
 
         def get(self):
+            if self.error is not None:
+                raise sc.TaskError(self.error)
             return self.r
 
-    def __init__(self, async, processes):
-        if async:
-            self.pool = mp.Pool(processes=processes)
-        self.async = async
+    def __init__(self, asynchronous, processes, initializer=None, initargs=()):
+        if asynchronous:
+            self.pool = sc.Scheduler(processes=processes,
+                                     initializer=initializer,
+                                     initargs=initargs)
+        elif initializer is not None:
+            initializer(*initargs)
+        self.asynchronous = asynchronous
 
-    def apply(self, func, args=(), kwds=()):
-        if self.async:
-            return self.pool.apply_async(func, args=args, kwds=kwds)
+    def apply(self, func, args=(), kwds=(), callback=None, priority=0,
+              timeout=None):
+        """Runs the function. In sync mode, priority and timeout are
+        ignored.
+        """
+        if self.asynchronous:
+            return self.pool.submit(func, args=args, kwds=kwds,
+                                    priority=priority, timeout=timeout,
+                                    callback=callback)
         else:
-            return SwitchPool.SyncResult(func(*args, **kwds))
+            try:
+                return SwitchPool.SyncResult(func(*args, **kwds))
+            except Exception as e:
+                logging.exception('Task failed.')
+                return SwitchPool.SyncResult(None, error=str(e))
+
+    def cancel(self, result):
+        if self.asynchronous:
+            self.pool.cancel(result)
+
+    def close(self):
+        if self.asynchronous:
+            self.pool.close()
+
+
+def result_config(worker_config):
+    """Returns the part of the worker configuration which influences the
+    results of the computations, used as a part of the result cache key.
+    """
+    config = {'solver': gt.solver_key()}
+    for key in ['polish', 'continuation', 'continuation_factor',
+                'continuation_tol']:
+        config[key] = worker_config[key]
+    if worker_config['solver_stub'] is not None:
+        config['solver_stub'] = worker_config['solver_stub']
+    if worker_config['multi_start'] > 1:
+        config['multi_start'] = [worker_config['multi_start'],
+                                 worker_config['multi_start_policy']]
+    surrogate = worker_config['surrogate']
+    if surrogate is not None:
+        st = os.stat(surrogate)
+        config['surrogate'] = [pth.abspath(surrogate), st.st_mtime_ns,
+                               st.st_size]
+    return config
+
+
+def open_result_cache(worker_config):
+    """Opens the result cache given by the worker configuration.
+
+    :return: tuple of the cache (``None`` if not configured) and the result
+        configuration (see :func:`result_config`)
+    """
+    if worker_config['result_cache'] is None:
+        return None, None
+    cache = rs.ResultCache(worker_config['result_cache'],
+                           max_bytes=worker_config['result_cache_size'],
+                           max_age=worker_config['result_cache_age'])
+    cache.evict()
+    return cache, result_config(worker_config)
+
+
+def cache_key(data, config, worker_config):
+    inputs = dict(data)
+    inputs.setdefault('transcription', worker_config['transcription'])
+    # only the results which met their deadline optimally are cached
+    inputs.pop('deadline', None)
+    return rs.result_key(inputs, config)
+
+
+def intra_task_threads(threads, processes):
+    """Returns the number of threads of one computation such that the
+    processes running the computations do not oversubscribe the CPUs.
 
+    :param threads: the requested number of threads or ``auto`` for all the
+        CPUs not taken by the other processes
+    """
+    cpus = os.cpu_count() or 1
+    available = max(1, cpus // processes)
+    if threads == 'auto':
+        return available
+    if threads > available:
+        logging.warning('%d processes with %d threads each exceed %d CPUs, '
+                        'using %d threads.', processes, threads, cpus,
+                        available)
+        return available
+    return threads
 
-def run(async, directory, indent, store_logs, write_raw_data):
-    logging.info('Starting gravity turn computation server. async=%s', async)
+
+def init_worker(worker_config):
+    """Configures the computation in a worker process.
+
+    :param worker_config: dictionary with keys ``solver_cache``,
+        ``compile_solvers``, ``solution_store``, ``surrogate``, ``polish``,
+        ``continuation``, ``continuation_factor``, ``continuation_tol``,
+        ``transcription``, ``intra_task_threads``, ``solver_stub`` and
+        ``deadline`` (see the corresponding command line options)
+    """
+    gt.set_transcription(worker_config['transcription'])
+    gt.set_threads(worker_config['intra_task_threads'])
+    gt.set_stub(worker_config['solver_stub'])
+    gt.set_deadlines(prepare=worker_config['deadline'] is not None)
+    gt.set_solution_store(worker_config['solution_store'])
+    gt.set_continuation(worker_config['continuation'],
+                        factor=worker_config['continuation_factor'],
+                        tol=worker_config['continuation_tol'])
+    gt.set_surrogate(worker_config['surrogate'],
+                     polish=worker_config['polish'])
+    if worker_config['solver_cache'] is None:
+        return
+    gt.set_solver_cache(worker_config['solver_cache'],
+                        compile=worker_config['compile_solvers'])
+    loaded = gt.load_solver_cache()
+    logging.info('Loaded cached solvers %s',
+                 ', '.join('{}-N{}'.format(*key) for key in loaded))
+
+
+def run(asynchronous, directory, indent, store_logs, write_raw_data,
+        worker_config, poll_interval, processes, task_timeout,
+        stats_file=None, write_progress=False, archive=None,
+        archive_age=None, raw_format='txt', output_defaults=None,
+        socket_address=None):
+    logging.info('Starting gravity turn computation server. async=%s',
+                 asynchronous)
     logging.info('Watching directory: %s', directory)
-    pool = SwitchPool(async, processes=1)
+    pool = SwitchPool(asynchronous, processes=processes,
+                      initializer=init_worker, initargs=(worker_config,))
+    watcher = wt.DirectoryWatcher(directory)
+    if watcher.event_driven:
+        logging.info('Watching for changes, rescanning every %s s.',
+                     poll_interval)
+    else:
+        logging.info('Polling every %s s.', poll_interval)
+    cache, config = open_result_cache(worker_config)
+    index = tk.TaskIndex(directory, archive=archive, archive_age=archive_age)
+    endpoint = None
+    if socket_address is not None:
+        endpoint = ep.Endpoint(socket_address, watcher.wake)
+        logging.info('Accepting requests at %s', socket_address)
+    requests = dict()
     running_tasks = dict()
-    while True:
-        logging.debug('Watching cycle start.')
-        tasks = scan_tasks(directory, running_tasks)
-        for name, task_dir, data in tasks:
-            running_tasks[name] = pool.apply(gturn_wrapper,
-                                             args=(name, task_dir, store_logs),
-                                             kwds=data)
-        for name in list(running_tasks.keys()):
-            res = running_tasks[name]
-            if res.ready():
-                write_result(directory, name, res.get(), indent, write_raw_data)
-                del running_tasks[name]
-        time.sleep(10)
-        logging.debug('Watching cycle end.')
+    task_metrics = dict()
+    task_keys = dict()
+    task_specs = dict()
+    stats = mt.RollingStats()
+
+    def publish(name, result, metrics, task_spec):
+        start = time.monotonic()
+        request = requests.pop(name, None)
+        if request is None:
+            write_result(directory, name, result, indent, write_raw_data,
+                         raw_format, task_spec, metrics.get('quality'))
+        else:
+            request.reply(compact_result(name, result, task_spec,
+                                         metrics.get('quality')),
+                          {key: value for key, value in metrics.items()
+                           if key != 'detected'})
+        end = time.monotonic()
+        metrics['serialization'] = end - start
+        metrics['end_to_end'] = end - metrics.pop('detected')
+        metrics['status'] = result.get('error', 'ok')
+        if request is None:
+            write_metrics(directory, name, metrics)
+            index.finished(name, ok='error' not in result)
+        stats.add(metrics)
+        if stats_file is not None:
+            stats.write(stats_file)
+
+    try:
+        while True:
+            logging.debug('Watching cycle start.')
+            tasks = index.scan()
+            if endpoint is not None:
+                for name, request, metrics in endpoint.requests():
+                    requests[name] = request
+                    tasks.append((name, None, request.data, metrics))
+            options = [(data.pop('priority', 0),
+                        data.pop('timeout', task_timeout),
+                        output_spec(data, output_defaults))
+                       for _, _, data, _ in tasks]
+            start = time.monotonic()
+            screened = [fs.options(priority, timeout) + issues
+                        for (priority, timeout, _), issues in zip(
+                            options,
+                            fs.screen([data for _, _, data, _ in tasks]))]
+            screening = (time.monotonic() - start) / max(1, len(tasks))
+            for (name, task_dir, data, metrics), \
+                    (priority, timeout, task_spec), issues in zip(
+                        tasks, options, screened):
+                metrics['screening'] = screening
+                if not screen_task(name, issues):
+                    metrics['strategy'] = 'rejected'
+                    publish(name, fs.error_result(issues), metrics, task_spec)
+                    continue
+                if task_dir is not None:
+                    resolve_previous(data, task_dir)
+                if cache is not None and 'state' not in data:
+                    start = time.monotonic()
+                    key = cache_key(data, config, worker_config)
+                    result = cache.get(key)
+                    metrics['cache_lookup'] = time.monotonic() - start
+                    if result is not None:
+                        logging.info('Task %s answered from the result '
+                                     'cache.', name)
+                        metrics['strategy'] = 'cache'
+                        publish(name, result, metrics, task_spec)
+                        continue
+                    task_keys[name] = key
+                task_deadline(data, worker_config['deadline'],
+                              metrics['detected'])
+                task_metrics[name] = metrics
+                task_specs[name] = task_spec
+                submit = functools.partial(compute_start, pool.apply, name,
+                                           task_dir,
+                                           store_logs and task_dir is not None,
+                                           write_progress, data,
+                                           callback=watcher.wake,
+                                           priority=priority, timeout=timeout)
+                running_tasks[name] = rc.Race(
+                    submit, worker_config['multi_start'],
+                    policy=worker_config['multi_start_policy'],
+                    cancel=pool.cancel, parallel=pool.asynchronous)
+            for name in list(running_tasks.keys()):
+                res = running_tasks[name]
+                if name in requests:
+                    gone = requests[name].closed
+                else:
+                    gone = not pth.isfile(pth.join(directory, name,
+                                                   'input.json'))
+                if gone:
+                    logging.info('Task %s abandoned (input removed or client '
+                                 'disconnected), cancelling.', name)
+                    res.cancel()
+                    index.cancelled(name)
+                    requests.pop(name, None)
+                    del running_tasks[name]
+                    del task_metrics[name]
+                    del task_specs[name]
+                    task_keys.pop(name, None)
+                    continue
+                if res.ready():
+                    metrics = task_metrics.pop(name)
+                    key = task_keys.pop(name, None)
+                    try:
+                        result, computed = res.get()
+                        metrics.update(computed)
+                        if result is None:
+                            result = {'error': 'computation failed'}
+                        elif key is not None and computed.get(
+                                'quality', 'optimal') == 'optimal':
+                            cache.put(key, result)
+                    except sc.TaskError as e:
+                        logging.error('Task %s failed: %s', name, e)
+                        result = {'error': str(e)}
+                    metrics['queue_wait'] = queue_wait(res)
+                    publish(name, result, metrics, task_specs.pop(name))
+                    del running_tasks[name]
+            watcher.wait(poll_interval)
+            logging.debug('Watching cycle end.')
+    finally:
+        if endpoint is not None:
+            endpoint.close()
+        watcher.close()
+        pool.close()
 
 
 def process(infile, outfile, indent, store_logs, write_raw_data,
-            postprocess_command):
-    if indent:
-        indent = 2
+            postprocess_command, worker_config, write_progress=False,
+            raw_format='txt', output_defaults=None):
+    indent = 2 if indent else None
+    init_worker(worker_config)
     logging.info('Processing file {}.'.format(infile))
     with open(infile, mode='r') as f:
         data = ks.load(f)
     if data is None:
         logging.error('Data could not be loaded. Exitting.')
         return
+    # the scheduling options of the server modes do not apply here
+    data.pop('priority', None)
+    data.pop('timeout', None)
+    spec = output_spec(data, output_defaults)
+    if not screen_task('processor', fs.check(data)):
+        return
+    resolve_previous(data, pth.dirname(infile))
+    task_deadline(data, worker_config['deadline'])
 
     logging.debug('Computing gravity turn...')
-    res = gturn_wrapper('processor', pth.dirname(outfile), store_logs, **data)
-    logging.debug('Computation finished.')
+    submit = functools.partial(compute_start,
+                               SwitchPool(False, processes=1).apply,
+                               'processor', pth.dirname(outfile), store_logs,
+                               write_progress, data)
+    try:
+        res, metrics = rc.Race(submit, worker_config['multi_start'],
+                               policy=worker_config['multi_start_policy'],
+                               parallel=False).get()
+    except sc.TaskError as e:
+        logging.error('Failed to compute: %s', e)
+        return
+    logging.debug('Computation finished. Metrics: %s', metrics)
     if res is None:
         logging.error('Failed to compute. No results written.')
         return
+    compact = compact_result('processor', res, spec, metrics.get('quality'))
+    if 'error' in compact:
+        return
 
     if outfile is None:
         logging.debug('Writing results to stdout')
-        ks.dump(res, sys.stdout, indent=indent, sort_keys=True)
+        ks.dump(compact, sys.stdout, indent=indent, sort_keys=True)
 
         if write_raw_data:
             logging.debug('Writing raw results to stdout')
-            bigdata = np.column_stack([res[key]
-                                       for key in sorted(res.keys())])
-            np.savetxt(sys.stdout.buffer, bigdata, delimiter='\t',
-                       header='\t'.join(sorted(res.keys())))
+            sys.stdout.flush()
+            ot.write_raw(sys.stdout.buffer, res, raw_format)
     else:
         logging.debug('Writing results to %s', outfile)
         with open(outfile, mode='w') as f:
-            ks.dump(res, f, indent=indent, sort_keys=True)
+            ks.dump(compact, f, indent=indent, sort_keys=True)
 
         if write_raw_data:
-            ofile_raw = pth.join(pth.dirname(outfile), 'output-raw.txt')
+            ofile_raw = pth.join(pth.dirname(outfile),
+                                 ot.RAW_FORMATS[raw_format])
             logging.debug('Writing raw results file %s', ofile_raw)
-            bigdata = np.column_stack([res[key]
-                                       for key in sorted(res.keys())])
-            np.savetxt(ofile_raw, bigdata, delimiter='\t',
-                       header='\t'.join(sorted(res.keys())))
+            ot.write_raw(ofile_raw, res, raw_format)
 
     if postprocess_command is not None:
         subprocess.run(postprocess_command, shell=True,
@@ -217,23 +620,145 @@ def process(infile, outfile, indent, store_logs, write_raw_data,
     logging.info('Results written.')
 
 
+def precompute(specfile, outfile, processes, worker_config):
+    logging.info('Precomputing grid specified in %s', specfile)
+    with open(specfile, mode='r') as f:
+        try:
+            spec = sg.load_spec(f)
+        except ValueError as e:
+            logging.error('Invalid grid specification: %s', e)
+            return
+    if spec['transcription'] is None:
+        spec['transcription'] = worker_config['transcription']
+    # the grid is being computed, it cannot answer its own points
+    worker_config = dict(worker_config, surrogate=None)
+    pool = mp.Pool(processes=processes, initializer=init_worker,
+                   initargs=(worker_config,))
+    pending = dict()
+    for index, inputs in sg.grid_points(spec):
+        name = 'grid-' + '-'.join(str(i) for i in index)
+        pending[index] = pool.apply_async(gturn_wrapper,
+                                          args=(name, None, False),
+                                          kwds=inputs)
+    pool.close()
+    results = dict()
+    for n, (index, res) in enumerate(pending.items()):
+        try:
+            results[index] = res.get()[0]
+        except Exception as e:
+            logging.error('Grid point %s failed: %r', index, e)
+            results[index] = None
+        logging.info('Grid point %d/%d done.', n + 1, len(pending))
+    pool.join()
+    sg.save_grid(outfile, spec, results)
+
+
+def batch(target, outfile, processes, kos_output, indent, task_timeout,
+          worker_config, output_defaults=None):
+    indent = 2 if indent else None
+    tasks = bt.collect_tasks(target)
+    logging.info('Batch of %d tasks from %s', len(tasks), target)
+    if kos_output is not None:
+        os.makedirs(kos_output, exist_ok=True)
+    cache, config = open_result_cache(worker_config)
+    pool = sc.Scheduler(processes=processes, initializer=init_worker,
+                        initargs=(worker_config,))
+    try:
+        pending = []
+        specs = []
+        inputs = []
+        for name, source, data in tasks:
+            data = dict(data)
+            options = (data.pop('priority', 0),
+                       data.pop('timeout', task_timeout))
+            specs.append(output_spec(data, output_defaults))
+            inputs.append((data, options))
+        screened = [fs.options(*options) + issues
+                    for (_, options), issues in zip(
+                        inputs, fs.screen([data for data, _ in inputs]))]
+        for (name, source, _), (data, (priority, timeout)), issues in zip(
+                tasks, inputs, screened):
+            if not screen_task(name, issues):
+                pending.append((None, SwitchPool.SyncResult(
+                    None, error=fs.error_result(issues)['error'])))
+                continue
+            resolve_previous(data, pth.dirname(source))
+            key = None
+            if cache is not None and 'state' not in data:
+                key = cache_key(data, config, worker_config)
+                res = cache.get(key)
+                if res is not None:
+                    pending.append((key, SwitchPool.SyncResult(
+                        (res, {'strategy': 'cache'}))))
+                    continue
+            task_deadline(data, worker_config['deadline'])
+            submit = functools.partial(compute_start, pool.submit, name,
+                                       None, False, False, data,
+                                       priority=priority, timeout=timeout)
+            pending.append((key, rc.Race(
+                submit, worker_config['multi_start'],
+                policy=worker_config['multi_start_policy'],
+                cancel=pool.cancel)))
+        results = []
+        metrics = []
+        for n, ((name, _, _), (key, task)) in enumerate(zip(tasks, pending)):
+            while not task.ready():
+                # decide the later races too, so that their losers are
+                # cancelled as soon as possible
+                for _, other in pending[n + 1:]:
+                    other.ready()
+                time.sleep(0.01)
+            try:
+                res, computed = task.get()
+                metrics.append(dict(computed, queue_wait=queue_wait(task)))
+                if res is None:
+                    res = 'computation failed'
+                elif (key is not None and
+                      computed.get('strategy') != 'cache' and
+                      computed.get('quality', 'optimal') == 'optimal'):
+                    cache.put(key, res)
+            except sc.TaskError as e:
+                res = str(e)
+                metrics.append({'queue_wait': queue_wait(task)})
+            if isinstance(res, str):
+                logging.error('Task %s failed: %s', name, res)
+            elif kos_output is not None:
+                compact = compact_result(name, res, specs[n],
+                                         computed.get('quality'))
+                with open(pth.join(kos_output, name + '.json'),
+                          mode='w') as f:
+                    ks.dump(compact, f, indent=indent, sort_keys=True)
+            results.append(res)
+            logging.info('Task %d/%d done.', n + 1, len(tasks))
+    finally:
+        pool.close()
+    bt.save_results(outfile, tasks, results, metrics)
+
+
 def main():
     logging.basicConfig(level=logging.DEBUG)
     epilog = '''
     RUN MODES
 
-    The program can run in three modes: server-sync, server-async and direct.
+    The program can run in five modes: server-sync, server-async, direct,
+    precompute and batch.
 
     Modes server-sync, server-async
 
     Both of these modes have the same logic and their difference is explained at
     the end of this section. Both of these modes can be called server modes.
 
-    In a server mode the program periodically checks the given directory for
-    input data files. Whenever it detects a ready data file it loads it and
-    dispatches a computation task to compute a gravity turn based on the data
-    loaded from the file. The result is written to the corresponding file. In
-    this mode the program runs until manually interrupted (e.g. by Ctrl+C).
+    In a server mode the program watches the given directory for input data
+    files. Whenever it detects a ready data file it loads it and dispatches a
+    computation task to compute a gravity turn based on the data loaded from
+    the file. The result is written to the corresponding file as soon as the
+    computation finishes. In this mode the program runs until manually
+    interrupted (e.g. by Ctrl+C).
+
+    On Linux, the changes of the directory are detected immediately using
+    inotify. Additionally (and on other systems or on file systems not
+    supporting inotify exclusively) the directory is rescanned periodically,
+    see --poll-interval.
 
     The monitored directory is expected to contain subdirectories, one for each
     computation (let's call these "task dirs"). A task dir can contain these
@@ -249,6 +774,9 @@ def main():
         * output.lock - if this file exists it is not safe to read the
                         output.json file; this file is written and deleted by
                         this program
+        * progress.json - with --write-progress, the progress of the running
+                        computation in kOS-JSON format, see below; this file
+                        is written by this program
     The output data and lock (output.json and output.lock) are written into the
     same task dir where the corresponding input.json was located.
 
@@ -260,12 +788,259 @@ def main():
     as asynchronous tasks in their own processes, i.e. two computations can run
     concurently (if properly configured).
 
+    Besides the input data, input.json may contain the entry "transcription"
+    overriding --transcription for the computation.
+
+    In async mode the computations run in a pool of --processes worker
+    processes. Besides the input data, input.json may contain these entries:
+        * priority - number; pending tasks with higher priority are started
+                     first (default is 0)
+        * timeout  - maximum wall-clock time of the computation in seconds; a
+                     computation running longer is killed (default is given by
+                     --task-timeout)
+    With --intra-task-threads, every computation with the shooting
+    --transcription additionally evaluates its shooting intervals by several
+    threads, so that even a single task uses several cores. The number of
+    threads is limited so that --processes times the threads do not exceed
+    the number of CPUs: "-p 1 --intra-task-threads auto" gives a single
+    urgent task the whole machine, while "-p <CPUs>" gives the most tasks per
+    second. The results differ from the serial evaluation only within the
+    tolerances of the solver.
+    A pending or running computation is cancelled if its task dir or its
+    input.json file is removed. A computation which fails, times out or is
+    killed results in an output.json containing a lexicon with a single key
+    "error" with the description of the error.
+
+    After the output.json of a task is written, the metrics of the task are
+    written to metrics.json (plain JSON) in its task dir. All the times are in
+    seconds:
+        * input_load    - loading input.json
+        * screening     - the feasibility screening (see below)
+        * queue_wait    - waiting for a free worker process (async mode)
+        * build, setup  - building the NLP and creating the solver, present
+                          only if the solver had to be built
+        * load          - loading the solver from --solver-cache, present only
+                          if it was loaded
+        * compute_wall, compute_cpu - wall-clock and CPU time of the whole
+                          computation in the worker
+        * ipopt         - solver status, iteration count, wall-clock and CPU
+                          time and the numbers of calls and wall-clock times
+                          of the function evaluations
+        * serialization - writing output.json (and the raw data)
+        * end_to_end    - from detecting the input to publishing the output
+        * transcription - transcription of the problem
+        * cache_lookup  - looking the task up in the --result-cache
+        * strategy      - how the result was obtained (cold, warm, surrogate,
+                          polish, continuation, replan, cache, rejected,
+                          stub), solver_source - memory, disk or built
+        * mesh          - with --continuation, the metrics of the solutions
+                          on the coarse grids (N, solver source and timings,
+                          ipopt, difference from the previous grid)
+        * objective, converged - the objective reached and whether the
+                          solver converged
+        * quality, violation, ladder - with a deadline, the quality of the
+                          result, the maximum violation of its constraints
+                          and the attempts made (attempt, N, status and
+                          iterations of each)
+        * start, race   - with --multi-start, the start which won (if not the
+                          first one) and the numbers of the starts, of the
+                          finished and of the converged computations
+        * status        - "ok" or the error description
+
+    Before a task is dispatched, its inputs are screened (analytically, in
+    microseconds) for missing, unknown or invalid entries (including a
+    "priority" or "timeout" which is not a number), for a thrust to weight
+    ratio at launch Fmax / (m0 * g0) of at most 1 and for an ideal delta-v
+    Isp1 * g0 * ln(m0 / m1) below the speed equivalent to the kinetic and
+    potential energy of the target (needed even without losses). Such a task
+    is rejected without a computation: its output.json contains "error" and
+    "feasibility", a list of the issues found, each a lexicon of "check"
+    (inputs, values, options, twr or delta_v), "severity", "message" and, for
+    the vehicle checks, "value" and "limit". A delta-v margin below 10 %
+    is only logged as a warning. The same screening applies in the other
+    modes.
+
+    The server keeps an index of the task dirs and examines a task dir again
+    only when its modification time changes, i.e. when a file is created or
+    removed in it. With --archive, task dirs whose output.json was written
+    more than --archive-age seconds ago are moved into the given directory,
+    keeping the monitored directory small.
+
+    With --socket, the server also accepts requests over a TCP or Unix
+    socket, e.g. from tools running outside of KSP, without the round trips
+    through the file system. A client sends one request per line, a kOS-JSON
+    (or plain JSON) document with the same content as input.json, and may
+    send more requests without waiting for the responses. Besides the input
+    data, a request may contain "id" (returned in the response) and "metrics"
+    (if true, the response contains the metrics of the computation). Every
+    response is one line with the content of output.json (and "id" and
+    "metrics"); the responses are sent in the order the computations finish.
+    The requests share the worker processes, the caches and --stats-file with
+    the task dirs. The computations of a client which disconnects are
+    cancelled. See client.py for a reference client.
+
+    A task can re-plan the rest of an ascent in flight. Then input.json
+    contains, besides the regular input data, these entries:
+        * state    - the current state of the vehicle, a list [m, v, q, h, d]
+                     (mass, speed, angle to vertical, altitude and body
+                     curvature angle); m0 stays the launch mass
+        * previous - optional path to the output.json of the previous plan
+                     (relative to the task dir), e.g. "../ascent-1/output.json"
+        * elapsed  - seconds since the start of the previous plan
+    The remaining trajectory is solved from the state with the rest of the
+    previous plan (shifted by elapsed) as the initial guess, which takes only
+    a few solver iterations. The times of the result are relative to the
+    moment of the state. Re-planning tasks do not use --surrogate,
+    --solution-store, --continuation and --result-cache; with the
+    collocation --transcription and an already built solver they typically
+    take a small fraction of a second.
+
+    With --multi-start, every task is computed from several initial guesses
+    (different time horizons, control levels and pitch profiles) at once, each
+    in its own worker process. With the "first" --multi-start-policy the
+    first converged solution wins and the other computations are killed;
+    with "best" all the computations are awaited and the converged solution
+    with the best objective wins. This trades CPU time for a shorter and more
+    predictable latency and fewer failed tasks. Only the first start (the
+    regular computation, which also uses --solution-store and --surrogate)
+    writes the logs and progress.json. In server-sync and direct modes, the
+    starts are tried one after another until one converges.
+
+    A task which must be answered in time (e.g. a re-planning in flight) may
+    contain "deadline", the seconds since the task is detected by which the
+    computation returns (--deadline gives the default for the tasks without
+    it). The solver is stopped in time and, if it did not converge, the
+    fallbacks are tried in the time left: a warm restart from the best
+    iterate with loose tolerances, then a 4 times coarser grid. The best
+    result is returned and output.json contains "quality": "optimal" (the
+    computation converged), "suboptimal" (a fallback converged) or
+    "infeasible" (nothing converged, the iterate violating the constraints
+    the least is returned). Creating the solver variants used by the
+    deadlines takes about as long as creating the solver itself; with
+    --deadline they are created together with the solvers, otherwise the
+    first task with a deadline of every N (per worker process) may overrun
+    its deadline by that time. The solver is stopped at the end of an
+    iteration, so very short deadlines may still be overrun by one iteration
+    (tens of milliseconds for the shooting transcription).
+
+    With --result-cache, the results are also stored in the given directory,
+    keyed by a hash of the input data and of the configuration influencing
+    the result. A task whose input data (without "priority", "timeout",
+    "deadline" and the output options) were already computed is answered
+    from this cache immediately, without a computation. The results of the
+    computations with a deadline are cached only if they are optimal. The
+    cache can be shared by several servers; the least recently used results
+    are removed when it grows over --result-cache-size, and results not used
+    for --result-cache-age are removed too.
+
+    With --write-progress, progress.json is rewritten (atomically, at most
+    every 0.1 s) during the computation. It is a lexicon with the keys
+        * status        - "running", or the final solver status
+        * iteration     - number of the solver iteration
+        * objective     - fraction of the propellant used so far
+        * infeasibility - maximum violation of the constraints
+        * elapsed       - seconds since the solver started
+
+    With --stats-file, the percentiles of the numeric metrics over the recent
+    tasks are kept in the given file, rewritten after every task.
+
     Direct mode
 
     In direct mode the program loads the given input data file, computes the
     gravity turn and writes the result to the given output data file and then
     exits. In contrast to the server mode, in direct mode the file is always
     loaded and the result is always written, no locks are checked.
+
+    Precompute mode
+
+    In precompute mode the program computes the gravity turns for all points of
+    a grid over the input data and stores the profiles to a single compressed
+    file. The grid is specified by a plain JSON file given by --target, e.g.:
+        {
+          "N": 100,
+          "base": {"m0": 20000, "m1": 6000, "g0": 9.81, ...},
+          "axes": {"m0": [18000, 20000, 22000],
+                   "Fmax": {"start": 350000, "stop": 450000, "num": 5}}
+        }
+    where "base" is complete input data and "axes" lists the values of the
+    inputs spanned by the grid. The grid points are computed in parallel by
+    --processes processes and the result is written to the file given by
+    --output. The grid is computed with the transcription of the base data
+    or --transcription and answers only the requests with the same one.
+
+    The grid file can then be given to the other modes with the --surrogate
+    option. Requests whose input data equals the base data in all inputs not
+    spanned by the grid and lies within the grid in the others are answered by
+    interpolating the neighbouring grid points instead of computing. With the
+    --polish option, the interpolated profile is used as the initial guess of a
+    regular computation instead.
+
+    Batch mode
+
+    In batch mode the program computes many gravity turns in one run, in
+    parallel by --processes processes. The --target is one of:
+        * a directory - every input.json in its subdirectories (i.e. the layout
+          of the server modes) and every *.json file directly in it is loaded
+        * a parameter sweep specification - a plain JSON file in the format of
+          the precompute mode; every grid point is computed
+        * a glob pattern (quoted) or a single kOS-JSON input file
+    All the results are written to a single columnar .npz file given by
+    --output: each result quantity (time, mass, ...) is one column
+    concatenated over all the tasks, the columns "offset" and "length" give
+    the rows of each task, "name" and "ok" give the names of the tasks and
+    whether they succeeded and "input/<name>" hold the inputs of the tasks.
+    A JSON index listing the tasks, their sources, rows and errors is written
+    next to it as <output without extension>-index.json, together with the
+    metrics of the tasks (see server modes). With --kos-output,
+    the result of every task is also written as kOS-JSON <name>.json into the
+    given directory.
+
+    OUTPUT
+
+    By default, output.json contains all N + 1 samples of the profiles. As
+    kOS reads and processes every element, the profiles can be resampled to
+    a few points (the first and the last samples are always kept):
+        * --resample-altitude - at the given altitudes (m), e.g. for a
+                                steering loop looking the pitch up by altitude
+        * --resample-time     - at the given times (s) since the start
+        * --resample-tol      - at as few samples as possible such that the
+                                linear interpolation between them deviates
+                                from every profile by at most the given
+                                fraction of its range (e.g. 0.005)
+    Every input.json may override these options by the entry "resample", a
+    lexicon with exactly one of the keys "altitude" (list), "time" (list) or
+    "tolerance" (number). The resampling applies to output.json (and to
+    --kos-output in batch mode); the raw data and the cached results always
+    keep all the samples.
+
+    With --tables, output.json also contains the entry "tables", lookup
+    tables of quantities derived from the profiles for the steering loop:
+        * pitch            - angle of the velocity above the horizon (deg) by
+                             altitude
+        * throttle         - the control by time
+        * dynamic_pressure - dynamic pressure (Pa) by altitude
+        * twr              - thrust to weight ratio by time
+        * apoapsis         - apoapsis altitude (m) of the coasting trajectory
+                             (negative if escaping) by time
+    Every table is a lexicon of "key" (the quantity it is keyed by),
+    "breakpoints" (--table-points evenly spaced values of the key, sorted),
+    "values", "start" and "step" (the first breakpoint and the stride), so
+    the value at x is found at the index floor((x - start) / step) or by
+    binary search in the breakpoints (see tableLookup and tableSearch in
+    libraries/math.ks). The values are interpolated linearly between the
+    breakpoints, except for the tables with "hold" true (throttle, which is
+    constant over the intervals of the solution), whose value holds from a
+    breakpoint to the next one. The tables are made from all the samples,
+    regardless of the resampling. Every input.json may override these
+    options by the entries "tables" (true or a list of the names) and
+    "table_points".
+
+    The raw data (--write-raw-data) are written as output-raw.<--raw-format>:
+        * txt - gnuplot-compatible text table, one column per quantity in the
+                alphabetical order named in the header line
+        * npy - NumPy structured array with one field per quantity, can be
+                memory-mapped by numpy.load(..., mmap_mode='r')
+        * npz - NumPy archive with one array per quantity
     '''
     ap = argparse.ArgumentParser(prog='gturn.py',
                                  description='Utility for computing gravity '
@@ -274,7 +1049,8 @@ def main():
                                  formatter_class=argparse.RawTextHelpFormatter)
     ap.add_argument('-m', '--mode',
                     nargs=1,
-                    choices=['server-sync', 'server-async', 'direct'],
+                    choices=['server-sync', 'server-async', 'direct',
+                             'precompute', 'batch'],
                     default='server',
                     required=False,
                     help='Specifies the mode the program will run in. See '
@@ -293,28 +1069,143 @@ def main():
     ap.add_argument('-p', '--processes',
                     nargs=1,
                     required=False,
-                    default=1,
+                    default=[1],
                     type=check_processes,
                     help='Specifies the number of simultaneous computation '
                          'processes (not counting the main process scanning '
                          'the directory) that can run concurrently. Must be '
                          'greater than 0. Default is 1.')
+
+    def check_seconds(x):
+        try:
+            x = float(x)
+            if x <= 0:
+                raise ValueError()
+            return x
+        except ValueError:
+            raise argparse.ArgumentTypeError('Time must be a number greater '
+                                             'than 0.')
+
+    def check_size(x):
+        try:
+            x = float(x)
+            if x <= 0:
+                raise ValueError()
+            return x
+        except ValueError:
+            raise argparse.ArgumentTypeError('Size must be a number greater '
+                                             'than 0.')
+
+    def check_tolerance(x):
+        try:
+            x = float(x)
+            if x <= 0:
+                raise ValueError()
+            return x
+        except ValueError:
+            raise argparse.ArgumentTypeError('Tolerance must be a number '
+                                             'greater than 0.')
+
+    def check_starts(x):
+        try:
+            x = int(x)
+            if not 1 <= x <= len(gt.START_GUESSES):
+                raise ValueError()
+            return x
+        except ValueError:
+            raise argparse.ArgumentTypeError(
+                'Number of starts must be an integer between 1 and '
+                '{}.'.format(len(gt.START_GUESSES)))
+
+    def check_factor(x):
+        try:
+            x = int(x)
+            if x < 2:
+                raise ValueError()
+            return x
+        except ValueError:
+            raise argparse.ArgumentTypeError('Refinement factor must be an '
+                                             'integer of at least 2.')
+
+    def check_coarse(x):
+        try:
+            x = int(x)
+            if x < 1:
+                raise ValueError()
+            return x
+        except ValueError:
+            raise argparse.ArgumentTypeError('Number of shooting intervals '
+                                             'must be an integer of at least '
+                                             '1.')
+
+    def check_difference(x):
+        try:
+            x = float(x)
+            if not 0 < x < float('inf'):
+                raise ValueError()
+            return x
+        except ValueError:
+            raise argparse.ArgumentTypeError('Tolerance must be a finite '
+                                             'number greater than 0.')
+    ap.add_argument('--poll-interval',
+                    nargs=1,
+                    required=False,
+                    default=[10.0],
+                    type=check_seconds,
+                    help='Specifies the interval (in seconds) of the periodic '
+                         'rescan of the monitored directory in server mode. '
+                         'Default is 10.')
+    ap.add_argument('--task-timeout',
+                    nargs=1,
+                    required=False,
+                    default=[None],
+                    type=check_seconds,
+                    help='Specifies the default maximum wall-clock time (in '
+                         'seconds) of a computation in server-async and batch '
+                         'modes. '
+                         'Computations running longer are killed. Default is '
+                         'no limit.')
+    ap.add_argument('--deadline',
+                    nargs=1,
+                    type=check_seconds,
+                    help='If specified, the default time (in seconds since '
+                         'the task is detected) by which a computation '
+                         'returns its best result so far. See information '
+                         'about server modes. The solvers are prepared for '
+                         'deadlines. Default is no deadline.')
+    ap.add_argument('--stats-file',
+                    nargs=1,
+                    help='If in server mode, the percentiles of the metrics '
+                         'of the recent tasks will be written to the given '
+                         'file (plain JSON) after every task. Ignored for '
+                         'other modes.')
     ap.add_argument('-t', '--target',
                     nargs=1,
                     required=True,
                     help='If in server mode, the path specifies the monitored '
                          'directory. If in direct mode, the path specifies the '
-                         'input data file.')
+                         'input data file. If in precompute mode, the path '
+                         'specifies the grid specification file. If in batch '
+                         'mode, the path specifies the input data, see '
+                         'information about the batch mode.')
     ap.add_argument('-o', '--output',
                     nargs=1,
                     help='If in direct mode, the result will be written to the '
                          'given file. If not present, the result will be '
-                         'printed to the standard output. Ignored for server '
-                         'mode.')
+                         'printed to the standard output. If in precompute '
+                         'mode, the grid will be written to the given file '
+                         '(required). If in batch mode, the results will be '
+                         'written to the given .npz file (required). Ignored '
+                         'for server mode.')
     ap.add_argument('-i', '--indent',
                     action='store_true',
                     help='If specified, the output files (regardless of the '
                          'mode or the destination file) will be indented.')
+    ap.add_argument('--kos-output',
+                    nargs=1,
+                    help='If in batch mode, the result of every task will also '
+                         'be written in kOS-JSON format to the given '
+                         'directory. Ignored for other modes.')
     ap.add_argument('--write-computation-log',
                     action='store_true',
                     help='If specified, the raw log of the computation will be '
@@ -326,14 +1217,73 @@ def main():
                          'printed.')
     ap.add_argument('--write-raw-data',
                     action='store_true',
-                    help='If specified, the raw data in gnuplot-compatible '
-                         'format will be written to a file. The file is stored '
+                    help='If specified, the raw data (all the samples) in the '
+                         'format given by --raw-format will be written to a '
+                         'file. The file is stored '
                          'in the corresponding task dir in case of server '
                          'mode, or in the directory of the output file if in '
                          'direct mode with --output option specified. If in '
                          'direct mode and --output option is not specified, '
                          'the data will be printed to standard output after '
                          'the kOS-JSON data.')
+    ap.add_argument('--raw-format',
+                    nargs=1,
+                    choices=sorted(ot.RAW_FORMATS),
+                    default=['txt'],
+                    help='Specifies the format of the raw data written by '
+                         '--write-raw-data. See information about output. '
+                         'Default is txt.')
+    resample = ap.add_mutually_exclusive_group()
+    resample.add_argument('--resample-altitude',
+                          nargs='+',
+                          type=float,
+                          help='If specified, the profiles in the output are '
+                               'sampled at the given altitudes. See '
+                               'information about output.')
+    resample.add_argument('--resample-time',
+                          nargs='+',
+                          type=float,
+                          help='If specified, the profiles in the output are '
+                               'sampled at the given times. See information '
+                               'about output.')
+    resample.add_argument('--resample-tol',
+                          nargs=1,
+                          type=check_tolerance,
+                          help='If specified, the profiles in the output are '
+                               'reduced to the samples needed to keep the '
+                               'given relative interpolation error. See '
+                               'information about output.')
+    ap.add_argument('--tables',
+                    nargs='*',
+                    choices=sorted(ot.TABLES),
+                    help='If specified, the output contains lookup tables of '
+                         'the given derived quantities (all of them if none '
+                         'is given). See information about output.')
+
+    def check_points(x):
+        try:
+            x = int(x)
+            if x < 2:
+                raise ValueError()
+            return x
+        except ValueError:
+            raise argparse.ArgumentTypeError('Number of points must be an '
+                                             'integer of at least 2.')
+    ap.add_argument('--table-points',
+                    nargs=1,
+                    default=[ot.DEFAULT_TABLE_POINTS],
+                    type=check_points,
+                    help='Specifies the number of the breakpoints of the '
+                         'lookup tables. Default is {}.'.format(
+                             ot.DEFAULT_TABLE_POINTS))
+    ap.add_argument('--write-progress',
+                    action='store_true',
+                    help='If specified, the progress of the computation is '
+                         'written to the file progress.json while it runs. '
+                         'The file is stored in the corresponding task dir in '
+                         'case of server mode, or in the directory of the '
+                         'output file if in direct mode with --output option '
+                         'specified. Ignored for other modes.')
     ap.add_argument('--postprocess-command',
                     nargs=1,
                     help='If specified, this command will be run after the '
@@ -343,13 +1293,223 @@ def main():
                          'of direct mode with --output specified, or the '
                          'working directory of this program (gturn) in case of '
                          'direct mode without --output option specified.')
+    ap.add_argument('--solver-cache',
+                    nargs=1,
+                    help='If specified, the built solvers are stored in the '
+                         'given directory and loaded from it at startup, so '
+                         'they do not need to be built again after a restart. '
+                         'Cached solvers built by a different version of '
+                         'this program or CasADi are rebuilt automatically.')
+    ap.add_argument('--compile-solvers',
+                    action='store_true',
+                    help='If specified together with --solver-cache, the '
+                         'solvers are also compiled to shared libraries using '
+                         'the C compiler given by the CC environment variable '
+                         '(cc by default). Solvers that cannot be compiled are '
+                         'cached in the serialized form only.')
+    ap.add_argument('--solution-store',
+                    nargs=1,
+                    help='If specified, every successful computation is '
+                         'stored in the given directory and new computations '
+                         'start from the stored solution with the most similar '
+                         'input data instead of the default initial guess. '
+                         'The directory can be shared by several processes.')
+    ap.add_argument('--surrogate',
+                    nargs=1,
+                    help='If specified, requests within the grid stored in the '
+                         'given file (created by the precompute mode) are '
+                         'answered by interpolation. See information about '
+                         'the precompute mode.')
+    ap.add_argument('--polish',
+                    action='store_true',
+                    help='If specified together with --surrogate, the '
+                         'interpolated profile is only used as the initial '
+                         'guess of a regular computation.')
+    ap.add_argument('--socket',
+                    nargs=1,
+                    help='If specified in server mode, computation requests '
+                         'are also accepted at the given address: HOST:PORT '
+                         '(TCP) or the path of a Unix socket. See '
+                         'information about server modes.')
+    ap.add_argument('--archive',
+                    nargs=1,
+                    help='If specified in server mode, finished task dirs are '
+                         'moved into the given directory after '
+                         '--archive-age.')
+    ap.add_argument('--archive-age',
+                    nargs=1,
+                    default=[86400.0],
+                    type=check_seconds,
+                    help='Specifies how long (in seconds) a finished task dir '
+                         'stays in the monitored directory if --archive is '
+                         'specified. Default is 86400 (one day).')
+    ap.add_argument('--result-cache',
+                    nargs=1,
+                    help='If specified, the results are cached in the given '
+                         'directory and tasks with the same input data are '
+                         'answered from the cache in server and batch modes. '
+                         'See information about server modes.')
+    ap.add_argument('--result-cache-size',
+                    nargs=1,
+                    default=[1024.0],
+                    type=check_size,
+                    help='Specifies the maximum size (in MiB) of the '
+                         '--result-cache. Default is 1024.')
+    ap.add_argument('--result-cache-age',
+                    nargs=1,
+                    default=[30.0],
+                    type=check_seconds,
+                    help='Specifies the time (in days) after which an unused '
+                         'result is removed from the --result-cache. Default '
+                         'is 30.')
+    ap.add_argument('--transcription',
+                    nargs=1,
+                    choices=sorted(gt.TRANSCRIPTIONS),
+                    default=['shooting'],
+                    help='Specifies how the optimal control problem is '
+                         'transcribed to the NLP: multiple shooting with '
+                         'an adaptive ODE integrator (shooting) or direct '
+                         'collocation (collocation). Collocation solves much '
+                         'faster and its solvers can be compiled by '
+                         '--compile-solvers, but from the default initial '
+                         'guess it may converge to a different local optimum. '
+                         'Default is shooting.')
+
+    def check_threads(x):
+        if x == 'auto':
+            return x
+        try:
+            x = int(x)
+            if x <= 0:
+                raise ValueError()
+            return x
+        except ValueError:
+            raise argparse.ArgumentTypeError('Number of threads must be auto '
+                                             'or an integer greater than 0.')
+    ap.add_argument('--intra-task-threads',
+                    nargs=1,
+                    default=[1],
+                    type=check_threads,
+                    help='Specifies the number of threads evaluating the '
+                         'shooting intervals of one computation (shooting '
+                         'transcription only), auto for the CPUs not taken '
+                         'by --processes. Limited so that --processes times '
+                         'the threads do not exceed the number of CPUs. '
+                         'Default is 1.')
+
+    def check_delay(x):
+        try:
+            x = float(x)
+            if x < 0:
+                raise ValueError()
+            return x
+        except ValueError:
+            raise argparse.ArgumentTypeError('Delay must be a number of at '
+                                             'least 0.')
+    ap.add_argument('--solver-stub',
+                    nargs=1,
+                    type=check_delay,
+                    help='If specified, the solver is replaced by a stub '
+                         'which waits the given number of seconds and '
+                         'returns a straight line profile, for measuring the '
+                         'overhead of the server (see loadgen.py).')
+    ap.add_argument('--continuation',
+                    nargs=1,
+                    type=check_coarse,
+                    help='If specified, computations without a better '
+                         'initial guess (from --solution-store or '
+                         '--surrogate) are solved on a coarse grid with the '
+                         'given number of shooting intervals first and the '
+                         'solution is refined onto finer and finer grids '
+                         '(see --continuation-factor) up to the requested '
+                         'number of shooting intervals, each solved starting '
+                         'from the previous solution.')
+    ap.add_argument('--continuation-factor',
+                    nargs=1,
+                    default=[2],
+                    type=check_factor,
+                    help='Specifies how many times finer each grid of '
+                         '--continuation is than the previous one. Must be '
+                         'at least 2. Default is 2.')
+    ap.add_argument('--continuation-tol',
+                    nargs=1,
+                    type=check_difference,
+                    help='If specified together with --continuation, the '
+                         'refinement stops as soon as the trajectories on two '
+                         'consecutive grids differ by less than the given '
+                         'relative tolerance (e.g. 0.001); the result then '
+                         'has the resolution of the finer of the two grids.')
+    ap.add_argument('--multi-start',
+                    nargs=1,
+                    default=[1],
+                    type=check_starts,
+                    help='Specifies the number of initial guesses every task '
+                         'is computed from concurrently (at most {}). See '
+                         'information about server modes. Default is 1.'
+                         .format(len(gt.START_GUESSES)))
+    ap.add_argument('--multi-start-policy',
+                    nargs=1,
+                    choices=rc.POLICIES,
+                    default=['first'],
+                    help='Specifies which computation of --multi-start wins: '
+                         'the first converged one (first) or the converged '
+                         'one with the best objective (best). Default is '
+                         'first.')
     args = ap.parse_args()
+    worker_config = dict()
+    for key in ['solver_cache', 'solution_store', 'surrogate', 'continuation',
+                'continuation_tol', 'result_cache', 'deadline']:
+        value = getattr(args, key)
+        worker_config[key] = None if value is None else value[0]
+    worker_config['compile_solvers'] = args.compile_solvers
+    worker_config['polish'] = args.polish
+    worker_config['continuation_factor'] = args.continuation_factor[0]
+    worker_config['transcription'] = args.transcription[0]
+    worker_config['solver_stub'] = None if args.solver_stub is None else \
+        args.solver_stub[0]
+    worker_config['intra_task_threads'] = intra_task_threads(
+        args.intra_task_threads[0],
+        1 if args.mode[0] in ['server-sync', 'direct'] else
+        args.processes[0])
+    worker_config['multi_start'] = args.multi_start[0]
+    worker_config['multi_start_policy'] = args.multi_start_policy[0]
+    worker_config['result_cache_size'] = int(args.result_cache_size[0] *
+                                             2 ** 20)
+    worker_config['result_cache_age'] = args.result_cache_age[0] * 86400
+    if args.resample_altitude is not None:
+        resample = {'altitude': args.resample_altitude}
+    elif args.resample_time is not None:
+        resample = {'time': args.resample_time}
+    elif args.resample_tol is not None:
+        resample = {'tolerance': args.resample_tol[0]}
+    else:
+        resample = None
+    if args.tables is None:
+        tables = None
+    else:
+        tables = args.tables or True
+    output_defaults = {'resample': resample,
+                       'tables': tables,
+                       'table_points': args.table_points[0]}
+    raw_format = args.raw_format[0]
     if args.mode[0] in ['server-sync', 'server-async']:
-        run(async=args.mode[0] == 'server-async',
+        run(asynchronous=args.mode[0] == 'server-async',
             directory=args.target[0],
             indent=args.indent,
             store_logs=args.write_computation_log,
-            write_raw_data=args.write_raw_data)
+            write_raw_data=args.write_raw_data,
+            worker_config=worker_config,
+            poll_interval=args.poll_interval[0],
+            processes=args.processes[0],
+            task_timeout=args.task_timeout[0],
+            stats_file=None if args.stats_file is None else
+            args.stats_file[0],
+            write_progress=args.write_progress,
+            archive=None if args.archive is None else args.archive[0],
+            archive_age=args.archive_age[0],
+            socket_address=None if args.socket is None else args.socket[0],
+            raw_format=raw_format,
+            output_defaults=output_defaults)
     elif args.mode[0] == 'direct':
         if args.output is None:
             output = None
@@ -364,7 +1524,30 @@ def main():
                 indent=args.indent,
                 store_logs=args.write_computation_log,
                 write_raw_data=args.write_raw_data,
-                postprocess_command=postprocess)
+                postprocess_command=postprocess,
+                worker_config=worker_config,
+                write_progress=args.write_progress and output is not None,
+                raw_format=raw_format,
+                output_defaults=output_defaults)
+    elif args.mode[0] == 'precompute':
+        if args.output is None:
+            ap.error('--output is required in precompute mode')
+        precompute(specfile=args.target[0],
+                   outfile=args.output[0],
+                   processes=args.processes[0],
+                   worker_config=worker_config)
+    elif args.mode[0] == 'batch':
+        if args.output is None:
+            ap.error('--output is required in batch mode')
+        batch(target=args.target[0],
+              outfile=args.output[0],
+              processes=args.processes[0],
+              kos_output=None if args.kos_output is None else
+              args.kos_output[0],
+              indent=args.indent,
+              task_timeout=args.task_timeout[0],
+              worker_config=worker_config,
+              output_defaults=output_defaults)
 
 
 if __name__ == '__main__':
@@ -11,58 +11,212 @@ _value_type_code = ''
 _lex_entries = 'entries'
 _list_items = 'items'
 
+# numpy dtype kinds written by the array fast path and produced by the decoder
+_numeric_kinds = 'iuf'
 
-def load(fp, parse_float=None, parse_int=None, parse_constant=None, **kw):
-    return js.load(fp,
-                   object_hook=_load_raw,
+
+def load(fp, parse_float=None, parse_int=None, parse_constant=None,
+         numeric_arrays=True, **kw):
+    """Loads kOS-JSON data from a file.
+
+    :param numeric_arrays: if ``True``, non-empty ListValues containing only
+        numbers are returned as NumPy arrays instead of lists
+    """
+    raw = js.load(fp,
+                  parse_float=parse_float,
+                  parse_int=parse_int,
+                  parse_constant=parse_constant,
+                  **kw)
+    return _from_raw(raw, numeric_arrays)
+
+
+def loads(s, parse_float=None, parse_int=None, parse_constant=None,
+          numeric_arrays=True, **kw):
+    """Like :func:`load` but loads the data from a string."""
+    raw = js.loads(s,
                    parse_float=parse_float,
                    parse_int=parse_int,
                    parse_constant=parse_constant,
                    **kw)
-
-
-def _load_raw(raw):
-    if _is_lex(raw):
-        return _load_lex(raw)
-    elif _is_list(raw):
-        return _load_list(raw)
+    return _from_raw(raw, numeric_arrays)
+
+
+def _from_raw(raw, numeric_arrays):
+    if isinstance(raw, dict):
+        raw_type = raw.get(_type_str, _value_type_code)
+        if raw_type == _lex_type_code:
+            return _load_lex(raw, numeric_arrays)
+        elif raw_type == _list_type_code:
+            return _load_list(raw, numeric_arrays)
+        return {key: _from_raw(value, numeric_arrays)
+                for key, value in raw.items()}
+    elif isinstance(raw, list):
+        return [_from_raw(item, numeric_arrays) for item in raw]
     else:
         return raw
 
 
-def _load_lex(lex_raw):
+def _load_lex(lex_raw, numeric_arrays):
     assert _lex_entries in lex_raw
     entries = lex_raw[_lex_entries]
     assert len(entries) % 2 == 0
     res = dict()
     for key, value in zip(entries[0::2], entries[1::2]):
-        res[key] = _load_raw(value)
+        res[key] = _from_raw(value, numeric_arrays)
     return res
 
 
-def _load_list(list_raw):
+def _load_list(list_raw, numeric_arrays):
     assert _list_items in list_raw
     items = list_raw[_list_items]
-    res = list()
-    for item in items:
-        res.append(_load_raw(item))
-    return res
+    if (numeric_arrays and items and
+            all(type(item) in (int, float) for item in items)):
+        arr = np.array(items)
+        if arr.dtype.kind in _numeric_kinds:
+            return arr
+    return [_from_raw(item, numeric_arrays) for item in items]
 
 
 def dump(data, fp, skipkeys=False, ensure_ascii=True, check_circular=True,
          allow_nan=True, cls=None, indent=None, separators=None, default=None,
          sort_keys=False, **kw):
-    js.dump(_to_raw(data), fp,
-            skipkeys=skipkeys,
-            ensure_ascii=ensure_ascii,
-            check_circular=check_circular,
-            allow_nan=allow_nan,
-            cls=cls,
-            indent=indent,
-            separators=separators,
-            default=default,
-            sort_keys=sort_keys,
-            **kw)
+    """Writes the data to a file in kOS-JSON format.
+
+    The arguments have the same meaning as for ``json.dump``. The data are
+    streamed to the file; one-dimensional numeric NumPy arrays are written in
+    a single pass without building the intermediate kOS structures. If
+    ``cls`` or ``default`` is given, the data are converted to the kOS
+    structures first and written by ``json.dump``.
+    """
+    if cls is not None or default is not None or kw:
+        js.dump(_to_raw(data), fp,
+                skipkeys=skipkeys,
+                ensure_ascii=ensure_ascii,
+                check_circular=check_circular,
+                allow_nan=allow_nan,
+                cls=cls,
+                indent=indent,
+                separators=separators,
+                default=default,
+                sort_keys=sort_keys,
+                **kw)
+        return
+    _Writer(fp, ensure_ascii, allow_nan, indent, separators, sort_keys,
+            skipkeys).write(data)
+
+
+def dumps(data, **kw):
+    """Like :func:`dump` but returns the data as a string."""
+    chunks = []
+
+    class _Chunks(object):
+        write = chunks.append
+
+    dump(data, _Chunks(), **kw)
+    return ''.join(chunks)
+
+
+class _Writer(object):
+    """Streaming kOS-JSON writer producing the same output as ``json.dump``
+    of the converted kOS structures.
+    """
+
+    def __init__(self, fp, ensure_ascii, allow_nan, indent, separators,
+                 sort_keys, skipkeys):
+        self.write_str = fp.write
+        self.ensure_ascii = ensure_ascii
+        self.allow_nan = allow_nan
+        if isinstance(indent, int):
+            indent = ' ' * indent
+        self.indent = indent
+        if separators is None:
+            separators = (', ', ': ') if indent is None else (',', ': ')
+        self.item_sep, self.key_sep = separators
+        self.sort_keys = sort_keys
+        self.skipkeys = skipkeys
+
+    def _scalar(self, value):
+        if isinstance(value, np.generic):
+            value = value.item()
+        return js.dumps(value, ensure_ascii=self.ensure_ascii,
+                        allow_nan=self.allow_nan)
+
+    def _newline(self, level):
+        if self.indent is None:
+            return ''
+        return '\n' + self.indent * level
+
+    def write(self, data):
+        self._write(data, 0)
+
+    def _write(self, data, level):
+        if isinstance(data, dict):
+            entries = []
+            for key, value in data.items():
+                if not isinstance(key, str):
+                    if self.skipkeys:
+                        continue
+                    raise TypeError('Lexicon keys must be strings, not '
+                                    '{}'.format(type(key).__name__))
+                entries.append(key)
+                entries.append(value)
+            self._structure(_lex_entries, entries, _lex_type_code, level)
+        elif isinstance(data, np.ndarray) and data.ndim == 0:
+            self.write_str(self._scalar(data))
+        elif isinstance(data, (list, tuple, np.ndarray)):
+            self._structure(_list_items, data, _list_type_code, level)
+        else:
+            self.write_str(self._scalar(data))
+
+    def _structure(self, key, items, type_code, level):
+        """Writes a kOS structure, i.e. an object with the type and the list
+        of items (or entries).
+        """
+        w = self.write_str
+        members = [(key, items), (_type_str, type_code)]
+        if self.sort_keys:
+            members.sort()
+        w('{')
+        for i, (name, value) in enumerate(members):
+            if i > 0:
+                w(self.item_sep)
+            w(self._newline(level + 1))
+            w(self._scalar(name))
+            w(self.key_sep)
+            if name == _type_str:
+                w(self._scalar(value))
+            else:
+                self._items(value, level + 1)
+        w(self._newline(level))
+        w('}')
+
+    def _items(self, items, level):
+        w = self.write_str
+        if len(items) == 0:
+            w('[]')
+            return
+        if (isinstance(items, np.ndarray) and items.ndim == 1 and
+                items.dtype.kind in _numeric_kinds):
+            values = items.tolist()
+            if self.indent is None:
+                w(js.dumps(values, allow_nan=self.allow_nan,
+                           separators=(self.item_sep, self.key_sep)))
+            else:
+                sep = self.item_sep + self._newline(level + 1)
+                w('[')
+                w(self._newline(level + 1))
+                w(sep.join(self._scalar(v) for v in values))
+                w(self._newline(level))
+                w(']')
+            return
+        w('[')
+        for i, item in enumerate(items):
+            if i > 0:
+                w(self.item_sep)
+            w(self._newline(level + 1))
+            self._write(item, level + 1)
+        w(self._newline(level))
+        w(']')
 
 
 def _to_raw(data):
@@ -93,21 +247,3 @@ def _to_list(data):
     """
     return {_list_items: list(map(_to_raw, data)),
             _type_str: _list_type_code}
-
-
-def _get_type(raw):
-    """
-    :type raw: dict
-    """
-    try:
-        return raw.get(_type_str, _value_type_code)
-    except AttributeError:
-        return _value_type_code
-
-
-def _is_lex(raw):
-    return _get_type(raw) == _lex_type_code
-
-
-def _is_list(raw):
-    return _get_type(raw) == _list_type_code
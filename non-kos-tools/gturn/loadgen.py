@@ -0,0 +1,331 @@
+# ----------------------------------------------------------------
+# Load generator and latency benchmark of the server modes
+# ----------------------------------------------------------------
+import argparse
+import json
+import logging
+import os
+import os.path as pth
+import signal
+import subprocess
+import sys
+import tempfile
+import textwrap
+import time
+
+import numpy as np
+
+import _metrics as mt
+import bench
+import koson as ks
+
+HERE = pth.dirname(pth.abspath(__file__))
+
+# Percentiles of the latency reported for every configuration
+PERCENTILES = (50, 95, 99)
+
+
+def submit(tasks, name, data):
+    """Creates a task dir the way kOS does: the input.json is written under
+    input.lock, which is removed afterwards.
+
+    :return: the time (monotonic) the task became ready
+    """
+    task_dir = pth.join(tasks, name)
+    os.makedirs(task_dir)
+    lock = pth.join(task_dir, 'input.lock')
+    with open(lock, mode='w') as f:
+        f.write('')
+    with open(pth.join(task_dir, 'input.json'), mode='w') as f:
+        ks.dump(data, f)
+    os.unlink(lock)
+    return time.monotonic()
+
+
+def finished(task_dir):
+    """Tells whether the output.json of a task is complete (it exists and the
+    output.lock does not)."""
+    return (pth.isfile(pth.join(task_dir, 'output.json')) and
+            not pth.isfile(pth.join(task_dir, 'output.lock')))
+
+
+def failed(task_dir):
+    with open(pth.join(task_dir, 'output.json'), mode='r') as f:
+        return 'error' in ks.load(f)
+
+
+def wait_finished(task_dir, deadline, server):
+    while not finished(task_dir):
+        if server.poll() is not None or time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def start_server(tmp, mode, processes, options, warmup, timeout):
+    """Starts a server with a master directory in the temporary directory
+    and waits until it has computed a warm-up task (so that the solver is
+    built before the measurement).
+
+    :return: tuple of the server process, the master directory and the
+        stats file of the server
+    """
+    tasks = pth.join(tmp, 'tasks')
+    os.makedirs(tasks)
+    stats = pth.join(tmp, 'stats.json')
+    cmd = [sys.executable, pth.join(HERE, 'gturn.py'),
+           '-m', mode, '-t', tasks, '-p', str(processes),
+           '--stats-file', stats] + options
+    with open(pth.join(tmp, 'server.log'), mode='w') as log:
+        server = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT)
+    submit(tasks, 'warmup', warmup)
+    if not wait_finished(pth.join(tasks, 'warmup'),
+                         time.monotonic() + timeout, server):
+        server.kill()
+        server.wait()
+        raise RuntimeError('The server did not start, see {}'.format(
+            pth.join(tmp, 'server.log')))
+    return server, tasks, stats
+
+
+def stop_server(server):
+    server.send_signal(signal.SIGINT)
+    try:
+        server.wait(10)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+def arrivals(n, rate, process, rng):
+    """Returns the submission times (s since the start) of n tasks at the
+    given mean rate (tasks per second); ``None`` submits all at once."""
+    if rate is None:
+        return np.zeros(n)
+    if process == 'poisson':
+        gaps = rng.exponential(1.0 / rate, n)
+        gaps[0] = 0.0
+        return np.cumsum(gaps)
+    return np.arange(n) / rate
+
+
+def generate(tasks, server, inputs, times, timeout):
+    """Submits the tasks at the given times and waits for their outputs.
+
+    :param inputs: list of the input data of the tasks
+    :return: tuple of the list of the latencies (s) of the finished tasks,
+        the number of failed tasks, the number of lost (not finished) tasks
+        and the time span (s) from the first submission to the last output
+    """
+    pending = dict()
+    latencies = []
+    errors = 0
+    start = time.monotonic()
+    last = start
+    n = 0
+    deadline = None
+    while n < len(inputs) or pending:
+        now = time.monotonic()
+        while n < len(inputs) and now - start >= times[n]:
+            name = 'load-{}'.format(n)
+            pending[name] = submit(tasks, name, inputs[n])
+            n += 1
+            now = time.monotonic()
+        for name in list(pending):
+            task_dir = pth.join(tasks, name)
+            if finished(task_dir):
+                last = time.monotonic()
+                latencies.append(last - pending.pop(name))
+                if failed(task_dir):
+                    errors += 1
+        if n == len(inputs) and deadline is None:
+            deadline = now + timeout
+        if (deadline is not None and now > deadline or
+                server.poll() is not None):
+            break
+        time.sleep(0.002)
+    return latencies, errors, len(pending), last - start
+
+
+def run_config(mode, processes, options, inputs, times, timeout):
+    """Measures one configuration of the server.
+
+    :return: dictionary of the results
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        server, tasks, stats = start_server(tmp, mode, processes, options,
+                                            inputs[0], timeout)
+        try:
+            latencies, errors, lost, span = generate(tasks, server, inputs,
+                                                     times, timeout)
+        finally:
+            stop_server(server)
+        res = {'mode': mode,
+               'processes': processes,
+               'submitted': len(inputs),
+               'finished': len(latencies),
+               'errors': errors,
+               'lost': lost,
+               'throughput': len(latencies) / span if span > 0 else 0.0}
+        if latencies:
+            arr = np.array(latencies)
+            for p, v in zip(PERCENTILES, np.percentile(arr, PERCENTILES)):
+                res['p{}'.format(p)] = float(v)
+            res['mean'] = float(arr.mean())
+            res['max'] = float(arr.max())
+        if pth.isfile(stats):
+            with open(stats, mode='r') as f:
+                # the server side breakdown (queue_wait, serialization, ...)
+                res['server'] = {key: value['p50'] for key, value in
+                                 json.load(f)['metrics'].items()}
+    return res
+
+
+def parse_mix(text):
+    """Parses the mix of the vehicle profiles, e.g. ``light:3,heavy:1``.
+
+    :return: tuple of the list of the profiles and of their probabilities
+    """
+    names = []
+    weights = []
+    for item in text.split(','):
+        name, _, weight = item.partition(':')
+        if name not in bench.PROFILES:
+            raise argparse.ArgumentTypeError('Unknown profile {}.'.format(
+                name))
+        try:
+            weight = float(weight or 1.0)
+            if weight <= 0:
+                raise ValueError()
+        except ValueError:
+            raise argparse.ArgumentTypeError('Weight of {} must be a number '
+                                             'greater than 0.'.format(name))
+        names.append(name)
+        weights.append(weight)
+    weights = np.array(weights)
+    return names, weights / weights.sum()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    epilog = '''
+    Stands in for kOS: for every mode and number of --processes, starts a
+    server with a master directory in a temporary directory, waits until it
+    computes a warm-up task and then creates --tasks task dirs (input.json
+    written under input.lock) at --rate tasks per second, with the vehicle
+    profiles drawn from --mix. A task finishes when its output.json exists and
+    output.lock does not; its latency is the time from the removal of
+    input.lock until then. Prints the throughput (finished tasks per second
+    from the first submission to the last output) and the percentiles of the
+    latency of every configuration; -o writes them as JSON together with the
+    medians of the metrics reported by the server (see --stats-file of
+    gturn.py).
+
+    With --stub, the server replaces the solver by a stub (see --solver-stub
+    of gturn.py) which takes the given time, so the overhead of the server
+    (scanning, scheduling, writing the output) is measured without IPOPT.
+    server-sync ignores --processes and is measured once.
+    '''
+    ap = argparse.ArgumentParser(prog='loadgen.py',
+                                 description='Load generator of the gturn '
+                                             'server modes.',
+                                 epilog=textwrap.dedent(epilog),
+                                 formatter_class=argparse.RawTextHelpFormatter)
+    ap.add_argument('--modes',
+                    nargs='+',
+                    choices=['server-sync', 'server-async'],
+                    default=['server-sync', 'server-async'],
+                    help='Modes of the server. Default is both.')
+    ap.add_argument('-p', '--processes',
+                    nargs='+',
+                    type=int,
+                    default=[1, 2, 4],
+                    help='Numbers of worker processes of server-async. '
+                         'Default is 1 2 4.')
+    ap.add_argument('--tasks',
+                    type=int,
+                    default=50,
+                    help='Number of tasks per configuration. Default is 50.')
+    ap.add_argument('--rate',
+                    type=float,
+                    help='Mean rate of the tasks (tasks per second). Default '
+                         'is all the tasks at once.')
+    ap.add_argument('--arrivals',
+                    choices=['poisson', 'uniform'],
+                    default='poisson',
+                    help='Process of the arrivals of the tasks at --rate. '
+                         'Default is poisson.')
+    ap.add_argument('--mix',
+                    type=parse_mix,
+                    default=parse_mix('light'),
+                    help='Vehicle profiles of the tasks with their relative '
+                         'weights, e.g. light:3,heavy:1. Default is light.')
+    ap.add_argument('-n', '--shooting-intervals',
+                    type=int,
+                    default=50,
+                    help='Number of intervals of the tasks. Default is 50.')
+    ap.add_argument('--stub',
+                    metavar='DELAY',
+                    type=float,
+                    help='Replace the solver by a stub taking DELAY seconds.')
+    ap.add_argument('--transcription',
+                    default='collocation',
+                    help='Transcription used by the server. Default is '
+                         'collocation.')
+    ap.add_argument('--seed',
+                    type=int,
+                    default=0,
+                    help='Seed of the random arrivals and mix. Default is 0.')
+    ap.add_argument('--timeout',
+                    type=float,
+                    default=600.0,
+                    help='Time (s) to wait for the outputs after the last '
+                         'task is submitted. Default is 600.')
+    ap.add_argument('-o', '--output',
+                    help='File to write the results to (JSON).')
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    names, weights = args.mix
+    inputs = [dict(bench.PROFILES[name], N=args.shooting_intervals)
+              for name in rng.choice(names, size=args.tasks, p=weights)]
+    times = arrivals(args.tasks, args.rate, args.arrivals, rng)
+    options = ['--transcription', args.transcription,
+               '--poll-interval', '1']
+    if args.stub is not None:
+        options += ['--solver-stub', str(args.stub)]
+
+    configs = []
+    for mode in args.modes:
+        for processes in (args.processes if mode == 'server-async' else [1]):
+            configs.append((mode, processes))
+    results = []
+    print('{:<13} {:>3} {:>9} {:>6} {:>6} {:>10} {:>9} {:>9} {:>9}'.format(
+        'mode', 'p', 'finished', 'errors', 'lost', 'tasks/s', 'p50', 'p95',
+        'p99'))
+    for mode, processes in configs:
+        logging.info('Measuring %s with %d processes', mode, processes)
+        res = run_config(mode, processes, options, inputs, times,
+                         args.timeout)
+        results.append(res)
+        print('{:<13} {:>3} {:>9} {:>6} {:>6} {:>10.3f} {:>9.4f} {:>9.4f} '
+              '{:>9.4f}'.format(mode, processes, res['finished'],
+                                res['errors'], res['lost'],
+                                res['throughput'], res.get('p50', np.nan),
+                                res.get('p95', np.nan),
+                                res.get('p99', np.nan)))
+    if args.output is not None:
+        mt.write_json(args.output, {'tasks': args.tasks,
+                                    'rate': args.rate,
+                                    'arrivals': args.arrivals,
+                                    'mix': dict(zip(names, weights.tolist())),
+                                    'N': args.shooting_intervals,
+                                    'stub': args.stub,
+                                    'transcription': args.transcription,
+                                    'results': results})
+    if any(res['lost'] or res['errors'] for res in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+# ----------------------------------------------------------------
+# Loopback test of the socket endpoint of the gravity turn server
+# ----------------------------------------------------------------
+import argparse
+import logging
+import os
+import os.path as pth
+import signal
+import subprocess
+import sys
+import tempfile
+import textwrap
+import time
+
+import numpy as np
+
+import bench
+import client as cl
+import koson as ks
+
+HERE = pth.dirname(pth.abspath(__file__))
+
+
+def start_server(tmp, address, processes, transcription, timeout):
+    """Starts a server in async mode with a master directory and a result
+    cache in the temporary directory and waits until it accepts
+    connections."""
+    tasks = pth.join(tmp, 'tasks')
+    os.makedirs(tasks)
+    cmd = [sys.executable, pth.join(HERE, 'gturn.py'),
+           '-m', 'server-async', '-t', tasks, '-p', str(processes),
+           '--socket', address, '--transcription', transcription,
+           '--result-cache', pth.join(tmp, 'results')]
+    with open(pth.join(tmp, 'server.log'), mode='w') as log:
+        server = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            cl.Client(address).close()
+            return server, tasks
+        except OSError:
+            if server.poll() is not None or time.monotonic() > deadline:
+                server.kill()
+                raise RuntimeError('The server did not start, see {}'.format(
+                    pth.join(tmp, 'server.log')))
+            time.sleep(0.1)
+
+
+def check_result(result, N):
+    assert 'error' not in result, result.get('error')
+    for key in ('time', 'mass', 'speed', 'altitude', 'control',
+                'body_curvature', 'vertical_angle'):
+        assert len(result[key]) == N + 1, key
+
+
+def run_checks(address, tasks, inputs, N, timeout):
+    """Runs the checks against the server.
+
+    :return: dictionary of the round-trip times (s) of the requests
+    """
+    times = dict()
+    with cl.Client(address, timeout=timeout) as client:
+        logging.info('Single request')
+        start = time.perf_counter()
+        response = client.request(inputs, metrics=True)
+        times['first'] = time.perf_counter() - start
+        check_result(response, N)
+        assert response['metrics']['strategy'] != 'cache'
+
+        logging.info('Repeated request (result cache)')
+        start = time.perf_counter()
+        cached = client.request(inputs, metrics=True)
+        times['cached'] = time.perf_counter() - start
+        check_result(cached, N)
+        assert cached['metrics']['strategy'] == 'cache', \
+            cached['metrics']['strategy']
+        assert np.allclose(cached['altitude'], response['altitude'])
+
+        logging.info('Pipelined requests')
+        variants = [dict(inputs, m0=inputs['m0'] * (1.0 + 0.01 * i))
+                    for i in range(1, 4)]
+        start = time.perf_counter()
+        ids = {client.send(data) for data in variants}
+        received = set()
+        for _ in variants:
+            reply = client.receive()
+            check_result(reply, N)
+            received.add(reply['id'])
+        times['pipelined'] = time.perf_counter() - start
+        assert received == ids, (received, ids)
+
+        logging.info('Invalid request')
+        client.sock.sendall(b'{"not json\n')
+        reply = client.receive()
+        assert 'error' in reply and 'id' not in reply, reply
+
+    logging.info('Same result through the task dirs')
+    data = dict(inputs, m0=inputs['m0'] * 0.99)
+    with cl.Client(address, timeout=timeout) as client:
+        via_socket = client.request(data)
+    task_dir = pth.join(tasks, 'loopback')
+    os.makedirs(task_dir)
+    with open(pth.join(task_dir, 'input.json'), mode='w') as f:
+        ks.dump(data, f)
+    output = pth.join(task_dir, 'output.json')
+    deadline = time.monotonic() + timeout
+    while not pth.isfile(output) or pth.isfile(pth.join(task_dir,
+                                                        'output.lock')):
+        assert time.monotonic() < deadline, 'no output.json'
+        time.sleep(0.05)
+    with open(output, mode='r') as f:
+        via_files = ks.load(f)
+    for key in via_files:
+        assert np.allclose(via_files[key], via_socket[key]), key
+    return times
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    epilog = '''
+    Starts a server (server-async mode with --socket and --result-cache) in a
+    temporary directory and checks the socket endpoint with the reference
+    client: a single request, a repeated request answered from the result
+    cache, pipelined requests, an invalid request and the equality of the
+    results returned through the socket and through a task dir (which share
+    the result cache). Prints the round-trip times and exits with status 1 if
+    any check fails.
+    '''
+    ap = argparse.ArgumentParser(prog='loopback.py',
+                                 description='Loopback test of the socket '
+                                             'endpoint of gturn.',
+                                 epilog=textwrap.dedent(epilog),
+                                 formatter_class=argparse.RawTextHelpFormatter)
+    ap.add_argument('--tcp',
+                    metavar='PORT',
+                    type=int,
+                    help='Use TCP on localhost at the given port instead of a '
+                         'Unix socket.')
+    ap.add_argument('-n', '--shooting-intervals',
+                    type=int,
+                    default=20,
+                    help='Number of intervals of the requests. Default is 20.')
+    ap.add_argument('--profile',
+                    choices=sorted(bench.PROFILES),
+                    default='light',
+                    help='Vehicle profile of the requests. Default is light.')
+    ap.add_argument('--transcription',
+                    default='collocation',
+                    help='Transcription used by the server. Default is '
+                         'collocation.')
+    ap.add_argument('-p', '--processes',
+                    type=int,
+                    default=2,
+                    help='Number of worker processes. Default is 2.')
+    ap.add_argument('--timeout',
+                    type=float,
+                    default=300.0,
+                    help='Timeout (s) of every check. Default is 300.')
+    args = ap.parse_args()
+
+    N = args.shooting_intervals
+    inputs = dict(bench.PROFILES[args.profile], N=N)
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.tcp is None:
+            address = pth.join(tmp, 'gturn.sock')
+        else:
+            address = 'localhost:{}'.format(args.tcp)
+        server, tasks = start_server(tmp, address, args.processes,
+                                     args.transcription, args.timeout)
+        try:
+            times = run_checks(address, tasks, inputs, N, args.timeout)
+        except (AssertionError, OSError, ValueError) as e:
+            logging.error('Loopback test failed: %r', e)
+            with open(pth.join(tmp, 'server.log'), mode='r') as f:
+                sys.stderr.write(f.read()[-4000:])
+            sys.exit(1)
+        finally:
+            server.send_signal(signal.SIGINT)
+            try:
+                server.wait(10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+                server.wait()
+    for key, value in times.items():
+        print('{:<10} {:>9.4f} s'.format(key, value))
+    logging.info('Loopback test passed (%s).', address)
+
+
+if __name__ == '__main__':
+    main()